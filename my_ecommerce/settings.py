@@ -63,17 +63,20 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that its latency covers the whole stack
+    'shop.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.routing.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'shop.authentication.ShopJWTAuthentication',
     ),
 }
 
@@ -82,6 +85,11 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer',),
 }
+
+# Users resolved by JWT authentication are reused for this long without a query
+JWT_USER_CACHE = {
+    'USER_CACHE_TTL': 60,
+}
 ROOT_URLCONF = 'my_ecommerce.urls'
 
 TEMPLATES = [
@@ -105,13 +113,134 @@ WSGI_APPLICATION = 'my_ecommerce.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
 
+# SQLite tuned for concurrent requests; DJANGO_SQLITE_PROFILE=basic restores
+# the stock configuration (compare both with `manage.py benchmark sqlite_profiles`).
+#   * WAL lets readers run while a transaction writes; with it, synchronous=NORMAL
+#     only risks the last commits on power loss, not on application crashes.
+#   * busy_timeout (ms) makes a blocked writer wait instead of failing with
+#     "database is locked"; mmap_size and cache_size keep hot pages in memory.
+#   * transaction_mode IMMEDIATE: atomic blocks (checkout) take the write lock at
+#     BEGIN, so concurrent read-then-write transactions queue up on busy_timeout
+#     instead of failing when upgrading their read lock.
+#   * CONN_MAX_AGE stays 0: under ASGI every sync_to_async executor thread
+#     keeps its own persistent connection, and request_finished never closes
+#     them, so a non-zero age leaks one open connection (and file handle) per
+#     thread. Opening a SQLite connection is cheap; the pragmas run on each.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # negative: KiB
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRODUCTION = {
+    'CONN_MAX_AGE': 0,
+    'OPTIONS': {
+        'transaction_mode': 'IMMEDIATE',
+        'init_command': ';'.join(f'PRAGMA {name}={value}' for name, value in SQLITE_PRAGMAS.items()),
+    },
+}
+
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        **(SQLITE_PRODUCTION if os.environ.get('DJANGO_SQLITE_PROFILE', 'production') == 'production' else {}),
+    }
+}
+
+# Read replicas, e.g. DJANGO_READ_REPLICAS=/srv/replica1.sqlite3,/srv/replica2.sqlite3
+# (kept in sync by the replication tool; tests use the primary instead)
+for _index, _name in enumerate(filter(None, os.environ.get('DJANGO_READ_REPLICAS', '').split(',')), 1):
+    DATABASES[f'replica_{_index}'] = {**DATABASES['default'], 'NAME': _name, 'TEST': {'MIRROR': 'default'}}
+
+# Safe-method requests read from a replica; clients that wrote read from the
+# primary for PIN_SECONDS (see shop/routing.py). No replicas: everything uses 'default'.
+DATABASE_ROUTERS = ['shop.routing.ReadReplicaRouter']
+DATABASE_ROUTING = {
+    'REPLICAS': None,
+    'PIN_SECONDS': 5,
+}
+
+
+# Caches
+# https://docs.djangoproject.com/en/6.0/topics/cache/
+# Local memory by default; point 'default' at Redis/Memcached when running
+# several processes so the catalog cache versions are shared between them.
+# Product list ETags only use those versions when the backend is shared.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            # Room for the catalog cache's payloads and version tokens
+            'MAX_ENTRIES': 10000,
+        },
     }
 }
 
+# Read-through cache for product payloads (see shop/cache.py)
+CATALOG_CACHE = {
+    'ENABLED': True,
+    'BACKEND': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAX_ENTRIES': 1024,
+}
+
+# Full-text search (see shop/search.py): None ranks every match by relevance;
+# a number ranks only that many of the newest matches per query, trading exact
+# results for speed on common words (responses then report `truncated`)
+SEARCH = {
+    'MAX_RANKED_CANDIDATES': None,
+}
+
+# Discount index (see shop/pricing.py). Saving a discount makes other processes
+# reload it through a version token in the 'default' cache; with a per-process
+# backend such as LocMemCache they reload every RELOAD_INTERVAL seconds instead.
+PRICING = {
+    'RELOAD_INTERVAL': 5,
+}
+
+# Product image derivatives (see shop/images.py)
+IMAGE_PIPELINE = {
+    'ASYNC': True,
+    'WORKERS': None,
+}
+
+# Cart line storage (see shop/services/cart.py); CacheCartStore keeps lines in
+# the cache and writes them to the database when the cart is read or checked out
+CART_STORE = {
+    'BACKEND': 'shop.services.cart.DatabaseCartStore',
+    'CACHE': 'default',
+    'TIMEOUT': 60 * 60 * 24 * 7,
+    'LOCK_TIMEOUT': 5,
+}
+
+# Idempotency-Key handling for checkout (see shop/services/idempotency.py)
+IDEMPOTENCY = {
+    'TTL': 60 * 60 * 24,
+    'WAIT_TIMEOUT': 10,
+}
+
+# Post-commit side effects, carried out by `manage.py run_outbox_worker`
+# (see shop/services/outbox.py)
+OUTBOX = {
+    'BATCH_SIZE': 100,
+    'CONCURRENCY': 4,
+    'LEASE': 60,
+    'MAX_ATTEMPTS': 10,
+}
+
+# Per-route request metrics at /api/metrics/ and sampled cProfile dumps of
+# slow requests (see shop/metrics.py)
+METRICS = {
+    'ENABLED': True,
+    'PROFILE_SAMPLE_RATE': 0.0,
+    'PROFILE_MIN_DURATION': 0.5,
+    'PROFILE_DIR': None,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
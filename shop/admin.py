@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Shop, Manager, Category, Brand, Product, ProductImage
+from .models import Shop, Manager, Category, Brand, Product, ProductImage, Discount
 
 @admin.register(Shop)
 class ShopAdmin(admin.ModelAdmin):
@@ -20,4 +20,9 @@ class BrandAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'shop', 'price', 'stock', 'status')
\ No newline at end of file
+    list_display = ('name', 'shop', 'price', 'stock', 'status')
+
+@admin.register(Discount)
+class DiscountAdmin(admin.ModelAdmin):
+    list_display = ('name', 'discount_percentage', 'start_date', 'end_date')
+    filter_horizontal = ('products', 'categories')
@@ -0,0 +1,217 @@
+"""
+Async versions of the hot read endpoints, served under /api/async/.
+
+They return the same payloads (and ETags) as their ViewSet counterparts but
+run as coroutines, so under ASGI a request waiting on the database does not
+hold a worker thread. Queries go through the async ORM (aget, aaggregate,
+async for); independent ones -- the discount index and the validators, a
+list page and its facet counts -- are awaited together with asyncio.gather.
+
+Django still executes async ORM calls on a thread (sync_to_async), so a single
+request gains little; the win is in how many concurrent requests one process
+can keep in flight. See `manage.py benchmark async_reads`.
+"""
+import asyncio
+
+from django.db.models import Prefetch
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .authentication import ShopJWTAuthentication
+from .cache import catalog_cache
+from .conditional import content_etag, make_etag, validator_aggregates, validators_row
+from .filters import ProductFilter
+from .metrics import serializing
+from .models import Order, OrderDetail, Product, Shop, ShopOrder
+from .pagination import OrderCursorPagination, ProductCursorPagination
+from .pricing import pricing_engine
+from .serializers import (
+    OrderSerializer, ProductListSerializer, ProductSerializer, ShopSerializer,
+    check_fields, product_list_queryset, requested_fields, trim_fields,
+)
+
+# Must match the validator_fields of the corresponding ViewSets
+PRODUCT_VALIDATOR_FIELDS = ('updated_at', 'shop__updated_at')
+SHOP_VALIDATOR_FIELDS = ('updated_at',)
+ORDER_VALIDATOR_FIELDS = ('updated_at', 'shop_orders__updated_at')
+
+
+def api_view(view):
+    """
+    Wraps an async view taking a DRF Request: renders returned data as JSON and
+    APIExceptions the way DRF's exception handler does.
+    """
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return _render({'detail': f'Method "{request.method}" not allowed.'}, 405, {'Allow': 'GET, HEAD'})
+        drf_request = Request(request)
+        try:
+            return await view(drf_request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return _error_response(drf_request, exc)
+    wrapper.__name__ = view.__name__
+    wrapper.__doc__ = view.__doc__
+    return wrapper
+
+
+@api_view
+async def product_list(request):
+    """Product cards with cursor pagination, filters and facet counts (like GET /api/products/)."""
+    product_filter = ProductFilter(request.query_params)
+    validators = None
+    if catalog_cache.shares_versions:
+        catalog_version, prices = await asyncio.gather(catalog_cache.acatalog_version(), pricing_engine.aindex())
+        validators = make_etag(request, None, [catalog_version, prices.token]), None
+        not_modified = _not_modified(request, validators)
+        if not_modified is not None:
+            return not_modified
+    else:
+        prices = await pricing_engine.aindex()
+
+    context = {'request': request, 'prices': prices}
+
+    async def load():
+        paginator = ProductCursorPagination()
+        page, facets = await asyncio.gather(
+            paginator.apaginate_queryset(product_filter.filter_queryset(product_list_queryset()), request),
+            product_filter.afacet_counts(Product.objects.all()),
+        )
+        with serializing():
+            data = paginator.get_paginated_response(ProductListSerializer(page, many=True, context=context).data).data
+        data['facets'] = facets
+        return data
+
+    data = await catalog_cache.aget_list(f'{request.build_absolute_uri()}|{prices.token}', load)
+    if validators is None:
+        # Same as ProductViewSet.list: per-process versions, so validate the body
+        validators = content_etag(data), None
+        not_modified = _not_modified(request, validators)
+        if not_modified is not None:
+            return not_modified
+    return _render(data, 200, validators=validators)
+
+
+@api_view
+async def product_detail(request, pk):
+    """One product with its images (like GET /api/products/<pk>/)."""
+    prices, row = await asyncio.gather(
+        pricing_engine.aindex(),
+        Product.objects.filter(pk=pk).aaggregate(**validator_aggregates(PRODUCT_VALIDATOR_FIELDS)),
+    )
+    if not row['rows']:
+        raise exceptions.NotFound("No Product matches the given query.")
+    parts, last_modified = validators_row(row, PRODUCT_VALIDATOR_FIELDS)
+    if last_modified is not None:
+        last_modified = max(last_modified, prices.changed_at)
+    validators = make_etag(request, None, [*parts, prices.token]), last_modified
+    not_modified = _not_modified(request, validators)
+    if not_modified is not None:
+        return not_modified
+
+    context = {'request': request, 'prices': prices}
+
+    async def load():
+        try:
+            product = await Product.objects.select_related('shop').prefetch_related('images').aget(pk=pk)
+        except Product.DoesNotExist:
+            raise exceptions.NotFound("No Product matches the given query.")
+        with serializing():
+            return ProductSerializer(product, context={**context, 'sparse': False}).data
+
+    # Shares the ViewSet's cache entries: same key, same full payload
+    data = await catalog_cache.aget_product(str(pk), load, variant=prices.token)
+    requested = requested_fields(context)
+    if requested is not None:
+        check_fields(requested, data)
+        data = trim_fields(data, requested)
+    return _render(data, 200, validators=validators)
+
+
+@api_view
+async def shop_list(request):
+    """All shops (like GET /api/shops/)."""
+    shops = Shop.objects.all()
+    row = await shops.order_by().aaggregate(**validator_aggregates(SHOP_VALIDATOR_FIELDS))
+    parts, last_modified = validators_row(row, SHOP_VALIDATOR_FIELDS)
+    validators = make_etag(request, None, parts), last_modified
+    not_modified = _not_modified(request, validators)
+    if not_modified is not None:
+        return not_modified
+
+    context = {'request': request}
+    serializer = ShopSerializer([shop async for shop in shops], many=True, context=context)
+    with serializing():
+        data = serializer.data
+    return _render(data, 200, validators=validators)
+
+
+@api_view
+async def order_list(request):
+    """The authenticated user's orders, newest first (like GET /api/orders/)."""
+    user = await authenticate(request)
+    orders = Order.objects.filter(user=user)
+    row = await orders.order_by().aaggregate(**validator_aggregates(ORDER_VALIDATOR_FIELDS))
+    parts, last_modified = validators_row(row, ORDER_VALIDATOR_FIELDS)
+    validators = make_etag(request, user.pk, parts), last_modified
+    not_modified = _not_modified(request, validators)
+    if not_modified is not None:
+        return not_modified
+
+    paginator = OrderCursorPagination()
+    page = await paginator.apaginate_queryset(orders.prefetch_related(
+        Prefetch('shop_orders', queryset=ShopOrder.objects.select_related('shop')),
+        Prefetch('shop_orders__items', queryset=OrderDetail.objects.select_related('product')),
+    ), request)
+    with serializing():
+        data = OrderSerializer(page, many=True, context={'request': request}).data
+    return _render(paginator.get_paginated_response(data).data, 200, validators=validators)
+
+
+async def authenticate(request):
+    """The JWT-authenticated user (see ShopJWTAuthentication.aauthenticate)."""
+    result = await ShopJWTAuthentication().aauthenticate(request)
+    if result is None:
+        raise exceptions.NotAuthenticated()
+    request.user, request.auth = result
+    return request.user
+
+
+def _not_modified(request, validators):
+    etag, last_modified = validators
+    response = get_conditional_response(
+        request, etag=etag, last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    if response is not None:
+        _set_validators(response, validators)
+    return response
+
+
+def _render(data, status, headers=None, validators=None):
+    response = HttpResponse(
+        JSONRenderer().render(data), status=status, content_type='application/json', headers=headers
+    )
+    if validators is not None:
+        _set_validators(response, validators)
+    return response
+
+
+def _set_validators(response, validators):
+    etag, last_modified = validators
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+
+
+def _error_response(request, exc):
+    headers = {}
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        # As APIView.handle_exception: 401 with a challenge
+        headers['WWW-Authenticate'] = ShopJWTAuthentication().authenticate_header(request)
+    if getattr(exc, 'wait', None):
+        headers['Retry-After'] = str(int(exc.wait))
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return _render(data, exc.status_code, headers)
@@ -0,0 +1,169 @@
+"""
+JWT authentication without per-request user queries.
+
+simplejwt's JWTAuthentication loads the User row on every request, and the
+shop permission checks then load the Manager and Shop rows. Here:
+
+  * ShopJWTAuthentication resolves users through UserCache, a short-TTL
+    in-process cache holding each User together with its managed shop id
+    (one joined query on a miss). Saving or deleting a User or Manager drops
+    the entry (see shop/signals.py), so deactivations and shop reassignments
+    apply at once in this process and within USER_CACHE_TTL elsewhere.
+  * The resolved user carries `managed_shop_id`; permissions and views
+    compare ids (see managed_shop_id()) and never load the related rows.
+
+Authenticated requests therefore make no auth-related queries while the
+user is cached.
+"""
+import copy
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .cache import LRUCache
+from .models import Manager
+
+DEFAULTS = {
+    # Seconds a resolved user is reused without a query
+    'USER_CACHE_TTL': 60,
+    'USER_CACHE_MAX_ENTRIES': 10000,
+}
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {})}
+
+
+def managed_shop_id(user):
+    """Id of the shop the user manages, or None."""
+    if hasattr(user, 'managed_shop_id'):
+        return user.managed_shop_id  # resolved with the user by ShopJWTAuthentication
+    if not user.is_authenticated:
+        return None
+    return Manager.objects.filter(user=user).values_list('shop_id', flat=True).first()
+
+
+def user_queryset():
+    return get_user_model().objects.select_related('manager_profile')
+
+
+def with_shop_id(user):
+    """Sets user.managed_shop_id from a user loaded with user_queryset()."""
+    try:
+        user.managed_shop_id = user.manager_profile.shop_id
+    except Manager.DoesNotExist:
+        user.managed_shop_id = None
+    return user
+
+
+class UserCache:
+    """Users by id with their managed shop id, reused for USER_CACHE_TTL seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._local = None
+
+    @property
+    def local(self):
+        if self._local is None:
+            self._local = LRUCache(options()['USER_CACHE_MAX_ENTRIES'])
+        return self._local
+
+    def get(self, user_id):
+        """The user, or raises DoesNotExist."""
+        user, generation = self._lookup(user_id)
+        if user is None:
+            user = with_shop_id(user_queryset().get(pk=user_id))
+            self._store(user_id, user, generation)
+        return copy.copy(user)
+
+    async def aget(self, user_id):
+        user, generation = self._lookup(user_id)
+        if user is None:
+            user = with_shop_id(await user_queryset().aget(pk=user_id))
+            self._store(user_id, user, generation)
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        def drop():
+            with self._lock:
+                self._generation += 1
+                self.local.set(str(user_id), None)
+
+        drop()
+        # Again after commit: a request may have cached the old row in between
+        transaction.on_commit(drop)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._local = None
+
+    def _lookup(self, user_id):
+        with self._lock:
+            entry = self.local.get(str(user_id))
+            generation = self._generation
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1], generation
+        return None, generation
+
+    def _store(self, user_id, user, generation):
+        with self._lock:
+            # Skip rows loaded before an invalidation that happened meanwhile
+            if generation == self._generation:
+                self.local.set(str(user_id), (time.monotonic() + options()['USER_CACHE_TTL'], user))
+
+
+user_cache = UserCache()
+
+
+class ShopJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication resolving users through user_cache."""
+
+    def get_user(self, validated_token):
+        user_model = get_user_model()
+        try:
+            user = user_cache.get(self._user_id(validated_token))
+        except user_model.DoesNotExist:
+            raise exceptions.AuthenticationFailed("User not found", code='user_not_found')
+        return self._checked(user, validated_token)
+
+    async def aauthenticate(self, request):
+        """authenticate() for async views; returns (user, token) or None without a token."""
+        header = self.get_header(request)
+        raw_token = None if header is None else self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        token = self.get_validated_token(raw_token)
+        user_model = get_user_model()
+        try:
+            user = await user_cache.aget(self._user_id(token))
+        except user_model.DoesNotExist:
+            raise exceptions.AuthenticationFailed("User not found", code='user_not_found')
+        return self._checked(user, token), token
+
+    @staticmethod
+    def _user_id(token):
+        if jwt_settings.USER_ID_CLAIM not in token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return token[jwt_settings.USER_ID_CLAIM]
+
+    @staticmethod
+    def _checked(user, token):
+        if jwt_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise exceptions.AuthenticationFailed("User is inactive", code='user_inactive')
+        if jwt_settings.CHECK_REVOKE_TOKEN and (
+            token.get(jwt_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password)
+        ):
+            raise exceptions.AuthenticationFailed("The user's password has been changed.", code='password_changed')
+        return user
+
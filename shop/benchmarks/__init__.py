@@ -0,0 +1,100 @@
+"""
+Performance benchmarks for the shop app.
+
+Each scenario is a function registered with @scenario that receives the parsed
+command options and returns a dict of measurements. Scenarios run against a
+throwaway test database (see isolated_database) so they never touch real data.
+Run them with:  python manage.py benchmark <scenario> [options]
+"""
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+SCENARIOS = {}
+
+
+def scenario(name, on_disk=False):
+    """
+    Registers a benchmark function under the given name. on_disk scenarios get
+    a file-backed SQLite database instead of the in-memory test database.
+    """
+    def register(func):
+        func.on_disk = on_disk
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def isolated_database(on_disk=False):
+    """Creates a fresh test database (and test client environment) for the block."""
+    old_name = connection.settings_dict['NAME']
+    test_settings = connection.settings_dict['TEST']
+    old_test_name = test_settings.get('NAME')
+    directory = None
+    if on_disk and connection.vendor == 'sqlite':
+        directory = tempfile.mkdtemp(prefix='shop-benchmark-')
+        test_settings['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        if directory is not None:
+            test_settings['NAME'] = old_test_name
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class Timer:
+    """Context manager measuring wall-clock time in seconds."""
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def time_call(func, repeat=5):
+    """Runs func repeat times and returns the median duration in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        with Timer() as timer:
+            func()
+        samples.append(timer.elapsed * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def environment():
+    """Where a run happened, so results of different commits can be told apart."""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+    }
+
+
+def load_scenarios():
+    """Imports the scenario modules so they register themselves."""
+    from . import async_reads, catalog, checkout, database, endpoints, exports  # noqa: F401
@@ -0,0 +1,139 @@
+import asyncio
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ..models import Cart, CartItem, Product
+from ..services.checkout import checkout_cart
+from . import Timer, scenario
+from .catalog import seed_products
+
+
+def request_mix(product_ids, count, seed=0):
+    """count read paths: half product details, then list pages, shops and order history."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        kind = i % 6
+        if kind < 3:
+            paths.append(f'products/{rng.choice(product_ids)}/')
+        elif kind == 3:
+            paths.append(f'products/?in_stock=true&page_size={rng.choice((10, 20, 50))}')
+        elif kind == 4:
+            paths.append('shops/')
+        else:
+            paths.append('orders/')
+    return paths
+
+
+def summarize(latencies, elapsed, peak_threads):
+    latencies = sorted(latencies)
+    return {
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(statistics.median(latencies) * 1000, 2),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        'peak_threads': peak_threads,
+    }
+
+
+class ThreadCounter:
+    """Samples threading.active_count() in the background while a run is going."""
+
+    def __enter__(self):
+        self.peak = threading.active_count()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._done.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._done.wait(0.005):
+            self.peak = max(self.peak, threading.active_count())
+
+
+def run_sync(paths, concurrency, auth):
+    """The sync ViewSets through the WSGI handler, one thread per in-flight request."""
+    local = threading.local()
+
+    def fetch(path):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client()
+        start = time.perf_counter()
+        response = client.get(f'/api/{path}', HTTP_AUTHORIZATION=auth)
+        assert response.status_code == 200, (path, response.status_code)
+        return time.perf_counter() - start
+
+    def close_connection(_):
+        connection.close()
+
+    with ThreadCounter() as threads, Timer() as timer:
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = list(pool.map(fetch, paths))
+            list(pool.map(close_connection, range(concurrency)))
+    return summarize(latencies, timer.elapsed, threads.peak)
+
+
+def run_async(paths, concurrency, auth):
+    """The async views through the ASGI handler, concurrency coroutines in one event loop."""
+    async def main():
+        client = AsyncClient()
+        slots = asyncio.Semaphore(concurrency)
+
+        async def fetch(path):
+            async with slots:
+                start = time.perf_counter()
+                response = await client.get(f'/api/async/{path}', headers={'Authorization': auth})
+                assert response.status_code == 200, (path, response.status_code)
+                return time.perf_counter() - start
+
+        return await asyncio.gather(*(fetch(path) for path in paths))
+
+    with ThreadCounter() as threads, Timer() as timer:
+        latencies = asyncio.run(main())
+    return summarize(latencies, timer.elapsed, threads.peak)
+
+
+@scenario('async_reads')
+def async_reads(options):
+    """
+    Throughput and latency of the hot read endpoints at increasing concurrency:
+    the sync ViewSets under WSGI (a thread per in-flight request) against the
+    async views under ASGI (coroutines on one event loop). Both run in-process,
+    without an HTTP server, and with the catalog cache off so every request
+    reaches the database.
+    """
+    count = options['products'] or 20_000
+    seed_products(count)
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    buyer = User.objects.create_user(username='bench-buyer')
+    for pk in product_ids[:25]:
+        cart, _ = Cart.objects.get_or_create(user=buyer)
+        CartItem.objects.create(cart=cart, product_id=pk, quantity=1)
+        checkout_cart(cart)
+    auth = f'Bearer {AccessToken.for_user(buyer)}'
+    paths = request_mix(product_ids, options['requests'])
+
+    results = []
+    with override_settings(CATALOG_CACHE={'ENABLED': False}):
+        # Warm up both stacks (URL resolvers, serializers, discount index)
+        run_sync(paths[:20], 1, auth)
+        run_async(paths[:20], 1, auth)
+        for concurrency in options['concurrency']:
+            results.append({
+                'concurrency': concurrency,
+                'sync_wsgi': run_sync(paths, concurrency, auth),
+                'async_asgi': run_async(paths, concurrency, auth),
+            })
+    return {'products': count, 'requests': len(paths), 'results': results}
@@ -0,0 +1,252 @@
+import csv
+import random
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.test import Client, RequestFactory, override_settings
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from .. import search
+from ..cache import catalog_cache
+from ..models import Brand, Category, Manager, Product, ProductImage, Shop
+from ..pagination import ProductCursorPagination
+from ..serializers import ProductListSerializer, ProductSerializer, product_list_queryset
+from ..services import product_import
+from . import Timer, scenario, time_call
+
+SEED_BATCH_SIZE = 5000
+
+
+ADJECTIVES = [
+    'red', 'blue', 'green', 'black', 'white', 'silver', 'golden', 'wooden', 'leather',
+    'cotton', 'wireless', 'compact', 'portable', 'classic', 'vintage', 'premium',
+    'organic', 'smart', 'heavy', 'light', 'waterproof', 'ergonomic', 'digital', 'mini',
+]
+NOUNS = [
+    'shoe', 'boot', 'jacket', 'shirt', 'lamp', 'chair', 'table', 'kettle', 'phone',
+    'laptop', 'headphones', 'speaker', 'watch', 'backpack', 'bottle', 'camera',
+    'keyboard', 'mouse', 'blender', 'toaster', 'pillow', 'blanket', 'mug', 'guitar',
+]
+
+
+def product_name(rng, i):
+    return f"{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}"
+
+
+def seed_products(count, shops=20):
+    """Bulk-inserts count products with varied names spread across a few shops."""
+    rng = random.Random(count)
+    shop_objs = Shop.objects.bulk_create([
+        Shop(name=f"Bench Shop {i}", slug=f"bench-shop-{i}") for i in range(shops)
+    ])
+    for start in range(0, count, SEED_BATCH_SIZE):
+        Product.objects.bulk_create([
+            Product(
+                shop=shop_objs[i % shops], name=product_name(rng, i),
+                description=f"A {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} for everyday use",
+                price=Decimal('1.00') + i % 500, stock=i % 50
+            )
+            for i in range(start, min(start + SEED_BATCH_SIZE, count))
+        ], batch_size=SEED_BATCH_SIZE)
+    return shop_objs
+
+
+@scenario('pagination')
+def pagination(options):
+    """
+    Latency of GET /api/products/ at increasing depths into the catalog.
+    Compares the keyset cursor endpoint with an equivalent OFFSET query.
+    """
+    count = options['products'] or 1_000_000
+    page_size = options['page_size']
+    seed_products(count)
+
+    client = Client()
+    paginator = ProductCursorPagination()
+    paginator.base_url = f'http://testserver/api/products/?page_size={page_size}'
+    ordered = Product.objects.order_by(*paginator.ordering)
+
+    results = []
+    for fraction in (0, 0.1, 0.5, 0.99):
+        depth = int((count - 1) * fraction)
+        url, keyset = paginator.base_url, ordered
+        if depth:
+            last = ordered[depth - 1]
+            url = paginator.encode_cursor(last, reverse=False)
+            position = [getattr(last, field.lstrip('-')) for field in paginator.ordering]
+            keyset = ordered.filter(paginator._seek_filter(paginator.ordering, position))
+        results.append({
+            'depth': depth,
+            'keyset_request_ms': time_call(lambda: client.get(url)),
+            'keyset_query_ms': time_call(lambda: list(keyset[:page_size])),
+            'offset_query_ms': time_call(lambda: list(ordered[depth:depth + page_size])),
+        })
+
+    return {'products': count, 'page_size': page_size, 'pages': results}
+
+
+@scenario('catalog_cache')
+def catalog_cache_rate(options):
+    """
+    Requests per second for a mix of product detail and list-page reads,
+    uncached versus served from a warm catalog cache.
+    """
+    count = options['products'] or 10_000
+    requests = options['requests']
+    seed_products(count)
+
+    rng = random.Random(42)
+    ids = list(Product.objects.values_list('id', flat=True))
+    hot = rng.sample(ids, min(len(ids), 500))
+    urls = [
+        f'/api/products/{rng.choice(hot)}/' if i % 4 else '/api/products/?page_size=20'
+        for i in range(requests)
+    ]
+    client = Client()
+
+    def run():
+        with Timer() as timer:
+            for url in urls:
+                client.get(url)
+        return round(len(urls) / timer.elapsed, 1)
+
+    with override_settings(CATALOG_CACHE={'ENABLED': False}):
+        uncached = run()
+    run()  # warm up
+    catalog_cache.reset_stats()
+    warm = run()
+
+    return {
+        'products': count,
+        'requests': requests,
+        'uncached_requests_per_second': uncached,
+        'warm_requests_per_second': warm,
+        'speedup': round(warm / uncached, 2),
+        'cache_stats': catalog_cache.stats(),
+    }
+
+
+@scenario('search')
+def search_latency(options):
+    """Latency of /api/products/search/ for common, rare, prefix and multi-word queries."""
+    count = options['products'] or 1_000_000
+    seed_products(count)
+    with Timer() as rebuild:
+        search.rebuild_index()
+
+    client = Client()
+    queries = ['shoe', 'wireless', 'golden kettle', 'vintage leather boot', 'head', f'{count // 2}']
+    results = []
+    for q in queries:
+        results.append({
+            'q': q,
+            'request_ms': time_call(lambda: client.get('/api/products/search/', {'q': q})),
+            'index_query_ms': time_call(lambda: search.search_product_ids(q, 20)),
+        })
+    return {
+        'products': count,
+        'index_rebuild_seconds': round(rebuild.elapsed, 2),
+        'queries': results,
+    }
+
+
+@scenario('product_import')
+def product_import_rate(options):
+    """
+    Rows per second for a bulk catalog import (CSV, upserting by sku) versus
+    creating the same products one POST /api/products/ at a time. The import
+    is run twice so the second pass measures updates of existing rows.
+    """
+    count = options['products'] or 50_000
+    api_sample = min(count, 500)
+    rng = random.Random(count)
+    shop = Shop.objects.create(name="Import Shop", slug='import-shop')
+    manager = User.objects.create(username='bench-manager')
+    Manager.objects.create(user=manager, shop=shop)
+    categories = Category.objects.bulk_create([Category(name=noun.title()) for noun in NOUNS])
+    brands = Brand.objects.bulk_create([Brand(name=f"Brand {i}") for i in range(50)])
+
+    client = APIClient()
+    client.force_authenticate(manager)
+    with Timer() as api:
+        for i in range(api_sample):
+            client.post('/api/products/', {
+                'shop': shop.id, 'sku': f'API-{i}', 'name': product_name(rng, i),
+                'description': 'Created via the API', 'price': '19.99', 'stock': 10, 'category': categories[i % 24].id,
+            })
+
+    rows = [
+        {
+            'sku': f'SKU-{i}', 'name': product_name(rng, i), 'description': 'Imported',
+            'price': str(Decimal('1.00') + i % 500), 'stock': i % 50,
+            'category': categories[i % len(categories)].name, 'brand': brands[i % len(brands)].name,
+        }
+        for i in range(count)
+    ]
+    stream = StringIO()
+    writer = csv.DictWriter(stream, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+
+    passes = []
+    for _ in range(2):
+        stream.seek(0)
+        with Timer() as timer:
+            report = product_import.import_products(shop.id, product_import.read_rows(stream, 'csv'))
+        passes.append({
+            'created': report.created, 'updated': report.updated, 'failed': report.failed,
+            'rows_per_second': round(count / timer.elapsed),
+        })
+
+    api_rate = api_sample / api.elapsed
+    return {
+        'rows': count,
+        'api_rows_per_second': round(api_rate),
+        'import': passes,
+        'speedup': round(passes[0]['rows_per_second'] / api_rate, 1),
+    }
+
+
+@scenario('product_list_payload')
+def product_list_payload(options):
+    """
+    Query + serialization time and JSON size of a product page rendered with
+    the full ProductSerializer versus the compact list representation.
+    """
+    seed_products(max(options['products'] or 1000, 1000))
+    products = list(Product.objects.order_by('id').values_list('id', flat=True)[:1000])
+    ProductImage.objects.bulk_create([
+        ProductImage(
+            product_id=pk, image=f'products/bench/{pk}-{i}.jpg', is_feature=i == 1,
+            alt_text=f"Photo {i}", content_hash=f'{pk:064x}',
+            variants={name: f'products/derived/{pk}/{i}/{name}' for name in ('thumb_webp', 'medium_webp')}
+        )
+        for pk in products for i in range(3)
+    ], batch_size=SEED_BATCH_SIZE)
+
+    context = {'request': RequestFactory().get('/api/products/')}
+    renderer = JSONRenderer()
+    full = Product.objects.select_related('shop').prefetch_related('images').order_by('-created_at', 'id')
+    compact = product_list_queryset().order_by('-created_at', 'id')
+
+    def render(serializer_class, queryset, rows):
+        return renderer.render(serializer_class(queryset[:rows], many=True, context=context).data)
+
+    results = []
+    for rows in (100, 1000):
+        full_ms = time_call(lambda: render(ProductSerializer, full, rows))
+        compact_ms = time_call(lambda: render(ProductListSerializer, compact, rows))
+        full_bytes = len(render(ProductSerializer, full, rows))
+        compact_bytes = len(render(ProductListSerializer, compact, rows))
+        results.append({
+            'rows': rows,
+            'full_ms': full_ms,
+            'compact_ms': compact_ms,
+            'full_bytes': full_bytes,
+            'compact_bytes': compact_bytes,
+            'time_ratio': round(full_ms / compact_ms, 2),
+            'size_ratio': round(full_bytes / compact_bytes, 2),
+        })
+    return {'pages': results}
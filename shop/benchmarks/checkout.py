@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection
+
+from ..models import Cart, CartItem, Order, Product, Shop
+from ..services.checkout import checkout_cart
+from ..services.inventory import InsufficientStockError
+from . import Timer, scenario
+
+
+@scenario('checkout_contention')
+def checkout_contention(options):
+    """
+    Many buyers checking out the same hot product at once.
+    Reports checkouts per second and verifies that stock was never oversold.
+    """
+    buyers = options['buyers']
+    stock = options['stock']
+    threads_count = options['threads']
+
+    shop = Shop.objects.create(name="Bench Shop", slug="bench-shop")
+    product = Product.objects.create(
+        shop=shop, name="Hot item", description='', price=Decimal('9.99'), stock=stock
+    )
+    users = User.objects.bulk_create([User(username=f"bench{i}") for i in range(buyers)])
+    carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+    CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=1) for cart in carts])
+
+    outcomes = {'ok': 0, 'short': 0, 'lock_retries': 0}
+    lock = threading.Lock()
+    queue = list(carts)
+
+    def worker():
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    cart = queue.pop()
+                while True:
+                    try:
+                        checkout_cart(cart)
+                        key = 'ok'
+                        break
+                    except InsufficientStockError:
+                        key = 'short'
+                        break
+                    except OperationalError:
+                        with lock:
+                            outcomes['lock_retries'] += 1
+                        time.sleep(random.uniform(0, 0.005))
+                with lock:
+                    outcomes[key] += 1
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+    with Timer() as timer:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    product.refresh_from_db()
+    return {
+        'buyers': buyers,
+        'threads': threads_count,
+        'initial_stock': stock,
+        'successful_checkouts': outcomes['ok'],
+        'rejected_checkouts': outcomes['short'],
+        'lock_retries': outcomes['lock_retries'],
+        'remaining_stock': product.stock,
+        'orders_created': Order.objects.count(),
+        'oversold': outcomes['ok'] > stock,
+        'elapsed_seconds': round(timer.elapsed, 4),
+        'checkouts_per_second': round(buyers / timer.elapsed, 1),
+    }
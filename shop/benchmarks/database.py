@@ -0,0 +1,142 @@
+import random
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections
+
+from ..models import Cart, CartItem, Product, Shop
+from ..serializers import product_list_queryset
+from ..services.checkout import checkout_cart
+from . import Timer, scenario
+
+# The stock configuration: rollback journal, deferred transactions, a new
+# connection per request
+BASIC_PROFILE = {'CONN_MAX_AGE': 0, 'OPTIONS': {}}
+
+
+def apply_profile(profile):
+    """Points the default alias at a profile; new connections pick it up."""
+    connections.close_all()
+    connection.settings_dict['CONN_MAX_AGE'] = profile.get('CONN_MAX_AGE', 0)
+    connection.settings_dict['OPTIONS'] = dict(profile.get('OPTIONS', {}))
+    # journal_mode is stored in the database file: switch it back from WAL
+    # (and into it, through init_command) before the threads connect
+    with connection.cursor() as cursor:
+        if 'journal_mode' not in connection.settings_dict['OPTIONS'].get('init_command', ''):
+            cursor.execute('PRAGMA journal_mode=DELETE')
+    connection.close()
+
+
+def run_mix(product_ids, carts, writers, readers, seconds, persistent):
+    """Checkouts on writer threads and catalog reads on reader threads for `seconds`."""
+    counts = {'checkouts': 0, 'reads': 0, 'checkout_lock_errors': 0, 'read_lock_errors': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def finish_request():
+        # What request_finished does under CONN_MAX_AGE = 0
+        if not persistent:
+            connection.close()
+
+    def writer(index):
+        rng = random.Random(index)
+        own = carts[index::writers]
+        try:
+            while time.monotonic() < deadline:
+                cart = rng.choice(own)
+                try:
+                    CartItem.objects.bulk_create([
+                        CartItem(cart=cart, product_id=pid, quantity=1)
+                        for pid in rng.sample(product_ids, 3)
+                    ])
+                    checkout_cart(cart)
+                    count('checkouts')
+                except OperationalError:
+                    count('checkout_lock_errors')
+                    try:
+                        CartItem.objects.filter(cart=cart).delete()
+                    except OperationalError:
+                        pass  # left for the next checkout of this cart
+                finish_request()
+        finally:
+            connection.close()
+
+    def reader(index):
+        rng = random.Random(-index - 1)
+        try:
+            while time.monotonic() < deadline:
+                try:
+                    offset = rng.randrange(max(len(product_ids) - 20, 1))
+                    list(product_list_queryset().order_by('-created_at', 'id')[offset:offset + 20])
+                    Product.objects.filter(pk=rng.choice(product_ids)).values('stock').first()
+                    count('reads')
+                except OperationalError:
+                    count('read_lock_errors')
+                finish_request()
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    threads += [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    with Timer() as timer:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    attempts = {
+        kind: counts[f'{kind}s'] + counts[f'{kind}_lock_errors'] for kind in ('checkout', 'read')
+    }
+    return {
+        **counts,
+        'checkouts_per_second': round(counts['checkouts'] / timer.elapsed, 1),
+        'reads_per_second': round(counts['reads'] / timer.elapsed, 1),
+        'checkout_lock_error_rate': round(counts['checkout_lock_errors'] / max(attempts['checkout'], 1), 4),
+        'read_lock_error_rate': round(counts['read_lock_errors'] / max(attempts['read'], 1), 4),
+    }
+
+
+@scenario('sqlite_profiles', on_disk=True)
+def sqlite_profiles(options):
+    """
+    Concurrent checkouts (--threads writers) and catalog reads (--readers) against
+    a file-backed SQLite database, under the stock configuration and under the
+    production profile (WAL, tuned pragmas, BEGIN IMMEDIATE; see
+    SQLITE_PRODUCTION in settings). Reports throughput and the
+    share of operations failing with "database is locked".
+    """
+    count = options['products'] or 2000
+    shop = Shop.objects.create(name="Bench Shop", slug="bench-shop")
+    Product.objects.bulk_create([
+        Product(shop=shop, name=f"Item {i}", description='', price=Decimal('5.00') + i % 40, stock=10 ** 9)
+        for i in range(count)
+    ])
+    product_ids = list(Product.objects.values_list('pk', flat=True))
+    users = User.objects.bulk_create([User(username=f"bench{i}") for i in range(options['buyers'])])
+    carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+
+    original = {key: connection.settings_dict.get(key) for key in ('CONN_MAX_AGE', 'OPTIONS')}
+    results = {}
+    try:
+        for name, profile in (('basic', BASIC_PROFILE), ('production', settings.SQLITE_PRODUCTION)):
+            apply_profile(profile)
+            results[name] = run_mix(
+                product_ids, carts, options['threads'], options['readers'], options['seconds'],
+                persistent=bool(profile.get('CONN_MAX_AGE'))
+            )
+    finally:
+        apply_profile(original)
+    return {
+        'products': count,
+        'writers': options['threads'],
+        'readers': options['readers'],
+        'seconds_per_profile': options['seconds'],
+        'profiles': results,
+    }
@@ -0,0 +1,331 @@
+"""
+Seeded synthetic datasets: shops with managers, categories, brands, products
+with images, discounts, buyers with carts, multi-shop orders and comments.
+
+Everything is inserted with bulk_create in chunks, so signals do not run;
+generate() rebuilds the derived data they would have maintained (product
+counters, facet counts, the search index, the sales rollups) at the end.
+The same seed and counts always produce the same rows. Rows are named after
+the seed, so datasets with different seeds can share a database.
+"""
+import random
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .. import facets, search
+from ..cache import catalog_cache
+from ..models import (
+    Brand, Cart, CartItem, Category, Comment, DeliveryInfo, Discount, Manager, Order, OrderDetail, OrderStatus,
+    Product, ProductImage, Shop, ShopOrder,
+)
+from ..services import analytics, counters
+from .catalog import ADJECTIVES, NOUNS
+
+CHUNK_SIZE = 5000
+
+SCALES = {
+    'small': {'shops': 20, 'products': 10_000, 'buyers': 500, 'orders': 2_000, 'comments': 5_000},
+    'medium': {'shops': 100, 'products': 100_000, 'buyers': 5_000, 'orders': 50_000, 'comments': 100_000},
+    'large': {'shops': 500, 'products': 1_000_000, 'buyers': 50_000, 'orders': 500_000, 'comments': 1_000_000},
+}
+CATEGORIES = 40
+BRANDS = 200
+DISCOUNTS = 10
+IMAGES_PER_PRODUCT = 2
+# Share of buyers with a non-empty cart
+CART_SHARE = 0.2
+# Orders are spread over this many days before today
+ORDER_DAYS = 90
+# Order statuses and their weights
+STATUS_WEIGHTS = {
+    OrderStatus.PENDING: 2, OrderStatus.PROCESSING: 2, OrderStatus.SHIPPED: 3,
+    OrderStatus.DELIVERED: 12, OrderStatus.CANCELLED: 1, OrderStatus.RETURNED: 1,
+}
+SHIPPED_STATUSES = (OrderStatus.SHIPPED, OrderStatus.DELIVERED, OrderStatus.RETURNED)
+# Comments approved and rejected by managers; the rest wait in the moderation queue
+APPROVED_SHARE = 0.7
+REJECTED_SHARE = 0.1
+
+
+def product_price(index):
+    """Regular price of the index-th product (kept out of memory for large datasets)."""
+    return Decimal('1.99') + (index * 7919) % 50000 / Decimal(100)
+
+
+class Dataset:
+    """Generates one dataset; see generate()."""
+
+    def __init__(self, counts, seed=0, chunk_size=CHUNK_SIZE, progress=None):
+        self.counts = {**SCALES['small'], **counts}
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.chunk_size = chunk_size
+        self.progress = progress or (lambda message: None)
+        self.tag = f'syn{seed}'
+        self.password = make_password(None)
+        self.created = {}
+
+    def generate(self):
+        self.labels()
+        self.shops()
+        self.products()
+        self.images()
+        self.discounts()
+        self.buyers()
+        self.carts()
+        self.orders()
+        self.comments()
+        self.derived()
+        return self.created
+
+    # Steps
+
+    def labels(self):
+        self.category_ids = self._ids(Category.objects.bulk_create([
+            Category(name=f"{noun.title()}s {self.tag}-{i}") for i, noun in enumerate(self._cycle(NOUNS, CATEGORIES))
+        ]))
+        self.brand_ids = self._ids(Brand.objects.bulk_create([
+            Brand(name=f"{adjective.title()} Co {self.tag}-{i}")
+            for i, adjective in enumerate(self._cycle(ADJECTIVES, BRANDS))
+        ]))
+        self._count('categories', CATEGORIES)
+        self._count('brands', BRANDS)
+
+    def shops(self):
+        count = self.counts['shops']
+        shops = Shop.objects.bulk_create([
+            Shop(
+                name=f"{self.rng.choice(ADJECTIVES).title()} {self.rng.choice(NOUNS).title()} Store {self.tag}-{i}",
+                slug=f'{self.tag}-shop-{i}', description=f"Shop number {i} of dataset {self.tag}",
+            )
+            for i in range(count)
+        ])
+        self.shop_ids = self._ids(shops)
+        users = User.objects.bulk_create([
+            User(username=f'{self.tag}-manager-{i}', password=self.password) for i in range(count)
+        ])
+        self.manager_ids = self._ids(Manager.objects.bulk_create([
+            Manager(user=user, shop=shop) for user, shop in zip(users, shops)
+        ]))
+        self._count('shops', count)
+        self._count('managers', count)
+
+    def products(self):
+        """Product i belongs to shop i % shops, so a shop's products are found without a query."""
+        count = self.counts['products']
+        self.product_ids = array('q')
+        for start, stop in self._chunks(count):
+            self.product_ids.extend(self._ids(Product.objects.bulk_create([
+                Product(
+                    shop_id=self.shop_ids[i % len(self.shop_ids)],
+                    category_id=self.rng.choice(self.category_ids),
+                    brand_id=self.rng.choice(self.brand_ids) if self.rng.random() < 0.9 else None,
+                    sku=f'SKU-{i}',
+                    name=f"{self.rng.choice(ADJECTIVES)} {self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} {i}",
+                    description=(
+                        f"A {self.rng.choice(ADJECTIVES)} {self.rng.choice(NOUNS)} "
+                        f"for {self.rng.choice(NOUNS)} lovers, made {self.rng.choice(ADJECTIVES)}"
+                    ),
+                    price=product_price(i),
+                    stock=0 if self.rng.random() < 0.1 else self.rng.randrange(1, 500),
+                )
+                for i in range(start, stop)
+            ])))
+            self.progress(f"products: {stop}/{count}")
+        self._count('products', count)
+
+    def images(self):
+        total = 0
+        for start, stop in self._chunks(len(self.product_ids)):
+            images = [
+                ProductImage(
+                    product_id=self.product_ids[i], image=f'products/{self.tag}/{i}-{n}.jpg',
+                    is_feature=n == 0, alt_text=f"Product {i}, view {n + 1}",
+                )
+                for i in range(start, stop) for n in range(IMAGES_PER_PRODUCT)
+            ]
+            ProductImage.objects.bulk_create(images, batch_size=self.chunk_size)
+            total += len(images)
+        self._count('images', total)
+
+    def discounts(self):
+        now = timezone.now()
+        for i in range(DISCOUNTS):
+            discount = Discount.objects.create(
+                name=f"Sale {self.tag}-{i}", discount_percentage=Decimal(5 + 5 * (i % 6)),
+                start_date=now - timedelta(days=7), end_date=now + timedelta(days=30 + i),
+            )
+            discount.categories.set(self.rng.sample(self.category_ids, 2))
+            picks = self.rng.sample(range(len(self.product_ids)), min(50, len(self.product_ids)))
+            discount.products.set([self.product_ids[i] for i in picks])
+        self._count('discounts', DISCOUNTS)
+
+    def buyers(self):
+        count = self.counts['buyers']
+        self.buyer_ids = array('q')
+        for start, stop in self._chunks(count):
+            self.buyer_ids.extend(self._ids(User.objects.bulk_create([
+                User(username=f'{self.tag}-buyer-{i}', password=self.password) for i in range(start, stop)
+            ])))
+        self._count('buyers', count)
+
+    def carts(self):
+        buyers = self.buyer_ids[:int(len(self.buyer_ids) * CART_SHARE)]
+        lines = 0
+        for start, stop in self._chunks(len(buyers)):
+            carts = Cart.objects.bulk_create([Cart(user_id=buyers[i]) for i in range(start, stop)])
+            items = [
+                CartItem(cart=cart, product_id=self.product_ids[index], quantity=self.rng.randint(1, 3))
+                for cart in carts
+                for index in self.rng.sample(range(len(self.product_ids)), self.rng.randint(1, 4))
+            ]
+            CartItem.objects.bulk_create(items)
+            lines += len(items)
+        self._count('carts', len(buyers))
+        self._count('cart_items', lines)
+
+    def orders(self):
+        """Orders of 1-3 shops with 1-3 lines each, spread over the last ORDER_DAYS days."""
+        count = self.counts['orders']
+        statuses, weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+        shop_count = len(self.shop_ids)
+        per_shop = max(len(self.product_ids) // shop_count, 1)
+        today = timezone.now()
+        totals = {'shop_orders': 0, 'order_lines': 0, 'deliveries': 0}
+        for start, stop in self._chunks(count):
+            plans = []
+            for _ in range(start, stop):
+                order_status = self.rng.choices(statuses, weights)[0]
+                shops = self.rng.sample(range(shop_count), min(self.rng.randint(1, 3), shop_count))
+                plans.append((order_status, self.rng.randrange(ORDER_DAYS), [
+                    (shop, [
+                        (shop + shop_count * self.rng.randrange(per_shop), self.rng.randint(1, 3))
+                        for _ in range(self.rng.randint(1, 3))
+                    ])
+                    for shop in shops
+                ]))
+            with transaction.atomic():
+                orders = Order.objects.bulk_create([
+                    Order(
+                        user_id=self.rng.choice(self.buyer_ids), status=order_status,
+                        total_amount=sum(
+                            product_price(index) * quantity for _, lines in parts for index, quantity in lines
+                        ),
+                    )
+                    for order_status, _, parts in plans
+                ])
+                shop_orders, lines, deliveries = [], [], []
+                for order, (order_status, _, parts) in zip(orders, plans):
+                    for shop, shop_lines in parts:
+                        delivery = None
+                        if order_status in SHIPPED_STATUSES:
+                            delivery = DeliveryInfo(
+                                tracking_number=f'{self.tag.upper()}-{order.pk}-{shop}',
+                                carrier=self.rng.choice(('DHL', 'UPS', 'FedEx', 'Posta')), status=order_status,
+                            )
+                            deliveries.append(delivery)
+                        shop_orders.append(ShopOrder(
+                            main_order=order, shop_id=self.shop_ids[shop], status=order_status,
+                            delivery_info=delivery,
+                            shop_total=sum(product_price(index) * quantity for index, quantity in shop_lines),
+                        ))
+                        lines += [(order, len(shop_orders) - 1, index, quantity) for index, quantity in shop_lines]
+                DeliveryInfo.objects.bulk_create(deliveries)
+                ShopOrder.objects.bulk_create(shop_orders)
+                OrderDetail.objects.bulk_create([
+                    OrderDetail(
+                        order=order, shop_order=shop_orders[position], product_id=self.product_ids[index],
+                        quantity=quantity, price=product_price(index),
+                    )
+                    for order, position, index, quantity in lines
+                ])
+                self._backdate(orders, [days for _, days, _ in plans], today)
+            totals['shop_orders'] += len(shop_orders)
+            totals['order_lines'] += len(lines)
+            totals['deliveries'] += len(deliveries)
+            self.progress(f"orders: {stop}/{count}")
+        self._count('orders', count)
+        for name, value in totals.items():
+            self._count(name, value)
+
+    def comments(self):
+        count = self.counts['comments']
+        shop_count = len(self.shop_ids)
+        now = timezone.now()
+        for start, stop in self._chunks(count):
+            comments = []
+            for _ in range(start, stop):
+                index = self.rng.randrange(len(self.product_ids))
+                roll = self.rng.random()
+                approved = roll < APPROVED_SHARE
+                moderated = roll < APPROVED_SHARE + REJECTED_SHARE
+                comments.append(Comment(
+                    product_id=self.product_ids[index], shop_id=self.shop_ids[index % shop_count],
+                    user_id=self.rng.choice(self.buyer_ids),
+                    comment=f"{self.rng.choice(ADJECTIVES).title()} and {self.rng.choice(ADJECTIVES)}, "
+                            f"would buy another {self.rng.choice(NOUNS)}",
+                    is_approved=approved,
+                    moderated_by_id=self.manager_ids[index % shop_count] if moderated else None,
+                    moderated_at=now if moderated else None,
+                ))
+            Comment.objects.bulk_create(comments)
+            self.progress(f"comments: {stop}/{count}")
+        self._count('comments', count)
+
+    def derived(self):
+        """What the signals, triggers and outbox would have maintained row by row."""
+        self.progress("reconciling product counters")
+        counters.reconcile_counters()
+        self.progress("rebuilding facet counts")
+        facets.rebuild_counts()
+        if search.is_supported():
+            self.progress("rebuilding the search index")
+            search.rebuild_index()
+        self.progress("backfilling sales rollups")
+        analytics.backfill()
+        catalog_cache.bump('catalog')
+
+    # Helpers
+
+    def _backdate(self, orders, days, today):
+        """Moves orders (and their shop orders) to their creation day; one UPDATE per day."""
+        by_day = {}
+        for order, offset in zip(orders, days):
+            by_day.setdefault(offset, []).append(order.pk)
+        for offset, ids in by_day.items():
+            created = today - timedelta(days=offset, minutes=self.rng.randrange(24 * 60))
+            Order.objects.filter(pk__in=ids).update(created_at=created, updated_at=created)
+            ShopOrder.objects.filter(main_order_id__in=ids).update(created_at=created, updated_at=created)
+
+    def _chunks(self, count):
+        for start in range(0, count, self.chunk_size):
+            yield start, min(start + self.chunk_size, count)
+
+    def _cycle(self, words, count):
+        return [words[i % len(words)] for i in range(count)]
+
+    def _count(self, name, value):
+        self.created[name] = value
+
+    @staticmethod
+    def _ids(objs):
+        return [obj.pk for obj in objs]
+
+
+def generate(counts=None, seed=0, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Inserts a dataset and returns the number of rows created per kind.
+    counts overrides the SCALES['small'] entries (shops, products, buyers,
+    orders, comments); progress, if given, is called with status messages.
+    """
+    return Dataset(counts or {}, seed, chunk_size, progress).generate()
+
+
+def exists(seed=0):
+    return Shop.objects.filter(slug=f'syn{seed}-shop-0').exists()
@@ -0,0 +1,498 @@
+import json
+import random
+import statistics
+import tracemalloc
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Count
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from .. import urls
+from ..models import Cart, CartItem, Comment, Manager, Order, Product, Shop, ShopOrder
+from . import Timer, scenario
+from .dataset import SCALES, generate
+from .exports import current_rss_kb
+
+# Requests per route measured under tracemalloc (slow; kept out of the latency samples)
+MEMORY_SAMPLES = 3
+WARMUP = 3
+# Default allowed p95 slowdown before a route counts as regressed against --baseline
+TOLERANCE = 0.25
+
+PLANS = {}
+# (route, method) pairs deliberately left out, with the reason
+SKIPPED = {
+    ('shop:vendor-order-list', 'POST'): "ShopOrderSerializer has no main_order field, so creates cannot succeed",
+}
+
+
+def plan(route, *methods, role='anonymous'):
+    """
+    Registers how to call a route: func(fixtures, iteration, method) returns a
+    Call. It runs before the timed request, so it may set up rows the request
+    consumes (a product to delete, a cart to check out).
+    """
+    def register(func):
+        for method in methods:
+            PLANS[(f'shop:{route}', method)] = (func, role)
+        return func
+    return register
+
+
+class Call:
+    def __init__(self, path, data=None, user=None, format='json'):
+        self.path = path
+        self.data = data
+        self.user = user
+        self.format = format
+
+
+def routes():
+    """(route name, method) of every view in shop/urls.py."""
+    found = set()
+
+    def walk(patterns):
+        for pattern in patterns:
+            if hasattr(pattern, 'url_patterns'):
+                walk(pattern.url_patterns)
+                continue
+            callback = pattern.callback
+            if getattr(callback, 'actions', None):
+                methods = callback.actions
+            elif hasattr(callback, 'view_class'):
+                methods = [name for name in ('get', 'post', 'put', 'patch', 'delete')
+                           if hasattr(callback.view_class, name)]
+            else:
+                methods = ['get']  # the async views answer GET (and HEAD)
+            # DRF adds 'head' to the actions once a viewset has served a request
+            found.update((f'shop:{pattern.name}', method.upper()) for method in methods if method != 'head')
+
+    walk(urls.urlpatterns)
+    return sorted(found)
+
+
+class Fixtures:
+    """Users, tokens and row ids the plans draw on, picked from the generated dataset."""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.product_ids = list(Product.objects.values_list('pk', flat=True))
+        # Enough stock for every checkout of the run
+        self.stocked_ids = list(Product.objects.filter(stock__gte=100).values_list('pk', flat=True))
+        self.shop_ids = list(Shop.objects.values_list('pk', flat=True))
+        manager = Manager.objects.select_related('user').order_by('pk').first()
+        self.manager, self.shop_id = manager.user, manager.shop_id
+        self.own_product_ids = list(
+            Product.objects.filter(shop_id=self.shop_id).values_list('pk', flat=True)[:500]
+        )
+        top = Order.objects.values('user').annotate(n=Count('id')).order_by('-n', 'user').first()
+        self.buyer = User.objects.get(pk=top['user'])
+        self.order_ids = list(Order.objects.filter(user=self.buyer).values_list('pk', flat=True))
+        self.shop_order_ids = list(
+            ShopOrder.objects.filter(shop_id=self.shop_id).values_list('pk', flat=True)[:500]
+        )
+        self.cartless = iter(User.objects.filter(cart__isnull=True, manager_profile__isnull=True).order_by('pk'))
+        self.staff = User.objects.create_user(username='bench-staff', is_staff=True)
+        self._tokens = {}
+        self._created = 0
+
+    def auth(self, user):
+        if user.pk not in self._tokens:
+            self._tokens[user.pk] = f'Bearer {AccessToken.for_user(user)}'
+        return self._tokens[user.pk]
+
+    def user_for(self, role):
+        return {'anonymous': None, 'buyer': self.buyer, 'manager': self.manager, 'staff': self.staff}[role]
+
+    def unique(self):
+        self._created += 1
+        return self._created
+
+    def new_product(self, shop_id=None):
+        return Product.objects.create(
+            shop_id=shop_id or self.shop_id, name=f"Bench product {self.unique()}", description='',
+            price='9.99', stock=10,
+        )
+
+    def new_manager(self):
+        """A shop of its own, for requests that would damage the shared one."""
+        n = self.unique()
+        shop = Shop.objects.create(name=f"Bench shop {n}", slug=f'bench-shop-{n}')
+        user = User.objects.create_user(username=f'bench-manager-{n}')
+        Manager.objects.create(user=user, shop=shop)
+        return shop, user
+
+    def new_shop_order(self):
+        order = Order.objects.create(user=self.buyer, total_amount='9.99')
+        return ShopOrder.objects.create(main_order=order, shop_id=self.shop_id, shop_total='9.99')
+
+    def fill_cart(self, user, lines=3):
+        cart, _ = Cart.objects.get_or_create(user=user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=pid, quantity=1) for pid in self.rng.sample(self.stocked_ids, lines)
+        ], ignore_conflicts=True)
+        return cart
+
+
+# Catalog
+
+@plan('api-root', 'GET')
+def api_root(fx, i, method):
+    return Call('/api/')
+
+
+@plan('product-list', 'GET')
+def product_list(fx, i, method):
+    query = fx.rng.choice([
+        '', '?in_stock=true', f'?shop={fx.rng.choice(fx.shop_ids)}', '?sort=best_selling',
+        '?min_price=10&max_price=100&page_size=50', '?price_band=0-25',
+    ])
+    return Call(f'/api/products/{query}')
+
+
+@plan('product-list', 'POST', role='manager')
+def product_create(fx, i, method):
+    return Call('/api/products/', {
+        'shop': fx.shop_id, 'name': f"Created {i}", 'description': "Benchmark", 'price': '12.50', 'stock': 5,
+        'sku': f'BENCH-{fx.unique()}',
+    })
+
+
+@plan('product-search', 'GET')
+def product_search(fx, i, method):
+    return Call(f"/api/products/search/?q={fx.rng.choice(['red shoe', 'wireless', 'leather jacket', 'mug'])}")
+
+
+@plan('product-bulk-import', 'POST', role='manager')
+def product_import(fx, i, method):
+    rows = '\n'.join(
+        f'IMP-{n},Imported {n},From the benchmark,{5 + n % 20}.00,{n % 7},,' for n in range(i * 50, i * 50 + 50)
+    )
+    upload = SimpleUploadedFile('catalog.csv', f'sku,name,description,price,stock,category,brand\n{rows}\n'.encode())
+    return Call('/api/products/import/', {'file': upload}, format='multipart')
+
+
+@plan('product-detail', 'GET')
+def product_detail(fx, i, method):
+    return Call(f'/api/products/{fx.rng.choice(fx.product_ids)}/')
+
+
+@plan('product-detail', 'PUT', 'PATCH', role='manager')
+def product_update(fx, i, method):
+    data = {'stock': fx.rng.randrange(1, 100)}
+    if method == 'PUT':
+        data.update({
+            'shop': fx.shop_id, 'name': f"Renamed {i}", 'description': "Updated", 'price': '15.00', 'sku': f'PUT-{i}',
+        })
+    return Call(f'/api/products/{fx.rng.choice(fx.own_product_ids)}/', data)
+
+
+@plan('product-detail', 'DELETE', role='manager')
+def product_delete(fx, i, method):
+    return Call(f'/api/products/{fx.new_product().pk}/')
+
+
+@plan('product-comments', 'GET')
+def product_comments(fx, i, method):
+    return Call(f'/api/products/{fx.rng.choice(fx.product_ids)}/comments/')
+
+
+@plan('shop-list', 'GET')
+def shop_list(fx, i, method):
+    return Call('/api/shops/')
+
+
+@plan('shop-list', 'POST', role='buyer')
+def shop_create(fx, i, method):
+    n = fx.unique()
+    return Call('/api/shops/', {'name': f"Opened shop {n}", 'slug': f'opened-shop-{n}'})
+
+
+@plan('shop-detail', 'GET')
+def shop_detail(fx, i, method):
+    return Call(f'/api/shops/{fx.rng.choice(fx.shop_ids)}/')
+
+
+@plan('shop-detail', 'PUT', 'PATCH', role='manager')
+def shop_update(fx, i, method):
+    data = {'description': f"Updated {i}"}
+    if method == 'PUT':
+        shop = Shop.objects.get(pk=fx.shop_id)
+        data.update({'name': shop.name, 'slug': shop.slug})
+    return Call(f'/api/shops/{fx.shop_id}/', data)
+
+
+@plan('shop-detail', 'DELETE')
+def shop_delete(fx, i, method):
+    shop, manager = fx.new_manager()
+    return Call(f'/api/shops/{shop.pk}/', user=manager)
+
+
+# Cart and checkout
+
+@plan('cart-list', 'GET', role='buyer')
+def cart_list(fx, i, method):
+    return Call('/api/cart/')
+
+
+@plan('cart-list', 'POST')
+def cart_create(fx, i, method):
+    user = next(fx.cartless)
+    return Call('/api/cart/', {'user': user.pk}, user=user)
+
+
+@plan('cart-detail', 'GET', 'PUT', 'PATCH', 'DELETE')
+def cart_detail(fx, i, method):
+    user = fx.buyer if method != 'DELETE' else next(fx.cartless)
+    cart = fx.fill_cart(user)
+    return Call(f'/api/cart/{cart.pk}/', {'user': user.pk} if method in ('PUT', 'PATCH') else None, user=user)
+
+
+@plan('cart-add-item', 'POST', role='buyer')
+def cart_add_item(fx, i, method):
+    return Call('/api/cart/add_item/', {'product_id': fx.rng.choice(fx.product_ids), 'quantity': 1})
+
+
+@plan('cart-update-items', 'POST', role='buyer')
+def cart_update_items(fx, i, method):
+    return Call('/api/cart/items/', {
+        'mode': 'set', 'items': [{'product_id': pid, 'quantity': 2} for pid in fx.rng.sample(fx.product_ids, 5)],
+    })
+
+
+@plan('cart-remove-item', 'POST', role='buyer')
+def cart_remove_item(fx, i, method):
+    product_id = fx.rng.choice(fx.product_ids)
+    CartItem.objects.get_or_create(cart=fx.fill_cart(fx.buyer, 0), product_id=product_id)
+    return Call('/api/cart/remove_item/', {'product_id': product_id})
+
+
+@plan('cart-checkout', 'POST', role='buyer')
+def cart_checkout(fx, i, method):
+    CartItem.objects.filter(cart__user=fx.buyer).delete()
+    fx.fill_cart(fx.buyer)
+    return Call('/api/cart/checkout/')
+
+
+# Orders and vendor tools
+
+@plan('order-list', 'GET', role='buyer')
+def order_list(fx, i, method):
+    return Call('/api/orders/')
+
+
+@plan('order-detail', 'GET', role='buyer')
+def order_detail(fx, i, method):
+    return Call(f'/api/orders/{fx.rng.choice(fx.order_ids)}/')
+
+
+@plan('vendor-order-list', 'GET', role='manager')
+def vendor_order_list(fx, i, method):
+    return Call('/api/vendor-orders/')
+
+
+@plan('vendor-order-detail', 'GET', 'PUT', 'PATCH', role='manager')
+def vendor_order_detail(fx, i, method):
+    data = None
+    if method == 'PATCH':
+        data = {'status': 'processing'}
+    elif method == 'PUT':
+        data = {'shop': fx.shop_id, 'status': 'processing', 'shop_total': '9.99'}
+    return Call(f'/api/vendor-orders/{fx.rng.choice(fx.shop_order_ids)}/', data)
+
+
+@plan('vendor-order-detail', 'DELETE', role='manager')
+def vendor_order_delete(fx, i, method):
+    return Call(f'/api/vendor-orders/{fx.new_shop_order().pk}/')
+
+
+@plan('vendor-order-update-status', 'POST', role='manager')
+def vendor_order_update_status(fx, i, method):
+    status = fx.rng.choice(['processing', 'shipped', 'delivered'])
+    return Call(f'/api/vendor-orders/{fx.rng.choice(fx.shop_order_ids)}/update_status/', {'status': status})
+
+
+@plan('vendor-order-export', 'GET', role='manager')
+def vendor_order_export(fx, i, method):
+    return Call(f"/api/vendor-orders/export/?type={fx.rng.choice(['csv', 'ndjson'])}")
+
+
+@plan('vendor-analytics-list', 'GET', role='manager')
+def vendor_analytics(fx, i, method):
+    return Call('/api/vendor-analytics/')
+
+
+@plan('comment-moderation-list', 'GET', role='manager')
+def moderation_queue(fx, i, method):
+    return Call('/api/moderation/comments/')
+
+
+@plan('comment-moderation-moderate', 'POST', role='manager')
+def moderate_comments(fx, i, method):
+    comments = Comment.objects.bulk_create([
+        Comment(product_id=pid, shop_id=fx.shop_id, user=fx.buyer, comment="Benchmark comment")
+        for pid in fx.rng.choices(fx.own_product_ids, k=200)
+    ])
+    verdict = 'approve' if i % 2 else 'reject'
+    return Call('/api/moderation/comments/moderate/', {'action': verdict, 'ids': [comment.pk for comment in comments]})
+
+
+@plan('metrics', 'GET', role='staff')
+def metrics(fx, i, method):
+    return Call('/api/metrics/')
+
+
+# Async views
+
+@plan('async-product-list', 'GET')
+def async_product_list(fx, i, method):
+    return Call(f"/api/async/products/{fx.rng.choice(['', '?in_stock=true', '?page_size=50'])}")
+
+
+@plan('async-product-detail', 'GET')
+def async_product_detail(fx, i, method):
+    return Call(f'/api/async/products/{fx.rng.choice(fx.product_ids)}/')
+
+
+@plan('async-shop-list', 'GET')
+def async_shop_list(fx, i, method):
+    return Call('/api/async/shops/')
+
+
+@plan('async-order-list', 'GET', role='buyer')
+def async_order_list(fx, i, method):
+    return Call('/api/async/orders/')
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def send(client, fx, route, method, iteration):
+    """Prepares and sends one request; returns (seconds, queries, status)."""
+    func, role = PLANS[(route, method)]
+    call = func(fx, iteration, method)
+    user = call.user or fx.user_for(role)
+    headers = {'HTTP_AUTHORIZATION': fx.auth(user)} if user is not None else {}
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter), Timer() as timer:
+        response = getattr(client, method.lower())(call.path, call.data, format=call.format, **headers)
+        if response.streaming:
+            b''.join(response.streaming_content)
+    return timer.elapsed, counter.count, response.status_code
+
+
+def measure(client, fx, route, method, iterations):
+    for i in range(WARMUP):
+        send(client, fx, route, method, i)
+    latencies, queries, statuses = [], [], {}
+    rss_before = current_rss_kb()
+    for i in range(WARMUP, WARMUP + iterations):
+        seconds, count, status = send(client, fx, route, method, i)
+        latencies.append(seconds)
+        queries.append(count)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    rss_growth = current_rss_kb() - rss_before
+
+    peaks = []
+    for i in range(WARMUP + iterations, WARMUP + iterations + MEMORY_SAMPLES):
+        tracemalloc.start()
+        try:
+            send(client, fx, route, method, i)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+        finally:
+            tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        'requests': iterations,
+        'statuses': statuses,
+        'p50_ms': _ms(statistics.median(latencies)),
+        'p95_ms': _ms(_percentile(latencies, 0.95)),
+        'p99_ms': _ms(_percentile(latencies, 0.99)),
+        'max_ms': _ms(latencies[-1]),
+        'queries_per_request': round(statistics.mean(queries), 2),
+        'max_queries': max(queries),
+        'peak_alloc_kb': max(peaks) // 1024,
+        'rss_growth_kb': rss_growth,
+    }
+
+
+def compare(routes, baseline, tolerance=TOLERANCE):
+    """Routes slower at p95 by more than tolerance, or making more queries, than in baseline."""
+    regressions = []
+    for key, current in routes.items():
+        before = baseline.get('routes', {}).get(key)
+        if before is None:
+            continue
+        if current['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append({
+                'route': key, 'metric': 'p95_ms', 'baseline': before['p95_ms'], 'current': current['p95_ms'],
+            })
+        if current['queries_per_request'] > before['queries_per_request']:
+            regressions.append({
+                'route': key, 'metric': 'queries_per_request',
+                'baseline': before['queries_per_request'], 'current': current['queries_per_request'],
+            })
+    return regressions
+
+
+@scenario('endpoints')
+def endpoints(options):
+    """
+    Every route of shop/urls.py, driven in-process through the full middleware
+    stack against a generated dataset (--scale, or --products to override its
+    product count). Per route and method: latency percentiles, queries per
+    request, peak memory allocated by one request and RSS growth over the run.
+    With --baseline (an earlier --output file) routes slower at p95 than
+    --tolerance allows, or making more queries, are listed as regressions.
+    """
+    counts = dict(SCALES[options['scale']])
+    if options['products']:
+        counts['products'] = options['products']
+    with Timer() as timer:
+        created = generate(counts, seed=options['seed'])
+    fx = Fixtures(options['seed'])
+    client = APIClient()
+
+    results, missing = {}, []
+    for route, method in routes():
+        key = f'{method} {route}'
+        if (route, method) in SKIPPED:
+            continue
+        if (route, method) not in PLANS:
+            missing.append(key)
+            continue
+        fx.rng.seed(f"{options['seed']}-{key}")  # the same choices whatever routes run before
+        results[key] = measure(client, fx, route, method, options['iterations'])
+
+    output = {
+        'dataset': created,
+        'dataset_seconds': round(timer.elapsed, 1),
+        'iterations': options['iterations'],
+        'routes': results,
+        'skipped': {f'{method} {route}': reason for (route, method), reason in SKIPPED.items()},
+        'not_covered': missing,
+    }
+    if options['baseline']:
+        with open(options['baseline']) as fh:
+            baseline = json.load(fh)
+        output['baseline_commit'] = baseline.get('environment', {}).get('commit')
+        output['regressions'] = compare(results, baseline, options['tolerance'])
+    return output
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
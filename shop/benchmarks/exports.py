@@ -0,0 +1,81 @@
+import os
+import resource
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+
+from .. import exports
+from ..models import Order, OrderDetail, Product, Shop, ShopOrder
+from . import Timer, scenario
+
+SEED_BATCH_SIZE = 5000
+LINES_PER_ORDER = 5
+
+
+def current_rss_kb():
+    """Resident set size of this process in KiB (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as fh:
+            pages = int(fh.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def seed_order_lines(shop, user, count):
+    """Bulk-inserts count order lines for shop, LINES_PER_ORDER per shop order."""
+    products = Product.objects.bulk_create([
+        Product(shop=shop, name=f"{shop.name} item {i}", description='', price=Decimal('3.50') + i, stock=0)
+        for i in range(50)
+    ])
+    for start in range(0, count, SEED_BATCH_SIZE):
+        lines = min(SEED_BATCH_SIZE, count - start)
+        orders_count = -(-lines // LINES_PER_ORDER)
+        orders = Order.objects.bulk_create([Order(user=user) for _ in range(orders_count)])
+        shop_orders = ShopOrder.objects.bulk_create([
+            ShopOrder(main_order=order, shop=shop, shop_total=Decimal('50.00')) for order in orders
+        ])
+        OrderDetail.objects.bulk_create([
+            OrderDetail(
+                order=orders[i // LINES_PER_ORDER], shop_order=shop_orders[i // LINES_PER_ORDER],
+                product=products[(start + i) % len(products)], quantity=1 + i % 3,
+                price=products[(start + i) % len(products)].price
+            )
+            for i in range(lines)
+        ], batch_size=SEED_BATCH_SIZE)
+
+
+def measure_export(shop_id, file_format):
+    baseline = peak = current_rss_kb()
+    size = 0
+    with Timer() as timer:
+        for chunk in exports.export_orders(shop_id, file_format):
+            size += len(chunk)
+            peak = max(peak, current_rss_kb())
+    return {'seconds': round(timer.elapsed, 3), 'chars': size, 'rss_growth_kb': peak - baseline}
+
+
+@scenario('order_export')
+def order_export(options):
+    """
+    Streams a small and a large shop's order history as CSV and NDJSON.
+    Reports rows per second and RSS growth; growth should not depend on row count.
+    """
+    rows = options['rows']
+    user = User.objects.create(username='bench-buyer')
+    small = Shop.objects.create(name="Small Shop", slug='small-shop')
+    large = Shop.objects.create(name="Large Shop", slug='large-shop')
+    seed_order_lines(small, user, max(rows // 100, 1))
+    seed_order_lines(large, user, rows)
+
+    results = []
+    for shop in (small, large):
+        lines = OrderDetail.objects.filter(shop_order__shop=shop).count()
+        for file_format in exports.ENCODERS:
+            run = measure_export(shop.id, file_format)
+            results.append({
+                'shop': shop.name, 'format': file_format, 'rows': lines,
+                'rows_per_second': round(lines / run['seconds']) if run['seconds'] else None,
+                **run,
+            })
+    return {'exports': results}
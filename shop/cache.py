@@ -0,0 +1,306 @@
+"""
+Read-through cache for catalog (product) payloads.
+
+Two tiers:
+  * a bounded in-process LRU holding serialized payloads, and
+  * a shared Django cache backend (CACHES alias, LocMemCache in development and
+    tests, Redis/Memcached in production).
+
+Entries are never deleted on writes. Instead each product, each shop and the
+catalog as a whole carry a version token stored in the shared backend, and
+every cache key embeds the tokens it depends on. Bumping a token (from model
+signals, see shop/signals.py) makes all dependent keys unreachable at once.
+With a backend shared by every process (Redis, Memcached) that holds across
+processes too. A per-process backend (LocMemCache) keeps per-process tokens,
+so another process's writes are not seen until its entries expire: both
+tiers keep entries for at most TIMEOUT seconds, which bounds that staleness.
+
+Async views use the a-prefixed read methods, which go through the backend's
+async API; invalidation only happens on the (sync) write paths.
+"""
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+DEFAULTS = {
+    'ENABLED': True,
+    'BACKEND': 'default',
+    'TIMEOUT': 300,
+    'LOCAL_MAX_ENTRIES': 1024,
+    'KEY_PREFIX': 'catalog',
+}
+
+
+class LRUCache:
+    """
+    Thread-safe bounded mapping that evicts the least recently used entry.
+    Entries expire ttl seconds after being set (None: never).
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return default
+            if expires is not None and time.monotonic() >= expires:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (None if self.ttl is None else time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class CatalogCache:
+    """Versioned read-through cache for product detail payloads and list pages."""
+
+    def __init__(self):
+        # No longer than the shared tier, whose expiry bounds cross-process staleness
+        self.local = LRUCache(self.options['LOCAL_MAX_ENTRIES'], ttl=self.options['TIMEOUT'])
+        self._counter_lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def options(self):
+        # Read on access so override_settings() applies in tests
+        return {**DEFAULTS, **getattr(settings, 'CATALOG_CACHE', {})}
+
+    @property
+    def enabled(self):
+        return self.options['ENABLED']
+
+    @property
+    def shared(self):
+        return caches[self.options['BACKEND']]
+
+    @property
+    def shares_versions(self):
+        """False when every process keeps its own backend, and so its own version tokens."""
+        return not isinstance(self.shared, (LocMemCache, DummyCache))
+
+    # Public API
+
+    def get_product(self, product_id, loader, variant=''):
+        """
+        Returns the payload for one product, calling loader() on a miss.
+        The key depends on the product's and its shop's version tokens, and on
+        variant, which distinguishes renderings of the same product (e.g. under
+        different active discounts).
+        """
+        if not self.enabled:
+            return loader()
+        product_version = self._versions([self._version_key('product', product_id)])[0]
+        key = self._key('product', product_id, product_version, variant)
+        entry, tier = self._get(key)
+        if entry is not None:
+            shop_version = self._versions([self._version_key('shop', entry['shop_id'])])[0]
+            if entry['shop_version'] == shop_version:
+                self._count(tier)
+                return entry['data']
+
+        self._count('misses')
+        data = loader()
+        shop_id = data.get('shop')
+        shop_version = self._versions([self._version_key('shop', shop_id)])[0]
+        self._set(
+            key,
+            {'shop_id': shop_id, 'shop_version': shop_version, 'data': data}
+        )
+        return data
+
+    def get_list(self, scope, loader):
+        """
+        Returns a list page payload identified by scope (e.g. the request URI),
+        calling loader() on a miss. Any catalog change invalidates every page.
+        """
+        if not self.enabled:
+            return loader()
+        catalog_version = self._versions([self._version_key('catalog')])[0]
+        digest = hashlib.sha1(scope.encode()).hexdigest()
+        key = self._key('list', digest, catalog_version)
+        data, tier = self._get(key)
+        if data is not None:
+            self._count(tier)
+            return data
+
+        self._count('misses')
+        data = loader()
+        self._set(key, data)
+        return data
+
+    async def aget_product(self, product_id, loader, variant=''):
+        """get_product() for async views; loader is a coroutine function."""
+        if not self.enabled:
+            return await loader()
+        product_version = (await self._aversions([self._version_key('product', product_id)]))[0]
+        key = self._key('product', product_id, product_version, variant)
+        entry, tier = await self._aget(key)
+        if entry is not None:
+            shop_version = (await self._aversions([self._version_key('shop', entry['shop_id'])]))[0]
+            if entry['shop_version'] == shop_version:
+                self._count(tier)
+                return entry['data']
+
+        self._count('misses')
+        data = await loader()
+        shop_id = data.get('shop')
+        shop_version = (await self._aversions([self._version_key('shop', shop_id)]))[0]
+        await self._aset(key, {'shop_id': shop_id, 'shop_version': shop_version, 'data': data})
+        return data
+
+    async def aget_list(self, scope, loader):
+        """get_list() for async views; loader is a coroutine function."""
+        if not self.enabled:
+            return await loader()
+        key = self._key('list', hashlib.sha1(scope.encode()).hexdigest(), await self.acatalog_version())
+        data, tier = await self._aget(key)
+        if data is not None:
+            self._count(tier)
+            return data
+
+        self._count('misses')
+        data = await loader()
+        await self._aset(key, data)
+        return data
+
+    def catalog_version(self):
+        """Token that changes whenever any product payload or list page may have changed."""
+        return self._versions([self._version_key('catalog')])[0]
+
+    async def acatalog_version(self):
+        return (await self._aversions([self._version_key('catalog')]))[0]
+
+    def version(self, name):
+        """Version token of another cached dataset (e.g. loaded discounts)."""
+        return self._versions([self._version_key(name)])[0]
+
+    async def aversion(self, name):
+        return (await self._aversions([self._version_key(name)]))[0]
+
+    def bump(self, name):
+        self._bump([self._version_key(name)])
+
+    def invalidate_products(self, product_ids):
+        """Bumps the version of the given products and of every list page."""
+        keys = [self._version_key('product', pid) for pid in product_ids]
+        self._bump(keys + [self._version_key('catalog')])
+
+    def invalidate_shop(self, shop_id):
+        """Bumps the version of a shop (embedded in its products) and of every list page."""
+        self._bump([self._version_key('shop', shop_id), self._version_key('catalog')])
+
+    def stats(self):
+        with self._counter_lock:
+            counters = dict(self._counters)
+        counters['evictions'] = self.local.evictions
+        counters['local_entries'] = len(self.local)
+        return counters
+
+    def reset_stats(self):
+        with self._counter_lock:
+            self._counters = {'local_hits': 0, 'shared_hits': 0, 'misses': 0}
+
+    def clear_local(self):
+        self.local.clear()
+
+    # Internals
+
+    def _key(self, *parts):
+        return ':'.join([self.options['KEY_PREFIX'], *map(str, parts)])
+
+    def _version_key(self, *parts):
+        return self._key('version', *parts)
+
+    def _versions(self, keys):
+        """Reads version tokens, creating a fresh unique token for any that is missing."""
+        found = self.shared.get_many(keys)
+        missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+        if missing:
+            # add() keeps a token another process created in the meantime
+            for key, token in missing.items():
+                if not self.shared.add(key, token, timeout=None):
+                    missing[key] = self.shared.get(key, token)
+            found.update(missing)
+        return [found[key] for key in keys]
+
+    async def _aversions(self, keys):
+        found = await self.shared.aget_many(keys)
+        missing = {key: uuid.uuid4().hex for key in keys if key not in found}
+        if missing:
+            for key, token in missing.items():
+                if not await self.shared.aadd(key, token, timeout=None):
+                    missing[key] = await self.shared.aget(key, token)
+            found.update(missing)
+        return [found[key] for key in keys]
+
+    def _bump(self, keys):
+        def bump():
+            self.shared.set_many({key: uuid.uuid4().hex for key in keys}, timeout=None)
+
+        bump()
+        # Bump again once the writing transaction commits, so a reader that
+        # cached pre-commit data in between is invalidated as well
+        transaction.on_commit(bump)
+
+    def _get(self, key):
+        """Returns (value, counter name of the tier that served it)."""
+        value = self.local.get(key)
+        if value is not None:
+            return value, 'local_hits'
+        value = self.shared.get(key)
+        if value is not None:
+            self.local.set(key, value)
+        return value, 'shared_hits'
+
+    def _set(self, key, value):
+        self.local.set(key, value)
+        self.shared.set(key, value, timeout=self.options['TIMEOUT'])
+
+    async def _aget(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value, 'local_hits'
+        value = await self.shared.aget(key)
+        if value is not None:
+            self.local.set(key, value)
+        return value, 'shared_hits'
+
+    async def _aset(self, key, value):
+        self.local.set(key, value)
+        await self.shared.aset(key, value, timeout=self.options['TIMEOUT'])
+
+    def _count(self, name):
+        with self._counter_lock:
+            self._counters[name] += 1
+
+
+catalog_cache = CatalogCache()
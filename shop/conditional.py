@@ -0,0 +1,124 @@
+"""
+Conditional GET for the read endpoints.
+
+A view's validators (ETag and Last-Modified) are derived from an aggregate
+over the rows its response is built from -- MAX(updated_at) of the relevant
+tables and a row count -- so checking them costs one small query and no
+serialization. When the client's If-None-Match / If-Modified-Since match, a
+304 is returned right after authentication, before the queryset is loaded.
+
+Responses whose validators would need an aggregate over a large row set (the
+product list without a shared cache) are validated by their body instead: a
+weak ETag over the rendered payload, which saves the transfer but not the work.
+"""
+import hashlib
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+def make_etag(request, user_pk, parts):
+    """Strong ETag over the validator parts of one resource as seen by one user."""
+    # The URL carries ?fields=, filters and cursors; the user scopes private data
+    token = '|'.join(map(str, [request.get_full_path(), user_pk, *parts]))
+    return quote_etag(hashlib.sha1(token.encode()).hexdigest())
+
+
+def content_etag(data):
+    """Weak ETag over a rendered payload."""
+    return 'W/' + quote_etag(hashlib.sha1(JSONRenderer().render(data)).hexdigest())
+
+
+def validators_row(rows, validator_fields):
+    """
+    Splits an aggregate row of Count('pk') as 'rows' and Max(field) as max_<i>
+    into (etag parts, last modified).
+    """
+    maxima = [rows[f'max_{index}'] for index in range(len(validator_fields))]
+    stamps = [value for value in maxima if value]
+    return [rows['rows'], *maxima], max(stamps) if stamps else None
+
+
+def validator_aggregates(validator_fields):
+    aggregates = {f'max_{index}': Max(field) for index, field in enumerate(validator_fields)}
+    return {'rows': Count('pk', distinct=True), **aggregates}
+
+
+class NotModified(Exception):
+    def __init__(self, response):
+        self.response = response
+
+
+class ConditionalGetMixin:
+    """
+    ViewSet mixin adding ETag/Last-Modified to list and retrieve.
+    validator_fields lists the timestamp lookups whose maximum changes
+    whenever the rendered rows change (e.g. 'updated_at', 'shop__updated_at').
+    """
+    conditional_actions = ('list', 'retrieve')
+    validator_fields = ('updated_at',)
+
+    def get_validator_queryset(self):
+        """The rows the response is rendered from, as scoped and filtered by the view."""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            queryset = queryset.filter(pk=self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+        return queryset
+
+    def get_validators(self):
+        """
+        Returns (etag token parts, last modified datetime or None), or None to
+        skip conditional handling.
+        """
+        try:
+            row = self.get_validator_queryset().order_by().aggregate(
+                **validator_aggregates(self.validator_fields)
+            )
+        except (TypeError, ValueError, ValidationError):
+            return None  # malformed lookup value; the view reports it
+        if self.action == 'retrieve' and not row['rows']:
+            return None  # let the view answer 404
+        return validators_row(row, self.validator_fields)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self._validators = None
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return
+        validators = self.get_validators()
+        if validators is None:
+            return
+        parts, last_modified = validators
+        etag = make_etag(request, request.user.pk, parts)
+        self._validators = (etag, last_modified)
+
+        response = get_conditional_response(
+            request, etag=etag,
+            last_modified=int(last_modified.timestamp()) if last_modified else None
+        )
+        if response is not None:
+            raise NotModified(response)
+
+    def content_validated_response(self, request, data):
+        """Response for data whose get_validators() returned None, validated by its body."""
+        self._validators = content_etag(data), None
+        return get_conditional_response(request, etag=self._validators[0]) or Response(data)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        validators = getattr(self, '_validators', None)
+        if validators is not None and response.status_code in (200, 304):
+            etag, last_modified = validators
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified.timestamp())
+        return response
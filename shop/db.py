@@ -0,0 +1,51 @@
+"""
+SQL helpers shared by the precomputed summary tables (facet counts, sales rollups).
+"""
+from datetime import date
+from decimal import Decimal
+
+from django.db import connection
+
+# Rows per INSERT statement; keeps well below SQLite's bound-variable limit
+UPSERT_BATCH_SIZE = 500
+
+
+def increment_rows(model, key_columns, value_columns, cells):
+    """
+    Adds values to summary rows, creating missing rows, with multi-row
+        INSERT ... ON CONFLICT (key) DO UPDATE SET value = value + excluded.value
+    key_columns must match a unique constraint of the model.
+    cells: {key tuple: [value, ...]}; all-zero increments are skipped.
+    """
+    items = [(key, values) for key, values in cells.items() if any(values)]
+    if not items:
+        return
+    table = model._meta.db_table
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in (*key_columns, *value_columns))
+    row_sql = '(' + ', '.join(['%s'] * (len(key_columns) + len(value_columns))) + ')'
+    updates = ', '.join(
+        f'{quote(column)} = {quote(table)}.{quote(column)} + excluded.{quote(column)}'
+        for column in value_columns
+    )
+    conflict = ', '.join(quote(column) for column in key_columns)
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), UPSERT_BATCH_SIZE):
+            batch = items[start:start + UPSERT_BATCH_SIZE]
+            params = []
+            for key, values in batch:
+                params.extend(_adapt(value) for value in (*key, *values))
+            cursor.execute(
+                f"INSERT INTO {quote(table)} ({columns}) VALUES "
+                f"{', '.join([row_sql] * len(batch))} "
+                f"ON CONFLICT ({conflict}) DO UPDATE SET {updates}",
+                params
+            )
+
+
+def _adapt(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
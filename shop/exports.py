@@ -0,0 +1,88 @@
+"""
+Streaming exports of a shop's order history.
+
+Rows are read with a server-side iterator over a flat values_list() query
+(one row per order line, shop orders without lines included) and encoded
+straight to CSV or NDJSON text, skipping model instances and serializers.
+Encoded rows are yielded in chunks, so memory stays bounded by the chunk
+size whatever the size of the history.
+"""
+import csv
+import io
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import ShopOrder
+
+EXPORT_CHUNK_SIZE = 2000
+
+# (column name, ShopOrder lookup)
+COLUMNS = [
+    ('shop_order_id', 'id'),
+    ('order_id', 'main_order_id'),
+    ('created_at', 'created_at'),
+    ('status', 'status'),
+    ('shop_total', 'shop_total'),
+    ('line_id', 'items__id'),
+    ('product_id', 'items__product_id'),
+    ('product_name', 'items__product__name'),
+    ('quantity', 'items__quantity'),
+    ('price', 'items__price'),
+]
+HEADER = [name for name, _ in COLUMNS]
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def order_lines(shop_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields one tuple per order line of the shop, in order id order."""
+    return (
+        ShopOrder.objects.filter(shop_id=shop_id)
+        .order_by('id', 'items__id')
+        .values_list(*(lookup for _, lookup in COLUMNS))
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_csv(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HEADER)
+    for chunk in _chunks(rows, chunk_size):
+        writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_ndjson(rows, chunk_size=EXPORT_CHUNK_SIZE):
+    encode = DjangoJSONEncoder(separators=(',', ':')).encode
+    for chunk in _chunks(rows, chunk_size):
+        yield ''.join(encode(dict(zip(HEADER, row))) + '\n' for row in chunk)
+
+
+ENCODERS = {
+    'csv': stream_csv,
+    'ndjson': stream_ndjson,
+}
+
+
+def export_orders(shop_id, file_format, chunk_size=EXPORT_CHUNK_SIZE):
+    """Returns an iterator of encoded text chunks for the shop's order lines."""
+    return ENCODERS[file_format](order_lines(shop_id, chunk_size), chunk_size)
@@ -0,0 +1,255 @@
+"""
+Facet counts for the product catalog.
+
+Counts are served from ProductFacetCount, a summary table with one row per
+combination of (shop, category, brand, price band, in stock) holding the
+number of products in that cell. Any filter made only of facet values can be
+answered by summing cells, so facet counts for unfiltered and broad queries
+never touch the product table. The table is maintained incrementally from
+product signals and stock reservations, and can be rebuilt with
+`manage.py rebuild_facet_counts`. Reservations only queue their deltas on the
+outbox, so checkouts never write the summary table's hot rows.
+"""
+import asyncio
+from collections import Counter
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import (
+    BooleanField, Case, Count, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+)
+
+from .db import increment_rows
+from .models import Brand, Category, Product, ProductFacetCount, Shop
+from .services import outbox
+
+# (key, lower bound inclusive, upper bound exclusive or None)
+PRICE_BANDS = [
+    ('0-25', Decimal('0'), Decimal('25')),
+    ('25-50', Decimal('25'), Decimal('50')),
+    ('50-100', Decimal('50'), Decimal('100')),
+    ('100-250', Decimal('100'), Decimal('250')),
+    ('250-500', Decimal('250'), Decimal('500')),
+    ('500+', Decimal('500'), None),
+]
+PRICE_BAND_KEYS = [key for key, _, _ in PRICE_BANDS]
+
+# Product fields that determine a product's facet cell
+KEY_FIELDS = ('shop_id', 'category_id', 'brand_id', 'price', 'stock')
+
+# Summary table columns making up a facet key, in facet_key() order
+KEY_COLUMNS = ('shop_id', 'category_id', 'brand_id', 'price_band', 'in_stock')
+
+STOCK_DEPLETED = 'facets.stock_depleted'
+
+# Facet name -> (summary column, label model)
+LABELLED_FACETS = {
+    'category': ('category_id', Category),
+    'brand': ('brand_id', Brand),
+    'shop': ('shop_id', Shop),
+}
+
+
+def price_band(price):
+    """Index into PRICE_BANDS for a price."""
+    price = Decimal(str(price))
+    for index, (_, lower, upper) in enumerate(PRICE_BANDS):
+        if upper is None or price < upper:
+            return index
+    return len(PRICE_BANDS) - 1
+
+
+def price_band_case(field='price'):
+    """SQL expression computing price_band() in the database."""
+    return Case(
+        *[
+            When(**{f'{field}__lt': upper}, then=Value(index))
+            for index, (_, _, upper) in enumerate(PRICE_BANDS) if upper is not None
+        ],
+        default=Value(len(PRICE_BANDS) - 1),
+        output_field=IntegerField()
+    )
+
+
+def facet_key(shop_id, category_id, brand_id, price, stock):
+    return (shop_id, category_id or 0, brand_id or 0, price_band(price), stock > 0)
+
+
+def product_key(product):
+    return facet_key(*(getattr(product, field) for field in KEY_FIELDS))
+
+
+# Incremental maintenance
+
+def apply_deltas(deltas):
+    """Adds {facet key: delta} to the summary table, creating cells as needed."""
+    increment_rows(
+        ProductFacetCount, KEY_COLUMNS, ('count',),
+        {key: [delta] for key, delta in deltas.items()}
+    )
+
+
+def product_changed(old_key, new_key):
+    """Moves a product between cells; either key may be None (created/deleted)."""
+    if old_key == new_key:
+        return
+    deltas = Counter()
+    if old_key is not None:
+        deltas[old_key] -= 1
+    if new_key is not None:
+        deltas[new_key] += 1
+    apply_deltas(deltas)
+
+
+def stock_depleted(product_ids):
+    """
+    Called inside the transaction in which a queryset update decremented stock
+    for product_ids: queues moving every product that reached zero from its
+    in-stock cell to the out-of-stock one. The cells are taken now, as of the
+    reservation, and applied by the outbox worker.
+    """
+    deltas = Counter()
+    depleted = Product.objects.filter(pk__in=product_ids, stock=0).values_list(*KEY_FIELDS)
+    for shop_id, category_id, brand_id, price, _ in depleted:
+        deltas[facet_key(shop_id, category_id, brand_id, price, 1)] -= 1
+        deltas[facet_key(shop_id, category_id, brand_id, price, 0)] += 1
+    if deltas:
+        outbox.publish(STOCK_DEPLETED, {'deltas': [[list(key), delta] for key, delta in deltas.items()]})
+
+
+@outbox.subscriber(STOCK_DEPLETED)
+def apply_depleted_stock(payload):
+    apply_deltas({tuple(key): delta for key, delta in payload['deltas']})
+
+
+def label_removed(column, label_id):
+    """
+    Merges the cells of a deleted category or brand into the "none" (0) cells,
+    mirroring the on_delete=SET_NULL applied to its products.
+    """
+    deltas = Counter()
+    cells = ProductFacetCount.objects.filter(**{column: label_id})
+    for cell in cells:
+        key = [cell.shop_id, cell.category_id, cell.brand_id, cell.price_band, cell.in_stock]
+        key[('category_id', 'brand_id').index(column) + 1] = 0
+        deltas[tuple(key)] += cell.count
+    cells.delete()
+    apply_deltas(deltas)
+
+
+def rebuild_counts():
+    """Recomputes the summary table from the product table in one GROUP BY."""
+    rows = (
+        Product.objects
+        .annotate(band=price_band_case(), has_stock=Case(
+            When(stock__gt=0, then=Value(True)), default=Value(False)
+        ))
+        .values('shop_id', 'category_id', 'brand_id', 'band', 'has_stock')
+        .annotate(n=Count('id'))
+        .order_by()
+    )
+    cells = [
+        ProductFacetCount(
+            shop_id=row['shop_id'], category_id=row['category_id'] or 0,
+            brand_id=row['brand_id'] or 0, price_band=row['band'],
+            in_stock=row['has_stock'], count=row['n']
+        )
+        for row in rows
+    ]
+    with transaction.atomic():
+        ProductFacetCount.objects.all().delete()
+        ProductFacetCount.objects.bulk_create(cells, batch_size=1000)
+    return len(cells)
+
+
+# Counting
+
+def summary_counts(filters):
+    """
+    Facet counts computed from the summary table, one aggregate query per facet.
+    filters maps facet name -> list of accepted values (see ProductFilter).
+    """
+    return _evaluate(_summary_plan(filters))
+
+
+def live_counts(queryset):
+    """Facet counts aggregated directly over a filtered product queryset."""
+    return _evaluate(_live_plan(queryset))
+
+
+async def asummary_counts(filters):
+    """summary_counts() for async views; the per-facet queries run concurrently."""
+    return await _aevaluate(_summary_plan(filters))
+
+
+async def alive_counts(queryset):
+    return await _aevaluate(_live_plan(queryset))
+
+
+def _summary_plan(filters):
+    """Facet name -> (unevaluated rows, row -> facet entry)."""
+    cells = ProductFacetCount.objects.filter(count__gt=0)
+    for name, values in filters.items():
+        cells = cells.filter(_summary_condition(name, values))
+
+    plan = {}
+    for name, (column, model) in LABELLED_FACETS.items():
+        label = Subquery(model.objects.filter(pk=OuterRef(column)).values('name')[:1])
+        plan[name] = (
+            cells.values(column).annotate(n=Sum('count'), label=label).order_by(column),
+            lambda row, column=column: {'value': row[column] or None, 'label': row['label'], 'count': row['n']}
+        )
+    plan['price_band'] = (
+        cells.values('price_band').annotate(n=Sum('count')).order_by('price_band'),
+        lambda row: {'value': PRICE_BAND_KEYS[row['price_band']], 'count': row['n']}
+    )
+    plan['in_stock'] = (
+        cells.values('in_stock').annotate(n=Sum('count')).order_by('-in_stock'),
+        lambda row: {'value': row['in_stock'], 'count': row['n']}
+    )
+    return plan
+
+
+def _live_plan(queryset):
+    queryset = queryset.order_by()
+    plan = {}
+    for name in LABELLED_FACETS:
+        plan[name] = (
+            queryset.values(name).annotate(n=Count('id'), label=F(f'{name}__name')).order_by(name),
+            lambda row, name=name: {'value': row[name], 'label': row['label'], 'count': row['n']}
+        )
+    plan['price_band'] = (
+        queryset.annotate(band=price_band_case()).values('band').annotate(n=Count('id')).order_by('band'),
+        lambda row: {'value': PRICE_BAND_KEYS[row['band']], 'count': row['n']}
+    )
+    in_stock = ExpressionWrapper(Q(stock__gt=0), output_field=BooleanField())
+    plan['in_stock'] = (
+        queryset.annotate(in_stock=in_stock).values('in_stock').annotate(n=Count('id')).order_by('-in_stock'),
+        lambda row: {'value': row['in_stock'], 'count': row['n']}
+    )
+    return plan
+
+
+def _evaluate(plan):
+    return {name: [entry(row) for row in rows] for name, (rows, entry) in plan.items()}
+
+
+async def _aevaluate(plan):
+    async def fetch(rows):
+        return [row async for row in rows]
+
+    results = await asyncio.gather(*(fetch(rows) for rows, _ in plan.values()))
+    return {
+        name: [entry(row) for row in rows]
+        for (name, (_, entry)), rows in zip(plan.items(), results)
+    }
+
+
+def _summary_condition(name, values):
+    if name in LABELLED_FACETS:
+        return Q(**{f'{LABELLED_FACETS[name][0]}__in': [value or 0 for value in values]})
+    if name == 'price_band':
+        return Q(price_band__in=[PRICE_BAND_KEYS.index(value) for value in values])
+    if name == 'in_stock':
+        return Q(in_stock__in=values)
+    raise ValueError(f"Unknown facet {name!r}")
@@ -0,0 +1,125 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from . import facets
+
+
+class ProductFilter:
+    """
+    Catalog filters parsed from the query string:
+        ?category=1,2  ?brand=3  ?shop=4   (ids, comma separated; "none" = unset)
+        ?price_band=25-50,50-100           (see facets.PRICE_BANDS)
+        ?in_stock=true|false
+        ?min_price=10&max_price=99.99      (free range, disables the facet summary)
+    """
+    ID_FACETS = ('category', 'brand', 'shop')
+
+    def __init__(self, query_params):
+        self.facet_filters = {}
+        errors = {}
+        for name in self.ID_FACETS:
+            if name in query_params:
+                try:
+                    self.facet_filters[name] = self._parse_ids(query_params[name], allow_none=name != 'shop')
+                except ValueError:
+                    errors[name] = "Expected comma separated ids."
+        if 'price_band' in query_params:
+            bands = query_params['price_band'].split(',')
+            if set(bands) - set(facets.PRICE_BAND_KEYS):
+                errors['price_band'] = f"Expected any of {', '.join(facets.PRICE_BAND_KEYS)}."
+            else:
+                self.facet_filters['price_band'] = bands
+        if 'in_stock' in query_params:
+            value = query_params['in_stock'].lower()
+            if value not in ('true', 'false', '1', '0'):
+                errors['in_stock'] = "Expected true or false."
+            else:
+                self.facet_filters['in_stock'] = [value in ('true', '1')]
+
+        self.min_price = self._parse_price(query_params, 'min_price', errors)
+        self.max_price = self._parse_price(query_params, 'max_price', errors)
+        if errors:
+            raise ValidationError(errors)
+
+    @property
+    def uses_summary(self):
+        """Facet-only filters can be answered from the precomputed summary table."""
+        return self.min_price is None and self.max_price is None
+
+    def filter_queryset(self, queryset):
+        for name, values in self.facet_filters.items():
+            queryset = queryset.filter(self._product_condition(name, values))
+        if self.min_price is not None:
+            queryset = queryset.filter(price__gte=self.min_price)
+        if self.max_price is not None:
+            queryset = queryset.filter(price__lte=self.max_price)
+        return queryset
+
+    def facet_counts(self, queryset):
+        """Per-value counts for the filtered result set, one query per facet."""
+        if self.uses_summary:
+            return facets.summary_counts(self.facet_filters)
+        return facets.live_counts(self.filter_queryset(queryset))
+
+    async def afacet_counts(self, queryset):
+        """facet_counts() for async views."""
+        if self.uses_summary:
+            return await facets.asummary_counts(self.facet_filters)
+        return await facets.alive_counts(self.filter_queryset(queryset))
+
+    @staticmethod
+    def _parse_ids(raw, allow_none):
+        values = []
+        for part in raw.split(','):
+            if allow_none and part.lower() == 'none':
+                values.append(None)
+            else:
+                values.append(int(part))
+        return values
+
+    @staticmethod
+    def _parse_price(query_params, name, errors):
+        if name not in query_params:
+            return None
+        try:
+            price = Decimal(query_params[name])
+        except InvalidOperation:
+            errors[name] = "Expected a number."
+            return None
+        # Decimal also parses NaN and Infinity, which no database comparison accepts
+        if not price.is_finite():
+            errors[name] = "Expected a number."
+            return None
+        return price
+
+    @staticmethod
+    def _product_condition(name, values):
+        if name in ProductFilter.ID_FACETS:
+            condition = Q(**{f'{name}__in': [value for value in values if value is not None]})
+            if None in values:
+                condition |= Q(**{f'{name}__isnull': True})
+            return condition
+        if name == 'price_band':
+            condition = Q()
+            for key, lower, upper in facets.PRICE_BANDS:
+                if key in values:
+                    band = Q(price__gte=lower)
+                    if upper is not None:
+                        band &= Q(price__lt=upper)
+                    condition |= band
+            return condition
+        if name == 'in_stock':
+            return Q(stock__gt=0) if values[0] else Q(stock=0)
+        raise ValueError(f"Unknown filter {name!r}")
+
+
+class ProductFilterBackend(BaseFilterBackend):
+    """Applies ProductFilter to list views."""
+
+    def filter_queryset(self, request, queryset, view):
+        if getattr(view, 'action', None) != 'list':
+            return queryset
+        return ProductFilter(request.query_params).filter_queryset(queryset)
@@ -0,0 +1,247 @@
+"""
+Derivative images for ProductImage uploads.
+
+Every upload is rendered into the resized JPEG and WebP variants listed in
+VARIANTS, which is what API clients should download instead of the original.
+Variants are stored content-addressed under the SHA-256 of the original
+bytes, so identical uploads (the same photo on several products or shops)
+are rendered and stored once.
+
+Rendering is CPU bound and runs in a process pool. New uploads are scheduled
+after their transaction commits and handed to the pool from a background
+thread, keeping the request path free; `manage.py process_product_images`
+backfills existing images through the same pool.
+
+Originals Pillow cannot decode (corrupt or truncated uploads) get their hash
+recorded with no variants, so clients keep the original and the backfill
+does not pick them up again unless run with --all.
+"""
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from .cache import catalog_cache
+from .models import Product, ProductImage
+
+logger = logging.getLogger(__name__)
+
+# name -> (longest side in pixels, Pillow format, file extension)
+VARIANTS = {
+    'thumb_jpeg': (200, 'JPEG', 'jpg'),
+    'thumb_webp': (200, 'WEBP', 'webp'),
+    'medium_jpeg': (800, 'JPEG', 'jpg'),
+    'medium_webp': (800, 'WEBP', 'webp'),
+}
+QUALITY = 82
+DERIVED_ROOT = 'products/derived'
+
+_DEFAULTS = {
+    # Render after commit on a background thread; False renders inline
+    'ASYNC': True,
+    # Process pool size; None uses every CPU, 0 renders in the calling process
+    'WORKERS': None,
+}
+
+_lock = threading.Lock()
+_process_pool = None
+_dispatcher = None
+
+
+def options():
+    return {**_DEFAULTS, **getattr(settings, 'IMAGE_PIPELINE', {})}
+
+
+def render_variants(data):
+    """
+    Renders every variant of an encoded image. Returns {name: encoded bytes}.
+    Pure function of its input so it can run in a worker process.
+    """
+    with Image.open(BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        has_alpha = source.mode in ('RGBA', 'LA') or 'transparency' in source.info
+        base = source.convert('RGBA' if has_alpha else 'RGB')
+
+    rendered = {}
+    for size in sorted({size for size, _, _ in VARIANTS.values()}, reverse=True):
+        # Resizing the previous (larger) step is much cheaper than the original
+        base = base.copy()
+        base.thumbnail((size, size), Image.Resampling.LANCZOS)
+        for name, (variant_size, image_format, _) in VARIANTS.items():
+            if variant_size != size:
+                continue
+            image = _flatten(base) if image_format == 'JPEG' else base
+            buffer = BytesIO()
+            image.save(buffer, image_format, quality=QUALITY, optimize=image_format == 'JPEG')
+            rendered[name] = buffer.getvalue()
+    return rendered
+
+
+def render_or_none(data):
+    """render_variants, or None if the original cannot be decoded."""
+    try:
+        return render_variants(data)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def _flatten(image):
+    """JPEG has no alpha channel: composite transparent images onto white."""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def variant_paths(content_hash):
+    """Storage paths of the variants of an original with the given hash."""
+    prefix = f'{DERIVED_ROOT}/{content_hash[:2]}/{content_hash}'
+    return {name: f'{prefix}/{name}.{ext}' for name, (_, _, ext) in VARIANTS.items()}
+
+
+def read_original(product_image):
+    with product_image.image.open('rb') as fh:
+        return fh.read()
+
+
+def store_variants(product_image, content_hash, rendered=None):
+    """
+    Saves rendered variants (unless already stored for this hash) and records
+    them on the image row. rendered may be None when every variant exists.
+    """
+    paths = variant_paths(content_hash)
+    for name, path in paths.items():
+        if rendered is not None and not default_storage.exists(path):
+            # The storage may pick another name if a concurrent job saved the same path
+            paths[name] = default_storage.save(path, ContentFile(rendered[name]))
+    ProductImage.objects.filter(pk=product_image.pk).update(content_hash=content_hash, variants=paths)
+    Product.objects.filter(pk=product_image.product_id).update(updated_at=Now())
+    catalog_cache.invalidate_products([product_image.product_id])
+
+
+def mark_unrenderable(product_images, content_hash):
+    """Records the hash of originals that failed to render, leaving them without variants."""
+    logger.warning(
+        "Product images %s cannot be decoded; serving the original",
+        ', '.join(str(product_image.pk) for product_image in product_images)
+    )
+    ProductImage.objects.filter(pk__in=[product_image.pk for product_image in product_images]).update(
+        content_hash=content_hash, variants={}
+    )
+
+
+def missing_variants(content_hash):
+    return any(not default_storage.exists(path) for path in variant_paths(content_hash).values())
+
+
+def process_image(product_image, pool=None):
+    """Renders and stores the variants of one image, reusing stored ones."""
+    data = read_original(product_image)
+    content_hash = hashlib.sha256(data).hexdigest()
+    if not missing_variants(content_hash):
+        store_variants(product_image, content_hash)
+        return
+    rendered = pool.submit(render_or_none, data).result() if pool else render_or_none(data)
+    if rendered is None:
+        mark_unrenderable([product_image], content_hash)
+    else:
+        store_variants(product_image, content_hash, rendered)
+
+
+def process_many(product_images, pool):
+    """
+    Processes images in parallel: originals are read and hashed here, only
+    unseen hashes are rendered in the pool; one undecodable original only
+    affects its own rows. Returns (processed, rendered, failed).
+    """
+    pending = {}
+    for product_image in product_images:
+        try:
+            data = read_original(product_image)
+        except (OSError, ValueError):
+            logger.warning("Original of product image %s is missing", product_image.pk)
+            continue
+        content_hash = hashlib.sha256(data).hexdigest()
+        entry = pending.setdefault(content_hash, {'data': data, 'images': []})
+        entry['images'].append(product_image)
+
+    to_render = [content_hash for content_hash in pending if missing_variants(content_hash)]
+    datas = (pending[content_hash]['data'] for content_hash in to_render)
+    results = dict(zip(to_render, pool.map(render_or_none, datas) if pool else map(render_or_none, datas)))
+
+    processed = failed = 0
+    for content_hash, entry in pending.items():
+        if content_hash in results and results[content_hash] is None:
+            mark_unrenderable(entry['images'], content_hash)
+            failed += len(entry['images'])
+            continue
+        for product_image in entry['images']:
+            store_variants(product_image, content_hash, results.get(content_hash))
+            processed += 1
+    rendered = sum(result is not None for result in results.values())
+    return processed, rendered, failed
+
+
+def new_process_pool(workers):
+    """A process pool of the given size (None = every CPU), or None for 0 workers."""
+    if workers == 0:
+        return None
+    # Spawned, never forked: a fork would copy the server's threads' held locks
+    # and its open database connections into the workers. Workers unpickle
+    # render_variants by importing this module, which needs configured apps.
+    return ProcessPoolExecutor(
+        max_workers=workers or os.cpu_count(), mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup
+    )
+
+
+def process_pool():
+    """Shared pool used for uploads, created on first use."""
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = new_process_pool(options()['WORKERS'])
+        return _process_pool
+
+
+def schedule(image_id):
+    """Processes an image once the current transaction commits."""
+    transaction.on_commit(lambda: _dispatch(image_id))
+
+
+def _dispatch(image_id):
+    global _dispatcher
+    if not options()['ASYNC']:
+        _process_by_id(image_id)
+        return
+    with _lock:
+        if _dispatcher is None:
+            _dispatcher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='product-images')
+    _dispatcher.submit(_process_in_background, image_id)
+
+
+def _process_in_background(image_id):
+    try:
+        _process_by_id(image_id)
+    except Exception:
+        logger.exception("Processing product image %s failed", image_id)
+    finally:
+        connection.close()
+
+
+def _process_by_id(image_id):
+    product_image = ProductImage.objects.filter(pk=image_id).first()
+    if product_image is not None and product_image.image:
+        process_image(product_image, process_pool())
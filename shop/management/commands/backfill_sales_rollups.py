@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shop.services import analytics
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the vendor sales rollups from the order history in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=analytics.BACKFILL_CHUNK_SIZE,
+            help="Shop orders aggregated per chunk"
+        )
+
+    def handle(self, *args, **options):
+        def progress(processed):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  processed {processed} shop orders")
+
+        processed = analytics.backfill(options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {processed} shop orders."))
@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.benchmarks import SCENARIOS, environment, isolated_database, load_scenarios
+from shop.benchmarks import dataset, endpoints
+
+
+class Command(BaseCommand):
+    help = "Runs a shop performance benchmark against a throwaway test database."
+
+    def add_arguments(self, parser):
+        load_scenarios()
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--output', help="Write the results as JSON to this file")
+        # checkout_contention
+        parser.add_argument('--buyers', type=int, default=200)
+        parser.add_argument('--stock', type=int, default=150)
+        parser.add_argument('--threads', type=int, default=8)
+        # catalog scenarios; each picks its own default product count
+        parser.add_argument('--products', type=int)
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--requests', type=int, default=2000)
+        # sqlite_profiles: seconds per profile and reader threads (--threads writers)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--readers', type=int, default=8)
+        # async_reads: in-flight requests per run
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[8, 64, 256])
+        # order_export
+        parser.add_argument('--rows', type=int, default=200_000)
+        # endpoints: dataset size and seed, timed requests per route, comparison
+        parser.add_argument('--scale', choices=sorted(dataset.SCALES), default='small')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--baseline', help="Results file of an earlier run to compare with")
+        parser.add_argument('--tolerance', type=float, default=endpoints.TOLERANCE)
+
+    def handle(self, *args, **options):
+        func = SCENARIOS.get(options['scenario'])
+        if func is None:
+            raise CommandError(f"Unknown scenario {options['scenario']!r}")
+
+        with isolated_database(on_disk=func.on_disk):
+            results = func(options)
+        results = {'scenario': options['scenario'], 'environment': environment(), **results}
+
+        output = json.dumps(results, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                fh.write(output + '\n')
+        self.stdout.write(output)
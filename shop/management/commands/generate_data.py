@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.benchmarks import dataset
+
+
+class Command(BaseCommand):
+    help = "Fills the database with a seeded synthetic dataset (shops, products, orders, comments, ...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=sorted(dataset.SCALES), default='small')
+        for name in dataset.SCALES['small']:
+            parser.add_argument(f'--{name}', type=int, help=f"Number of {name}; overrides --scale")
+        parser.add_argument('--seed', type=int, default=0, help="Same seed, same rows")
+        parser.add_argument(
+            '--chunk-size', type=int, default=dataset.CHUNK_SIZE, help="Rows inserted per statement"
+        )
+
+    def handle(self, *args, **options):
+        counts = dict(dataset.SCALES[options['scale']])
+        counts.update({name: options[name] for name in counts if options[name] is not None})
+        if counts['shops'] < 1 or counts['buyers'] < 1 or counts['products'] < counts['shops']:
+            raise CommandError("Needs at least one shop and buyer, and a product per shop")
+        if dataset.exists(options['seed']):
+            raise CommandError(f"A dataset with seed {options['seed']} is already loaded; pass another --seed")
+
+        def progress(message):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {message}")
+
+        created = dataset.generate(counts, options['seed'], options['chunk_size'], progress=progress)
+        summary = ', '.join(f"{count} {name.replace('_', ' ')}" for name, count in created.items())
+        self.stdout.write(self.style.SUCCESS(f"Created {summary}."))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.models import Shop
+from shop.services import product_import
+
+
+class Command(BaseCommand):
+    help = "Upserts products into a shop by sku from a CSV or NDJSON file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV (with a header row) or NDJSON file")
+        parser.add_argument('--shop', required=True, help="Shop id or slug")
+        parser.add_argument('--type', choices=product_import.FORMATS, help="Defaults to the file extension")
+        parser.add_argument(
+            '--chunk-size', type=int, default=product_import.IMPORT_CHUNK_SIZE,
+            help="Rows upserted per statement"
+        )
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['shop']} if options['shop'].isdigit() else {'slug': options['shop']}
+        shop_id = Shop.objects.filter(**lookup).values_list('pk', flat=True).first()
+        if shop_id is None:
+            raise CommandError(f"Unknown shop {options['shop']!r}")
+        file_format = options['type'] or options['path'].rpartition('.')[2].lower()
+        if file_format not in product_import.FORMATS:
+            raise CommandError("Pass --type csv or --type ndjson")
+
+        with open(options['path'], 'rb') as stream:
+            lines = product_import.decode_lines(stream)
+            try:
+                report = product_import.import_products(
+                    shop_id, product_import.read_rows(lines, file_format), options['chunk_size']
+                )
+            except product_import.UnreadableFileError as exc:
+                raise CommandError(str(exc))
+
+        for error in report.errors:
+            messages = '; '.join(f"{name}: {message}" for name, message in error['errors'].items())
+            self.stderr.write(f"row {error['row']}: {messages}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {report.created}, updated {report.updated}, failed {report.failed}."
+        ))
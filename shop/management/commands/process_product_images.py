@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from shop import images
+from shop.models import ProductImage
+
+
+class Command(BaseCommand):
+    help = "Renders the resized/WebP derivatives of product images in a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Reprocess images that already have variants")
+        parser.add_argument('--workers', type=int, help="Process pool size (default: every CPU, 0 = inline)")
+        parser.add_argument('--chunk-size', type=int, default=200, help="Images read per batch")
+
+    def handle(self, *args, **options):
+        queryset = ProductImage.objects.exclude(image='').order_by('pk')
+        if not options['all']:
+            queryset = queryset.filter(content_hash='')
+
+        workers = options['workers'] if options['workers'] is not None else images.options()['WORKERS']
+        pool = images.new_process_pool(workers)
+
+        processed = rendered = failed = 0
+        last_id = 0
+        try:
+            while True:
+                chunk = list(queryset.filter(pk__gt=last_id)[:options['chunk_size']])
+                if not chunk:
+                    break
+                done, new, broken = images.process_many(chunk, pool)
+                processed += done
+                rendered += new
+                failed += broken
+                last_id = chunk[-1].pk
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"  processed {processed} images")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} images; rendered {rendered} distinct originals."
+        ))
+        if failed:
+            self.stdout.write(self.style.WARNING(f"{failed} images could not be decoded and keep no variants."))
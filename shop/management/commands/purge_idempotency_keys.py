@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.services import idempotency
+
+
+class Command(BaseCommand):
+    help = "Deletes expired Idempotency-Key records; schedule it (e.g. hourly with cron)."
+
+    def handle(self, *args, **options):
+        deleted = idempotency.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} expired idempotency keys."))
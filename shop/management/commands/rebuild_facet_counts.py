@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop import facets
+
+
+class Command(BaseCommand):
+    help = "Recomputes the product facet summary table from the product table."
+
+    def handle(self, *args, **options):
+        cells = facets.rebuild_counts()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {cells} facet cells."))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from shop import search
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text product search index from the product table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=search.REBUILD_CHUNK_SIZE,
+            help="Products indexed per INSERT statement"
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            self.stdout.write(self.style.WARNING(
+                "The database backend has no FTS5 index; search uses substring matching."
+            ))
+            return
+
+        def progress(indexed):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  indexed {indexed} products")
+
+        indexed = search.rebuild_index(options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} products."))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from shop.services import counters
+
+
+class Command(BaseCommand):
+    help = "Recomputes Product.comment_count and Product.units_sold in chunks and fixes drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=counters.RECONCILE_CHUNK_SIZE,
+            help="Products checked per chunk"
+        )
+
+    def handle(self, *args, **options):
+        def progress(checked, fixed):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  checked {checked} products, fixed {fixed}")
+
+        checked, fixed = counters.reconcile_counters(options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} products, fixed {fixed}."))
@@ -0,0 +1,44 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from shop.services import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Carries out queued outbox events (analytics rollups and other post-commit side effects). "
+        "Run one or more next to the web processes."
+    )
+
+    def add_arguments(self, parser):
+        config = outbox.options()
+        parser.add_argument(
+            '--concurrency', type=int, default=config['CONCURRENCY'],
+            help="Events handled in parallel (1 handles them in the main thread)"
+        )
+        parser.add_argument('--batch-size', type=int, default=config['BATCH_SIZE'], help="Events claimed at a time")
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Handle the events that are due now, then exit"
+        )
+
+    def handle(self, *args, **options):
+        config = {**outbox.options(), 'BATCH_SIZE': options['batch_size']}
+        if options['once']:
+            handled = outbox.process_pending(config, options['concurrency'])
+            self.stdout.write(self.style.SUCCESS(f"Handled {handled} outbox events."))
+            return
+
+        stopping = []
+        # Finish the current batch on SIGTERM/SIGINT instead of abandoning its leases
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stopping.append(True))
+
+        def progress(claimed, handled):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  handled {handled} of {claimed} claimed events")
+
+        self.stdout.write(f"Outbox worker started (concurrency {options['concurrency']}).")
+        outbox.run_worker(config, options['concurrency'], stop=lambda: bool(stopping), progress=progress)
+        self.stdout.write(self.style.SUCCESS("Outbox worker stopped."))
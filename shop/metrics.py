@@ -0,0 +1,277 @@
+"""
+Per-route request metrics and sampled profiling.
+
+MetricsMiddleware measures every request: total latency, the number of
+queries and the time spent in them, and the time spent rendering
+serializers. Queries are counted by an execute wrapper installed on every
+database connection (see shop/signals.py), which only records while a
+request is being measured; serializer time comes from views using
+SerializerTimingMixin (and from async views through serializing()).
+
+Measurements are aggregated per route (the URL name, e.g.
+"shop:product-list") and method into in-process histograms, exposed in
+Prometheus text format at GET /api/metrics/ (staff only). Each process keeps
+its own histograms; scrape every worker.
+
+With PROFILE_SAMPLE_RATE > 0 a sample of sync requests runs under cProfile,
+and those slower than PROFILE_MIN_DURATION seconds are dumped as .prof files
+to PROFILE_DIR (inspect them with `python -m pstats` or snakeviz).
+"""
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Histogram bucket upper bounds, in seconds and in queries
+    'LATENCY_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'QUERY_BUCKETS': (0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+    # Fraction of sync requests run under cProfile (0 disables profiling)
+    'PROFILE_SAMPLE_RATE': 0.0,
+    # Profiled requests at least this slow (seconds) are written out
+    'PROFILE_MIN_DURATION': 0.5,
+    # Where .prof files go; None means <BASE_DIR>/profiles
+    'PROFILE_DIR': None,
+}
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('shop_request_stats', default=None)
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'METRICS', {})}
+
+
+class RequestStats:
+    """What one request spent; shared with the threads its async queries run on."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper counting and timing queries of the request being measured."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.db_seconds += time.perf_counter() - start
+
+
+def instrument(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializing():
+    """Counts the block as serializer time of the current request."""
+    stats = _current.get()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if stats is not None:
+            stats.serializer_seconds += time.perf_counter() - start
+
+
+class SerializerTimingMixin:
+    """
+    GenericAPIView mixin: the time from the first get_serializer() call to
+    finalize_response() counts as serializer time. That span covers
+    validation, saving and serializer.data, with the queries they run.
+    """
+
+    def get_serializer(self, *args, **kwargs):
+        if getattr(self, '_serializer_timing', None) is None:
+            self._serializer_timing = ExitStack()
+            self._serializer_timing.enter_context(serializing())
+        return super().get_serializer(*args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        timing, self._serializer_timing = getattr(self, '_serializer_timing', None), None
+        if timing is not None:
+            timing.close()
+        return super().finalize_response(request, response, *args, **kwargs)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """In-process request counters and histograms, labelled by route and method."""
+
+    HISTOGRAMS = (
+        ('shop_request_duration_seconds', "Request latency, middleware to middleware.", 'LATENCY_BUCKETS'),
+        ('shop_request_db_seconds', "Time spent executing database queries per request.", 'LATENCY_BUCKETS'),
+        ('shop_request_serializer_seconds', "Time spent rendering serializers per request.", 'LATENCY_BUCKETS'),
+        ('shop_request_queries', "Database queries per request.", 'QUERY_BUCKETS'),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def record(self, route, method, status, stats, duration, config=None):
+        config = config or options()
+        values = (duration, stats.db_seconds, stats.serializer_seconds, stats.queries)
+        labels = (route, method)
+        with self._lock:
+            key = (route, method, str(status))
+            self._requests[key] = self._requests.get(key, 0) + 1
+            for (name, _, buckets), value in zip(self.HISTOGRAMS, values):
+                series = self._histograms[name]
+                if labels not in series:
+                    series[labels] = Histogram(config[buckets])
+                series[labels].observe(value)
+
+    def render(self):
+        """The metrics in Prometheus text exposition format."""
+        lines = [
+            '# HELP shop_requests_total Requests handled, by route, method and status.',
+            '# TYPE shop_requests_total counter',
+        ]
+        with self._lock:
+            for (route, method, status), count in sorted(self._requests.items()):
+                lines.append(f'shop_requests_total{_labels(route=route, method=method, status=status)} {count}')
+            for name, help_text, _ in self.HISTOGRAMS:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for (route, method), histogram in sorted(self._histograms[name].items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        labels = _labels(route=route, method=method, le=_number(bound))
+                        lines.append(f'{name}_bucket{labels} {count}')
+                    labels = _labels(route=route, method=method)
+                    lines += [
+                        f'{name}_bucket{_labels(route=route, method=method, le="+Inf")} {histogram.count}',
+                        f'{name}_sum{labels} {_number(histogram.sum)}',
+                        f'{name}_count{labels} {histogram.count}',
+                    ]
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._requests = {}
+            self._histograms = {name: {} for name, _, _ in self.HISTOGRAMS}
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """Measures each request into the registry; see the module docstring."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        config = options()
+        if not config['ENABLED']:
+            return self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        profiler = _start_profiler(config)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            _current.reset(token)
+            if profiler is not None:
+                profiler.disable()
+        registry.record(_route(request), request.method, response.status_code, stats, duration, config)
+        if profiler is not None and duration >= config['PROFILE_MIN_DURATION']:
+            _dump_profile(profiler, request, duration, config)
+        return response
+
+    async def __acall__(self, request):
+        # Coroutines of other requests interleave on the event loop thread, so
+        # async requests are measured but never profiled
+        config = options()
+        if not config['ENABLED']:
+            return await self.get_response(request)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            duration = time.perf_counter() - start
+            _current.reset(token)
+        registry.record(_route(request), request.method, response.status_code, stats, duration, config)
+        return response
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+def _start_profiler(config):
+    rate = config['PROFILE_SAMPLE_RATE']
+    if not rate or random.random() >= rate:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None  # another profiler (e.g. a debugger) is active on this thread
+    return profiler
+
+
+def _dump_profile(profiler, request, duration, config):
+    directory = config['PROFILE_DIR'] or os.path.join(settings.BASE_DIR, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    route = _route(request).replace(':', '.')
+    path = os.path.join(directory, f'{route}-{request.method}-{stamp}-{int(duration * 1000)}ms.prof')
+    profiler.dump_stats(path)
+    logger.info("Profiled %s %s (%.0f ms) to %s", request.method, request.path, duration * 1000, path)
+    return path
+
+
+def _labels(**labels):
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
@@ -0,0 +1,44 @@
+from django.db import migrations
+
+# Full-text index over product name, description, category and brand names.
+# rowid is the product id. Prefix indexes make search-as-you-type queries
+# ("lapt*") index lookups instead of term scans. SQLite only; see shop/search.py.
+CREATE_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS shop_product_fts USING fts5(
+    name, description, category, brand,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+)
+"""
+
+POPULATE_SQL = """
+INSERT INTO shop_product_fts (rowid, name, description, category, brand)
+SELECT p.id, p.name, p.description, COALESCE(c.name, ''), COALESCE(b.name, '')
+FROM shop_product p
+LEFT JOIN shop_category c ON c.id = p.category_id
+LEFT JOIN shop_brand b ON b.id = p.brand_id
+"""
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(CREATE_SQL)
+    schema_editor.execute(POPULATE_SQL)
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute("DROP TABLE IF EXISTS shop_product_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0002_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 6.1.2 on 2026-10-18 20:47
+
+from collections import Counter
+from decimal import Decimal
+
+from django.db import migrations, models
+
+# Upper bounds of shop.facets.PRICE_BANDS at the time of this migration
+PRICE_BAND_UPPER_BOUNDS = [Decimal('25'), Decimal('50'), Decimal('100'), Decimal('250'), Decimal('500')]
+
+
+def populate_facet_counts(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    ProductFacetCount = apps.get_model('shop', 'ProductFacetCount')
+    cells = Counter()
+    rows = Product.objects.values_list('shop_id', 'category_id', 'brand_id', 'price', 'stock')
+    for shop_id, category_id, brand_id, price, stock in rows.iterator():
+        band = next(
+            (i for i, upper in enumerate(PRICE_BAND_UPPER_BOUNDS) if price < upper),
+            len(PRICE_BAND_UPPER_BOUNDS)
+        )
+        cells[(shop_id, category_id or 0, brand_id or 0, band, stock > 0)] += 1
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(
+            shop_id=shop_id, category_id=category_id, brand_id=brand_id,
+            price_band=band, in_stock=in_stock, count=count
+        )
+        for (shop_id, category_id, brand_id, band, in_stock), count in cells.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shop_id', models.BigIntegerField()),
+                ('category_id', models.BigIntegerField(default=0)),
+                ('brand_id', models.BigIntegerField(default=0)),
+                ('price_band', models.PositiveSmallIntegerField()),
+                ('in_stock', models.BooleanField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-created_at', 'id'], name='product_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['brand', '-created_at', 'id'], name='product_brand_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['shop', '-created_at', 'id'], name='product_shop_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price'], name='product_price_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productfacetcount',
+            constraint=models.UniqueConstraint(fields=('shop_id', 'category_id', 'brand_id', 'price_band', 'in_stock'), name='product_facet_count_key'),
+        ),
+        migrations.RunPython(populate_facet_counts, migrations.RunPython.noop),
+    ]
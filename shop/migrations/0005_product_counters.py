@@ -0,0 +1,52 @@
+# Generated by Django 6.1.2 on 2026-10-18 20:49
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Comment = apps.get_model('shop', 'Comment')
+    OrderDetail = apps.get_model('shop', 'OrderDetail')
+    approved = (
+        Comment.objects.filter(product=OuterRef('pk'), is_approved=True)
+        .values('product').annotate(n=Count('id')).values('n')
+    )
+    sold = (
+        OrderDetail.objects.filter(product=OuterRef('pk'))
+        .values('product').annotate(n=Sum('quantity')).values('n')
+    )
+    Product.objects.update(
+        comment_count=Coalesce(Subquery(approved, output_field=IntegerField()), Value(0)),
+        units_sold=Coalesce(Subquery(sold, output_field=IntegerField()), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_product_facets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0, help_text='Number of approved comments'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='units_sold',
+            field=models.PositiveIntegerField(default=0, help_text='Units ordered across all orders'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-units_sold', 'id'], name='product_units_sold_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['-comment_count', 'id'], name='product_comment_count_idx'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 6.1.2 on 2026-10-18 21:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='discount',
+            name='categories',
+            field=models.ManyToManyField(blank=True, help_text='Applies to every product in these categories', related_name='discounts', to='shop.category'),
+        ),
+        migrations.AddField(
+            model_name='discount',
+            name='products',
+            field=models.ManyToManyField(blank=True, related_name='discounts', to='shop.product'),
+        ),
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['end_date'], name='discount_end_date_idx'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 6.1.2 on 2026-10-18 22:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Q, Subquery
+
+
+def populate_moderation(apps, schema_editor):
+    Comment = apps.get_model('shop', 'Comment')
+    Product = apps.get_model('shop', 'Product')
+    Comment.objects.update(
+        shop_id=Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('shop_id')[:1])
+    )
+    # Comments already approved or handled by a manager leave the queue
+    Comment.objects.filter(Q(is_approved=True) | Q(moderated_by__isnull=False)).update(
+        moderated_at=F('updated_at')
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_outbox_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='shop',
+            field=models.ForeignKey(
+                editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                to='shop.shop'
+            ),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='moderated_at',
+            field=models.DateTimeField(
+                blank=True, help_text='When a manager approved or rejected it; empty while pending', null=True
+            ),
+        ),
+        migrations.RunPython(populate_moderation, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='comment',
+            name='shop',
+            field=models.ForeignKey(
+                editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.shop'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(
+                condition=models.Q(('is_approved', False), ('moderated_at__isnull', True)),
+                fields=['shop', 'created_at', 'id'], name='comment_pending_shop_idx'
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(
+                condition=models.Q(('is_approved', True)), fields=['product', '-created_at', '-id'],
+                name='comment_approved_product_idx'
+            ),
+        ),
+    ]
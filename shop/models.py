@@ -145,6 +145,12 @@ class Product(TimeStampedModel):
         blank=True,
         related_name='products'
     )
+    sku = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        help_text="Shop-specific stock keeping unit; the key used by bulk imports"
+    )
     name = models.CharField(max_length=255)
     description = models.TextField()
     price = models.DecimalField(
@@ -159,10 +165,27 @@ class Product(TimeStampedModel):
         choices=Status.choices,
         default=Status.ACTIVE
     )
+    # Denormalized counters, maintained with F() updates (see shop/services/counters.py)
+    comment_count = models.PositiveIntegerField(default=0, help_text="Number of approved comments")
+    units_sold = models.PositiveIntegerField(default=0, help_text="Units ordered across all orders")
 
     class Meta:
         indexes = [
             models.Index(fields=['name', 'status'], name='product_name_status_idx'),
+            # Backs keyset pagination of the catalog (see ProductCursorPagination)
+            models.Index(fields=['-created_at', 'id'], name='product_created_id_idx'),
+            # Filtered catalog pages (see ProductFilter) seek these in list order
+            models.Index(fields=['category', '-created_at', 'id'], name='product_category_created_idx'),
+            models.Index(fields=['brand', '-created_at', 'id'], name='product_brand_created_idx'),
+            models.Index(fields=['shop', '-created_at', 'id'], name='product_shop_created_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+            # Popularity sorts (see ProductCursorPagination.sort_options)
+            models.Index(fields=['-units_sold', 'id'], name='product_units_sold_idx'),
+            models.Index(fields=['-comment_count', 'id'], name='product_comment_count_idx'),
+        ]
+        constraints = [
+            # Conflict target of the bulk import upsert (see shop/services/product_import.py)
+            models.UniqueConstraint(fields=['shop', 'sku'], name='product_shop_sku_uniq'),
         ]
         ordering = ['-created_at']
 
@@ -179,6 +202,14 @@ class ProductImage(models.Model):
         help_text="Mark as the main/featured product image"
     )
     alt_text = models.CharField(max_length=255, blank=True, help_text="SEO-friendly alt text")
+    # Derivatives rendered off the request path (see shop/images.py)
+    content_hash = models.CharField(
+        max_length=64,
+        blank=True,
+        db_index=True,
+        help_text="SHA-256 of the original upload; derivatives are stored under it"
+    )
+    variants = models.JSONField(default=dict, blank=True, help_text="Variant name -> storage path")
 
     def __str__(self):
         return f"Image for {self.product.name}"
@@ -222,6 +253,10 @@ class Order(TimeStampedModel):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Backs keyset pagination of a user's order history (see OrderCursorPagination)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} by {self.user.username}"
@@ -280,8 +315,9 @@ class OrderDetail(models.Model):
 
 class Discount(models.Model):
     """
-    Time-bound percentage discount.
-    Can be applied to products, categories, or whole orders (logic in views/services).
+    Time-bound percentage discount on products and/or whole categories.
+    Active between start_date (inclusive) and end_date (exclusive); resolved
+    into sale prices by shop/pricing.py.
     """
     name = models.CharField(max_length=100)
     discount_percentage = models.DecimalField(
@@ -291,6 +327,19 @@ class Discount(models.Model):
     )
     start_date = models.DateTimeField()
     end_date = models.DateTimeField()
+    products = models.ManyToManyField(Product, blank=True, related_name='discounts')
+    categories = models.ManyToManyField(
+        Category,
+        blank=True,
+        related_name='discounts',
+        help_text="Applies to every product in these categories"
+    )
+
+    class Meta:
+        indexes = [
+            # The pricing index loads discounts that have not ended yet
+            models.Index(fields=['end_date'], name='discount_end_date_idx'),
+        ]
 
     def clean(self):
         if self.start_date and self.end_date and self.start_date > self.end_date:
@@ -330,6 +379,9 @@ class Comment(TimeStampedModel):
     Requires moderation by shop manager before public display.
     """
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='comments')
+    # Denormalized product.shop, so a shop's moderation queue is one index range
+    # (kept in sync by save() and the Product post_save signal)
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='+', editable=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     comment = models.TextField()
     moderated_by = models.ForeignKey(
@@ -339,7 +391,153 @@ class Comment(TimeStampedModel):
         blank=True,
         related_name='moderated_comments'
     )
+    moderated_at = models.DateTimeField(
+        null=True, blank=True, help_text="When a manager approved or rejected it; empty while pending"
+    )
     is_approved = models.BooleanField(default=False, help_text="Approved by shop manager")
 
+    class Meta:
+        indexes = [
+            # The moderation queue of a shop, oldest first (see shop/services/moderation.py)
+            models.Index(
+                fields=['shop', 'created_at', 'id'],
+                condition=models.Q(is_approved=False, moderated_at__isnull=True),
+                name='comment_pending_shop_idx',
+            ),
+            # Public comments of a product, newest first
+            models.Index(
+                fields=['product', '-created_at', '-id'],
+                condition=models.Q(is_approved=True),
+                name='comment_approved_product_idx',
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.shop_id is None:
+            self.shop_id = Product.objects.values_list('shop_id', flat=True).get(pk=self.product_id)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Comment by {self.user.username} on {self.product.name}"
+
+# ────────────────────────────────────────────────
+#                 Precomputed Summaries
+# ────────────────────────────────────────────────
+
+class ProductFacetCount(models.Model):
+    """
+    Number of products for each combination of facet values.
+    Maintained incrementally on product writes (see shop/facets.py) so facet
+    counts for facet-only filters never scan the product table.
+    Missing category/brand are stored as 0 so the unique key has no NULLs.
+    """
+    shop_id = models.BigIntegerField()
+    category_id = models.BigIntegerField(default=0)
+    brand_id = models.BigIntegerField(default=0)
+    price_band = models.PositiveSmallIntegerField()
+    in_stock = models.BooleanField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['shop_id', 'category_id', 'brand_id', 'price_band', 'in_stock'],
+                name='product_facet_count_key'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Facet cell {self.shop_id}/{self.category_id}/{self.brand_id}: {self.count}"
+
+
+class ProductSalesRollup(models.Model):
+    """
+    Units and revenue sold per shop, product and day (order date).
+    Incremented at checkout and rebuilt by `manage.py backfill_sales_rollups`;
+    vendor analytics read only these rows (see shop/services/analytics.py).
+    """
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='+')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_lines = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'product', 'date'], name='product_sales_rollup_key'),
+        ]
+        indexes = [
+            models.Index(fields=['shop', 'date'], name='product_sales_shop_date_idx'),
+        ]
+
+
+class ShopOrderStatusRollup(models.Model):
+    """Number and value of a shop's orders per order date and current status."""
+    shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name='+')
+    date = models.DateField()
+    status = models.CharField(max_length=20, choices=OrderStatus.choices)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['shop', 'date', 'status'], name='shop_order_status_rollup_key'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a request sent with an Idempotency-Key header, so retries of
+    the same key are answered from here (see shop/services/idempotency.py).
+    status_code is null while the first request is still running.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    key = models.CharField(max_length=255)
+    # The endpoint the key was first used on
+    scope = models.CharField(max_length=255)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_user_key_uniq'),
+        ]
+        indexes = [
+            # Expired keys are purged in bulk (manage.py purge_idempotency_keys)
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.scope})"
+
+
+class OutboxEvent(models.Model):
+    """
+    Side effect recorded in the same transaction as the write that causes it,
+    and carried out later by the outbox worker (see shop/services/outbox.py).
+    Handled events are deleted; events that keep failing are kept with failed_at set.
+    """
+    topic = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    created_at = models.DateTimeField(default=timezone.now)
+    # Next time a worker may claim the event; claiming pushes it out by the lease
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim due events in this order
+            models.Index(
+                fields=['available_at', 'id'], name='outbox_due_idx',
+                condition=models.Q(failed_at__isnull=True)
+            ),
+        ]
+
     def __str__(self):
-        return f"Comment by {self.user.username} on {self.product.name}"
\ No newline at end of file
+        return f"{self.topic} #{self.pk}"
@@ -0,0 +1,231 @@
+import base64
+import binascii
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError as APIValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a composite ordering, e.g. ('-created_at', 'id').
+
+    The cursor stores the ordering values of the last row served, so every page
+    is fetched with a seek predicate such as
+        WHERE created_at <= :c AND (created_at < :c OR (created_at = :c AND id > :id))
+        ORDER BY created_at DESC, id ASC LIMIT :n
+    which a matching composite index answers without skipping rows. Deep pages
+    cost the same as the first page, unlike OFFSET pagination.
+    The last ordering field must be unique so that every cursor is exact.
+    """
+    ordering = ('-created_at', 'id')
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset() for async views."""
+        return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+    def page_queryset(self, queryset, request):
+        """The unevaluated queryset of the requested page (plus one lookahead row)."""
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request)
+        self.position, self.reverse = self.decode_cursor(request, queryset.model)
+
+        ordering = [self._flip(field) for field in self.ordering] if self.reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if self.position is not None:
+            queryset = queryset.filter(self._seek_filter(ordering, self.position))
+        # Fetch one extra row to know whether there is a further page
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, rows):
+        """Takes the rows fetched for page_queryset() and returns the page."""
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        if self.reverse:
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_ordering(self, request):
+        return self.ordering
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    # Cursor encoding
+
+    def encode_cursor(self, row, reverse):
+        values = [self._field_value(row, field) for field in self.ordering]
+        payload = json.dumps({'p': values, 'r': int(reverse)}, default=str)
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            values = payload['p']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    # Helpers
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _field_value(row, field):
+        return getattr(row, field.lstrip('-'))
+
+    @staticmethod
+    def _seek_filter(ordering, position):
+        """
+        Builds the lexicographic "row comes after position" predicate.
+        The redundant inclusive bound on the leading field lets the database
+        seek into the index instead of scanning it from the start.
+        """
+        clauses = []
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {f.lstrip('-'): value for f, value in zip(ordering[:i], position[:i])}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': position[i]}))
+        leading = ordering[0]
+        bound = Q(**{f"{leading.lstrip('-')}__{'lte' if leading.startswith('-') else 'gte'}": position[0]})
+        return bound & reduce(or_, clauses)
+
+
+class ProductCursorPagination(KeysetPagination):
+    """
+    Product catalog: newest first by default, or ?sort=best_selling /
+    most_reviewed on the denormalized counters. id breaks ties.
+    """
+    ordering = ('-created_at', 'id')
+    sort_query_param = 'sort'
+    sort_options = {
+        'newest': ('-created_at', 'id'),
+        'best_selling': ('-units_sold', 'id'),
+        'most_reviewed': ('-comment_count', 'id'),
+    }
+
+    def get_ordering(self, request):
+        sort = request.query_params.get(self.sort_query_param, 'newest')
+        if sort not in self.sort_options:
+            raise APIValidationError({self.sort_query_param: f"Expected any of {', '.join(self.sort_options)}."})
+        return self.sort_options[sort]
+
+
+class OrderCursorPagination(KeysetPagination):
+    """Customer order history: newest first."""
+    ordering = ('-created_at', '-id')
+
+
+class CommentCursorPagination(KeysetPagination):
+    """Approved comments of a product: newest first."""
+    ordering = ('-created_at', '-id')
+
+
+class ModerationQueuePagination(KeysetPagination):
+    """A shop's pending comments: oldest first, so the queue is worked in order."""
+    ordering = ('created_at', 'id')
+    page_size = 50
+    max_page_size = 500
+
+
+class RankedPagination(BasePagination):
+    """
+    Page-number pagination for relevance-ranked results (e.g. search), where
+    the rank is computed per query and cannot serve as a keyset. The caller
+    fetches one extra row and reports whether another page exists, so no
+    COUNT(*) over the full match set is needed.
+    """
+    page_size = 20
+    max_page_size = 100
+    page_query_param = 'page'
+    page_size_query_param = 'page_size'
+
+    def get_window(self, request):
+        """Returns (limit, offset) for the requested page."""
+        self.base_url = request.build_absolute_uri()
+        try:
+            self.page_number = max(1, int(request.query_params.get(self.page_query_param, 1)))
+        except ValueError:
+            raise NotFound("Invalid page")
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+            self.page_size = max(1, min(size, self.max_page_size))
+        except (KeyError, ValueError):
+            pass
+        return self.page_size, (self.page_number - 1) * self.page_size
+
+    def get_paginated_response(self, data, has_more, truncated=False):
+        """truncated: only part of the matches were ranked, so later pages are incomplete."""
+        next_link = previous_link = None
+        if has_more:
+            next_link = replace_query_param(self.base_url, self.page_query_param, self.page_number + 1)
+        if self.page_number > 1:
+            previous_link = replace_query_param(self.base_url, self.page_query_param, self.page_number - 1)
+        return Response({'next': next_link, 'previous': previous_link, 'truncated': truncated, 'results': data})
@@ -1,5 +1,8 @@
 from rest_framework import permissions
 
+from .authentication import managed_shop_id
+
+
 class IsShopManager(permissions.BasePermission):
     """
     Allows access only to managers of the specific shop.
@@ -8,9 +11,8 @@ class IsShopManager(permissions.BasePermission):
         # Read permissions are allowed for any request
         if request.method in permissions.SAFE_METHODS:
             return True
-        
-        # Check if the user has a manager profile linked to the shop of the product
-        try:
-            return request.user.manager_profile.shop == obj.shop
-        except AttributeError:
-            return False
\ No newline at end of file
+
+        # Compare the user's managed shop id (resolved with the user) with the
+        # object's shop id, or the shop's own id; no related rows are loaded
+        shop_id = managed_shop_id(request.user)
+        return shop_id is not None and shop_id == getattr(obj, 'shop_id', obj.pk)
@@ -0,0 +1,217 @@
+"""
+Discount resolution for product prices.
+
+Discounts are attached to products and to categories and are active inside
+their [start_date, end_date) window. Pricing a product must not cost a query
+per product, so every process keeps the discounts that have not ended yet in
+memory and derives a DiscountIndex from them: the best active percentage per
+product and per category, valid until the next window opens or closes.
+Pricing a whole page or cart is then a pair of dict lookups per product.
+
+The in-memory windows are reloaded when a Discount row or its targets change:
+signals (see shop/signals.py) bump a version token in the shared cache, which
+each process compares on every index() call. A per-process cache backend
+(LocMemCache) only tells the process that saved the change, so there every
+process also reloads once PRICING['RELOAD_INTERVAL'] seconds have passed.
+When a window opens or closes, the index is re-derived from the loaded
+windows without a query. Queryset updates bypass the signals; call
+pricing_engine.invalidate() after them.
+
+When several discounts apply to a product (directly or through its category)
+the largest percentage wins; discounts do not stack.
+"""
+import asyncio
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.conf import settings
+from django.utils import timezone
+
+from .cache import catalog_cache
+from .models import Discount
+
+CENT = Decimal('0.01')
+
+_DEFAULTS = {
+    # Seconds between reloads when the cache backend is per process
+    'RELOAD_INTERVAL': 5,
+}
+
+
+def options():
+    return {**_DEFAULTS, **getattr(settings, 'PRICING', {})}
+
+
+@dataclass(frozen=True)
+class Window:
+    discount_id: int
+    percentage: Decimal
+    start: object
+    end: object
+    product_ids: frozenset
+    category_ids: frozenset
+
+
+class DiscountIndex:
+    """The discounts active at one moment, keyed by product and by category."""
+
+    def __init__(self, windows, at, loaded_at=None):
+        self.at = at
+        self.by_product = {}
+        self.by_category = {}
+        active = []
+        boundaries = []
+        # Discounts may have been edited any time up to their loading
+        self.changed_at = loaded_at or at
+        for window in windows:
+            if window.end <= at:
+                self.changed_at = max(self.changed_at, window.end)
+                continue
+            if window.start > at:
+                boundaries.append(window.start)
+                continue
+            self.changed_at = max(self.changed_at, window.start)
+            boundaries.append(window.end)
+            active.append(window)
+            for targets, ids in ((self.by_product, window.product_ids), (self.by_category, window.category_ids)):
+                for target in ids:
+                    if window.percentage > targets.get(target, 0):
+                        targets[target] = window.percentage
+        # The moment the set of active discounts changes next (None: never)
+        self.valid_until = min(boundaries, default=None)
+        # Identifies the resolved prices; embedded in cache keys and ETags. Derived
+        # from the active discounts themselves, so every process agrees on it
+        content = sorted(
+            (w.discount_id, str(w.percentage), sorted(w.product_ids), sorted(w.category_ids)) for w in active
+        )
+        self.token = hashlib.sha1(repr(content).encode()).hexdigest()[:16]
+
+    def is_valid(self, at):
+        return self.at <= at and (self.valid_until is None or at < self.valid_until)
+
+    def percentage(self, product_id, category_id=None):
+        """The discount percentage applying to a product, or None."""
+        best = max(self.by_product.get(product_id, 0), self.by_category.get(category_id, 0))
+        return best or None
+
+    def sale_price(self, product):
+        """The price charged for product (anything with pk, category_id and price)."""
+        percentage = self.percentage(product.pk, product.category_id)
+        return discounted(product.price, percentage)
+
+
+def discounted(price, percentage):
+    if not percentage:
+        return price
+    return (price * (100 - percentage) / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def load_windows(at):
+    """Discounts that have not ended at `at`, with their targets (three queries)."""
+    return _build_windows(*(list(rows) for rows in _window_queries(at)))
+
+
+async def aload_windows(at):
+    """load_windows() for async callers; the three queries run concurrently."""
+    async def fetch(rows):
+        return [row async for row in rows]
+
+    return _build_windows(*await asyncio.gather(*(fetch(rows) for rows in _window_queries(at))))
+
+
+def _window_queries(at):
+    discounts = Discount.objects.filter(end_date__gt=at).values_list(
+        'pk', 'discount_percentage', 'start_date', 'end_date'
+    )
+    targets = [
+        Discount._meta.get_field(field).remote_field.through.objects
+        .filter(discount__end_date__gt=at).values_list('discount_id', column)
+        for field, column in (('products', 'product_id'), ('categories', 'category_id'))
+    ]
+    return [discounts, *targets]
+
+
+def _build_windows(discount_rows, product_rows, category_rows):
+    discounts = {
+        pk: {'percentage': percentage, 'start': start, 'end': end, 'products': set(), 'categories': set()}
+        for pk, percentage, start, end in discount_rows
+    }
+    for field, rows in (('products', product_rows), ('categories', category_rows)):
+        for discount_id, target_id in rows:
+            if discount_id in discounts:
+                discounts[discount_id][field].add(target_id)
+    return [
+        Window(pk, d['percentage'], d['start'], d['end'], frozenset(d['products']), frozenset(d['categories']))
+        for pk, d in discounts.items()
+    ]
+
+
+class PricingEngine:
+    """Process-wide holder of the loaded discount windows and the current index."""
+
+    VERSION_KEY = 'pricing'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def index(self, at=None):
+        """The DiscountIndex for `at` (default now); loads discounts only after changes."""
+        at = at or timezone.now()
+        version = catalog_cache.version(self.VERSION_KEY)
+        if self._stale(version, at):
+            self._loaded(load_windows(at), version, at)
+        return self._current(at)
+
+    async def aindex(self, at=None):
+        """index() for async views."""
+        at = at or timezone.now()
+        version = await catalog_cache.aversion(self.VERSION_KEY)
+        if self._stale(version, at):
+            self._loaded(await aload_windows(at), version, at)
+        return self._current(at)
+
+    def invalidate(self):
+        """
+        Makes every process reload discounts on its next index() call; with a
+        per-process cache backend, other processes within RELOAD_INTERVAL.
+        """
+        catalog_cache.bump(self.VERSION_KEY)
+
+    def _stale(self, version, at):
+        if self._windows is None or version != self._version or at < self._loaded_at:
+            return True
+        # Another process's invalidate() never reaches a per-process backend
+        return (
+            not catalog_cache.shares_versions
+            and time.monotonic() - self._reloaded >= options()['RELOAD_INTERVAL']
+        )
+
+    def _loaded(self, windows, version, at):
+        with self._lock:
+            self._reloaded = time.monotonic()
+            self._version = version
+            if windows == self._windows and at >= self._loaded_at:
+                return  # a periodic reload found nothing new: keep Last-Modified
+            self._windows, self._loaded_at = windows, at
+            self._index = None
+
+    def _current(self, at):
+        with self._lock:
+            if self._index is None or not self._index.is_valid(at):
+                self._index = DiscountIndex(self._windows, at, self._loaded_at)
+            return self._index
+
+    def clear(self):
+        """Drops this process's loaded discounts."""
+        self._windows = None
+        self._version = None
+        self._loaded_at = None
+        self._reloaded = None
+        self._index = None
+
+
+pricing_engine = PricingEngine()
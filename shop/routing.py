@@ -0,0 +1,163 @@
+"""
+Read/write splitting across a primary database and read replicas.
+
+ReplicaMiddleware picks one replica per GET/HEAD/OPTIONS request and
+ReadReplicaRouter sends that request's reads to it. Everything else uses the
+primary ('default'):
+
+  * writes, and every query of unsafe-method requests;
+  * reads inside a transaction on the primary (e.g. checkout);
+  * reads after the request wrote anything (e.g. a GET creating a cart);
+  * reads outside requests (management commands, the outbox worker);
+  * requests of clients that wrote within the last PIN_SECONDS, so they read
+    their own writes despite replication lag. Pins are kept per user in the
+    default cache (share it between processes) and in a cookie for clients
+    without a user.
+
+With no replica configured (DATABASE_ROUTING['REPLICAS'] empty, or naming
+aliases missing from DATABASES) the middleware and router do nothing.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+DEFAULTS = {
+    # Replica aliases; None means every configured alias except 'default'
+    'REPLICAS': None,
+    # Seconds a client keeps reading from the primary after a write
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'db_pin',
+}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = ContextVar('shop_db_routing', default=None)
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'DATABASE_ROUTING', {})}
+
+
+def replica_aliases(config=None):
+    config = config or options()
+    aliases = config['REPLICAS']
+    if aliases is None:
+        aliases = [alias for alias in connections.settings if alias != DEFAULT_DB_ALIAS]
+    return [alias for alias in aliases if alias in connections.settings and alias != DEFAULT_DB_ALIAS]
+
+
+def pin_key(user_id):
+    return f'db-pin:{user_id}'
+
+
+class RequestRouting:
+    """Routing state of one request."""
+
+    def __init__(self, request, replica, pinned):
+        self.request = request
+        self.replica = replica
+        self.pinned = pinned
+        self.wrote = False
+        self._user_checked = False
+
+    def read_alias(self):
+        if self.replica is None or self.wrote or self.pinned:
+            return DEFAULT_DB_ALIAS
+        if not self._user_checked:
+            user_id = authenticated_user_id(self.request)
+            if user_id is not None:
+                # Known once authentication ran; checked once per request
+                self._user_checked = True
+                self.pinned = cache.get(pin_key(user_id)) is not None
+                if self.pinned:
+                    return DEFAULT_DB_ALIAS
+        return self.replica
+
+
+def authenticated_user_id(request):
+    """The request user's id if authentication already ran; never triggers it."""
+    user = request.__dict__.get('user')
+    if user is None:
+        return None
+    if isinstance(user, SimpleLazyObject):
+        if user.__dict__.get('_wrapped', empty) is empty:
+            return None  # evaluating it would query (through this router)
+        user = user._wrapped
+    return user.pk if user.is_authenticated else None
+
+
+class ReadReplicaRouter:
+    """Database router for ReplicaMiddleware; see the module docstring."""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.read_alias()
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+
+class ReplicaMiddleware:
+    """Sets up read routing for each request and pins clients after writes."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state, config = self.start(request)
+        if state is None:
+            return self.get_response(request)
+        token = _state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(request, response, state, config)
+
+    async def __acall__(self, request):
+        state, config = self.start(request)
+        if state is None:
+            return await self.get_response(request)
+        token = _state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self.finish(request, response, state, config)
+
+    def start(self, request):
+        config = options()
+        replicas = replica_aliases(config)
+        if not replicas:
+            return None, config
+        replica = random.choice(replicas) if request.method in SAFE_METHODS else None
+        pinned = config['PIN_COOKIE'] in request.COOKIES
+        return RequestRouting(request, replica, pinned), config
+
+    def finish(self, request, response, state, config):
+        if state.wrote and response.status_code < 400:
+            seconds = config['PIN_SECONDS']
+            user_id = authenticated_user_id(request)
+            if user_id is not None:
+                cache.set(pin_key(user_id), 1, seconds)
+            response.set_cookie(config['PIN_COOKIE'], '1', max_age=seconds, httponly=True, samesite='Lax')
+        return response
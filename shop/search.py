@@ -0,0 +1,201 @@
+"""
+Full-text product search backed by an SQLite FTS5 inverted index.
+
+The index is a contentful FTS5 table whose rowid is the product id, with one
+column per searchable text: product name and description, category name and
+brand name. It is kept in sync incrementally from model signals (see
+shop/signals.py) and can be rebuilt with `manage.py rebuild_search_index`.
+Results are ranked with BM25, weighting name matches above the rest.
+
+BM25 has to score every matching document, which for very common words on a
+large catalog costs far more than the page being returned. Every match is
+ranked by default; setting SEARCH['MAX_RANKED_CANDIDATES'] bounds ranking to
+that many of the most recent matches (highest rowid) instead. Queries
+specific enough to match fewer documents are still ranked exactly, and
+results say whether older matches were left out.
+
+On database backends without FTS5 the search degrades to a case-insensitive
+substring match ordered like the catalog.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+
+from .models import Brand, Category, Product
+
+FTS_TABLE = 'shop_product_fts'
+# BM25 column weights: name, description, category, brand
+BM25_WEIGHTS = (10.0, 1.0, 4.0, 4.0)
+REBUILD_CHUNK_SIZE = 10000
+
+_DEFAULTS = {
+    # Upper bound on the number of matches scored per query (see module
+    # docstring); None ranks every match
+    'MAX_RANKED_CANDIDATES': None,
+}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# SELECT producing (rowid, name, description, category, brand) for products
+_SOURCE_SQL = f"""
+    SELECT p.id, p.name, p.description, COALESCE(c.name, ''), COALESCE(b.name, '')
+    FROM {Product._meta.db_table} p
+    LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_id
+    LEFT JOIN {Brand._meta.db_table} b ON b.id = p.brand_id
+"""
+
+
+def options():
+    return {**_DEFAULTS, **getattr(settings, 'SEARCH', {})}
+
+
+def is_supported():
+    return connection.vendor == 'sqlite'
+
+
+def index_products(product_ids):
+    """(Re)indexes the given products with two set-based statements per chunk."""
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        for ids, placeholders in _id_chunks(product_ids):
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", ids)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description, category, brand) "
+                f"{_SOURCE_SQL} WHERE p.id IN ({placeholders})",
+                ids
+            )
+
+
+def index_products_where(column, value):
+    """Reindexes every product whose category_id or brand_id equals value."""
+    if not is_supported():
+        return
+    assert column in ('category_id', 'brand_id')
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+            f"(SELECT id FROM {Product._meta.db_table} WHERE {column} = %s)",
+            [value]
+        )
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, category, brand) "
+            f"{_SOURCE_SQL} WHERE p.{column} = %s",
+            [value]
+        )
+
+
+def remove_products(product_ids):
+    if not is_supported():
+        return
+    with connection.cursor() as cursor:
+        for ids, placeholders in _id_chunks(product_ids):
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})", ids)
+
+
+def rebuild_index(chunk_size=REBUILD_CHUNK_SIZE, progress=None):
+    """
+    Repopulates the index from scratch, walking the product table by id range.
+    Returns the number of indexed products.
+    """
+    if not is_supported():
+        return 0
+    table = Product._meta.db_table
+    indexed = 0
+    last_id = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        while True:
+            cursor.execute(
+                f"SELECT MAX(id), COUNT(*) FROM (SELECT id FROM {table} "
+                "WHERE id > %s ORDER BY id LIMIT %s)",
+                [last_id, chunk_size]
+            )
+            upper, count = cursor.fetchone()
+            if not count:
+                break
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description, category, brand) "
+                f"{_SOURCE_SQL} WHERE p.id > %s AND p.id <= %s",
+                [last_id, upper]
+            )
+            indexed += count
+            last_id = upper
+            if progress:
+                progress(indexed)
+        # Merge the b-tree segments written by the chunked inserts
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return indexed
+
+
+def build_match_query(text):
+    """
+    Turns free text into a safe FTS5 query: every word is quoted (so operators
+    and punctuation in user input are inert) and the last word matches as a
+    prefix to support search-as-you-type. Returns None for empty input.
+    """
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def search_product_ids(text, limit, offset=0):
+    """
+    Returns ([product ids ranked by relevance], has_more, truncated); truncated
+    is True when more documents matched than were ranked.
+    """
+    if not is_supported():
+        return _fallback_search(text, limit, offset)
+
+    match = build_match_query(text)
+    if match is None:
+        return [], False, False
+    weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+    candidates = options()['MAX_RANKED_CANDIDATES']
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM ("
+            f"  SELECT rowid, bm25({FTS_TABLE}, {weights}) AS score FROM {FTS_TABLE}"
+            f"  WHERE {FTS_TABLE} MATCH %s ORDER BY rowid DESC LIMIT %s"
+            f") ORDER BY score, rowid LIMIT %s OFFSET %s",
+            [match, -1 if candidates is None else candidates, limit + 1, offset]
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+        truncated = False
+        if candidates is not None:
+            # Walks the index in rowid order without scoring
+            cursor.execute(
+                f"SELECT 1 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rowid DESC LIMIT 1 OFFSET %s",
+                [match, candidates]
+            )
+            truncated = cursor.fetchone() is not None
+    return ids[:limit], len(ids) > limit, truncated
+
+
+def _id_chunks(product_ids, size=500):
+    """Yields (ids, placeholders) pairs that stay below SQLite's variable limit."""
+    ids = list(product_ids)
+    for start in range(0, len(ids), size):
+        chunk = ids[start:start + size]
+        yield chunk, ', '.join(['%s'] * len(chunk))
+
+
+def _fallback_search(text, limit, offset):
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        return [], False, False
+    condition = Q()
+    for token in tokens:
+        condition &= (
+            Q(name__icontains=token) | Q(description__icontains=token)
+            | Q(category__name__icontains=token) | Q(brand__name__icontains=token)
+        )
+    ids = list(
+        Product.objects.filter(condition).values_list('id', flat=True)[offset:offset + limit + 1]
+    )
+    return ids[:limit], len(ids) > limit, False
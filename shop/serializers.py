@@ -1,41 +1,199 @@
+from django.core.files.storage import default_storage
+from django.db.models import OuterRef, Subquery
+from django.db.models.fields.json import KT
 from rest_framework import serializers
-from .models import Shop, Product, ProductImage, Cart,CartItem, Category, Order, ShopOrder, OrderDetail
+from .models import Shop, Product, ProductImage, Cart,CartItem, Category, Comment, Order, ShopOrder, OrderDetail
+from .pricing import discounted, pricing_engine
+
+
+def requested_fields(context):
+    """
+    Field names from ?fields=a,b on read requests, or None for all fields.
+    Views caching full payloads pass context['sparse'] = False.
+    """
+    request = context.get('request')
+    if request is None or request.method not in ('GET', 'HEAD') or not context.get('sparse', True):
+        return None
+    raw = request.query_params.get('fields')
+    if not raw:
+        return None
+    return {name.strip() for name in raw.split(',') if name.strip()}
+
+
+def check_fields(requested, available):
+    unknown = requested - set(available)
+    if unknown:
+        raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}."})
+
+
+def trim_fields(data, requested):
+    """Applies a sparse fieldset to an already rendered payload."""
+    return {name: value for name, value in data.items() if name in requested}
+
+
+def price_index(context):
+    """
+    The discount index used for a whole rendering: views pass it as
+    context['prices'], otherwise it is resolved once and kept in the context.
+    """
+    if 'prices' not in context:
+        context['prices'] = pricing_engine.index()
+    return context['prices']
+
+
+def sale_fields(product, context):
+    """sale_price and discount_percentage of a product, as rendered strings."""
+    percentage = price_index(context).percentage(product.pk, product.category_id)
+    return {
+        'sale_price': str(discounted(product.price, percentage)),
+        'discount_percentage': None if percentage is None else str(percentage),
+    }
+
+
+class SparseFieldsMixin:
+    """
+    Renders only the fields named in ?fields= (top level only; nested
+    serializers are built without a request and stay complete).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context)
+        if requested is not None:
+            check_fields(requested, self.fields)
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+class ProductImageSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    # Resized JPEG/WebP derivatives (see shop/images.py); empty until processed
+    variants = serializers.SerializerMethodField()
 
-class ProductImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'is_feature', 'alt_text']
+        fields = ['id', 'image', 'is_feature', 'alt_text', 'variants']
 
-class ShopSerializer(serializers.ModelSerializer):
+    def get_variants(self, obj):
+        request = self.context.get('request')
+        urls = {}
+        for name, path in obj.variants.items():
+            url = default_storage.url(path)
+            urls[name] = request.build_absolute_uri(url) if request else url
+        return urls
+
+class ShopSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Shop
         fields = ['id', 'name', 'slug', 'description', 'status']
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
     shop_name = serializers.ReadOnlyField(source='shop.name')
+    # price is the regular price; these reflect the best active discount
+    sale_price = serializers.SerializerMethodField()
+    discount_percentage = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = [
-            'id', 'shop', 'shop_name', 'category', 'name', 
-            'description', 'price', 'stock', 'images'
+            'id', 'shop', 'shop_name', 'category', 'sku', 'name', 
+            'description', 'price', 'sale_price', 'discount_percentage', 'stock', 'images',
+            'comment_count', 'units_sold'
         ]
-
-
-class CartItemSerializer(serializers.ModelSerializer):
+        read_only_fields = ['comment_count', 'units_sold']
+        extra_kwargs = {'sku': {'allow_blank': False}}
+
+    def to_representation(self, instance):
+        # Both discount fields come from one lookup per product
+        self._sale_fields = sale_fields(instance, self.context)
+        return super().to_representation(instance)
+
+    def get_sale_price(self, obj):
+        return self._sale_fields['sale_price']
+
+    def get_discount_percentage(self, obj):
+        return self._sale_fields['discount_percentage']
+
+
+class ProductListSerializer(serializers.BaseSerializer):
+    """
+    Compact, read-only product representation for catalog listings: what a
+    product card shows, with the feature image instead of the gallery.
+    Expects the queryset built by product_list_queryset() below.
+    """
+    FIELDS = (
+        'id', 'name', 'price', 'sale_price', 'discount_percentage', 'stock',
+        'shop', 'shop_name', 'image', 'thumbnail'
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.requested = requested_fields(self.context)
+        if self.requested is not None:
+            check_fields(self.requested, self.FIELDS)
+
+    def to_representation(self, product):
+        request = self.context.get('request')
+
+        def url(path):
+            if not path:
+                return None
+            url = default_storage.url(path)
+            return request.build_absolute_uri(url) if request else url
+
+        data = {
+            'id': product.id,
+            'name': product.name,
+            'price': str(product.price),
+            **sale_fields(product, self.context),
+            'stock': product.stock,
+            'shop': product.shop_id,
+            'shop_name': product.shop.name,
+            'image': url(product.feature_image),
+            'thumbnail': url(product.feature_thumbnail),
+        }
+        return data if self.requested is None else trim_fields(data, self.requested)
+
+
+def product_list_queryset():
+    """
+    Products with only the columns ProductListSerializer and the list sort
+    keys need, plus the feature image (or the first image when none is
+    flagged) and its thumbnail picked by correlated subqueries.
+    """
+    feature = ProductImage.objects.filter(product=OuterRef('pk')).order_by('-is_feature', 'id')
+    return (
+        Product.objects.select_related('shop')
+        .only(
+            'id', 'name', 'price', 'stock', 'shop_id', 'shop__name', 'category_id',
+            'created_at', 'units_sold', 'comment_count'
+        )
+        .annotate(
+            feature_image=Subquery(feature.values('image')[:1]),
+            feature_thumbnail=Subquery(
+                feature.annotate(thumbnail=KT('variants__thumb_webp')).values('thumbnail')[:1]
+            ),
+        )
+    )
+
+
+class CartItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_name = serializers.ReadOnlyField(source='product.name')
-    price = serializers.ReadOnlyField(source='product.price')
+    # The unit price checkout will charge, discounts applied
+    price = serializers.SerializerMethodField()
     subtotal = serializers.SerializerMethodField()
 
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'product_name', 'price', 'quantity', 'subtotal']
 
+    def get_price(self, obj):
+        return price_index(self.context).sale_price(obj.product)
+
     def get_subtotal(self, obj):
-        return obj.quantity * obj.product.price
+        return obj.quantity * self.get_price(obj)
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
 
@@ -44,19 +202,35 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'items', 'total_price']
 
     def get_total_price(self, obj):
-        return sum(item.quantity * item.product.price for item in obj.items.all())
+        prices = price_index(self.context)
+        return sum(item.quantity * prices.sale_price(item.product) for item in obj.items.all())
+
 
 
 
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = serializers.ReadOnlyField(source='user.username')
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'user', 'comment', 'created_at']
+
+class ModerationCommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    user = serializers.ReadOnlyField(source='user.username')
+    product_name = serializers.ReadOnlyField(source='product.name')
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'product', 'product_name', 'user', 'comment', 'created_at']
 
-class OrderDetailSerializer(serializers.ModelSerializer):
+class OrderDetailSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     product_name = serializers.ReadOnlyField(source='product.name')
 
     class Meta:
         model = OrderDetail
         fields = ['id', 'product', 'product_name', 'quantity', 'price']
 
-class ShopOrderSerializer(serializers.ModelSerializer):
+class ShopOrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     items = OrderDetailSerializer(many=True, read_only=True)
     shop_name = serializers.ReadOnlyField(source='shop.name')
 
@@ -64,7 +238,7 @@ class ShopOrderSerializer(serializers.ModelSerializer):
         model = ShopOrder
         fields = ['id', 'shop', 'shop_name', 'items', 'status', 'shop_total']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     shop_orders = ShopOrderSerializer(many=True, read_only=True)
 
     class Meta:
@@ -0,0 +1,4 @@
+"""
+Business services used by the shop views.
+Keeps multi-step, write-heavy workflows out of the viewsets.
+"""
@@ -0,0 +1,239 @@
+"""
+Vendor sales analytics.
+
+Dashboards read two rollup tables instead of the order history:
+  * ProductSalesRollup     (shop, product, date) -> units, revenue, order lines
+  * ShopOrderStatusRollup  (shop, date, status)  -> orders, revenue
+Both are incremented with multi-row INSERT ... ON CONFLICT DO UPDATE
+statements, so rolling up a checkout costs one statement per table no matter
+how many lines or shops it has. Checkouts and status changes only publish an
+outbox event (see shop/services/outbox.py); the worker applies it.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from ..db import increment_rows
+from ..models import OrderDetail, OutboxEvent, ProductSalesRollup, ShopOrder, ShopOrderStatusRollup
+from . import outbox
+
+BACKFILL_CHUNK_SIZE = 5000
+
+ORDER_PLACED = 'order.placed'
+SHOP_ORDER_STATUS = 'shop_order.status'
+
+
+def record_checkout(order, shop_orders):
+    """Queues a freshly created order and its shop orders for the rollups."""
+    # Placement status and total, as of now: later changes publish their own event
+    outbox.publish(ORDER_PLACED, {
+        'order_id': order.pk,
+        'shop_orders': {
+            str(shop_order.pk): {'status': shop_order.status, 'shop_total': str(shop_order.shop_total)}
+            for shop_order in shop_orders
+        },
+    })
+
+
+def record_status_change(shop_order, old_status):
+    """Queues moving one shop order from its previous status cell to the current one."""
+    if old_status != shop_order.status:
+        _publish_status(shop_order, old_status)
+
+
+def record_shop_order(shop_order):
+    """Queues a single shop order created outside checkout for the status rollup."""
+    _publish_status(shop_order, None)
+
+
+def _publish_status(shop_order, old_status):
+    # Everything the rollup needs, as of now: later changes publish their own event
+    outbox.publish(SHOP_ORDER_STATUS, {
+        'shop_id': shop_order.shop_id,
+        'date': timezone.localdate(shop_order.created_at).isoformat(),
+        'shop_total': str(shop_order.shop_total),
+        'old_status': old_status,
+        'status': shop_order.status,
+    })
+
+
+@outbox.subscriber(ORDER_PLACED)
+def roll_up_order(payload):
+    shop_orders = list(ShopOrder.objects.filter(main_order_id=payload['order_id']))
+    for shop_order in shop_orders:
+        at_checkout = payload['shop_orders'][str(shop_order.pk)]
+        shop_order.status = at_checkout['status']
+        shop_order.shop_total = Decimal(at_checkout['shop_total'])
+    lines = list(OrderDetail.objects.filter(order_id=payload['order_id']).select_related('shop_order'))
+    add_order(shop_orders, lines)
+
+
+@outbox.subscriber(SHOP_ORDER_STATUS)
+def roll_up_status(payload):
+    day = date.fromisoformat(payload['date'])
+    total = Decimal(payload['shop_total'])
+    cells = defaultdict(lambda: [0, Decimal('0')])
+    if payload['old_status'] is not None:
+        cells[(payload['shop_id'], day, payload['old_status'])] = [-1, -total]
+    cell = cells[(payload['shop_id'], day, payload['status'])]
+    cell[0] += 1
+    cell[1] += total
+    _add_statuses(cells)
+
+
+def add_order(shop_orders, lines):
+    """
+    Adds an order to the rollups.
+    shop_orders: ShopOrder instances; lines: OrderDetail instances.
+    """
+    sales = defaultdict(lambda: [0, Decimal('0'), 0])
+    dates = {}
+    for shop_order in shop_orders:
+        dates[shop_order.pk] = timezone.localdate(shop_order.created_at)
+    for line in lines:
+        cell = sales[(line.shop_order.shop_id, line.product_id, dates[line.shop_order_id])]
+        cell[0] += line.quantity
+        cell[1] += line.quantity * line.price
+        cell[2] += 1
+    _add_sales(sales)
+
+    statuses = defaultdict(lambda: [0, Decimal('0')])
+    for shop_order in shop_orders:
+        cell = statuses[(shop_order.shop_id, dates[shop_order.pk], shop_order.status)]
+        cell[0] += 1
+        cell[1] += shop_order.shop_total
+    _add_statuses(statuses)
+
+
+def dashboard(shop_id, date_from, date_to):
+    """Analytics for one shop over [date_from, date_to], read from the rollups only."""
+    sales = ProductSalesRollup.objects.filter(shop_id=shop_id, date__range=(date_from, date_to))
+    per_day = (
+        sales.values('date')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'), order_lines=Sum('order_lines'))
+        .order_by('date')
+    )
+    per_product = (
+        sales.values('product_id', 'product__name')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'))
+        .order_by('-units', 'product_id')
+    )
+    statuses = (
+        ShopOrderStatusRollup.objects
+        .filter(shop_id=shop_id, date__range=(date_from, date_to))
+        .values('status')
+        .annotate(orders=Sum('orders'), revenue=Sum('revenue'))
+        .filter(orders__gt=0)
+        .order_by('status')
+    )
+    return {
+        'shop': shop_id,
+        'from': date_from,
+        'to': date_to,
+        'revenue_per_day': list(per_day),
+        'units_per_product': [
+            {
+                'product': row['product_id'], 'product_name': row['product__name'],
+                'units': row['units'], 'revenue': row['revenue'],
+            }
+            for row in per_product
+        ],
+        'status_breakdown': list(statuses),
+    }
+
+
+def backfill(chunk_size=BACKFILL_CHUNK_SIZE, progress=None):
+    """
+    Rebuilds both rollups from the order history. Returns the number of shop orders read.
+
+    An order's sales cells never change once it is placed, so they are summed
+    one id range of ShopOrders at a time in autocommit reads, while checkouts
+    keep committing. Only the swap runs in a transaction (and so holds the
+    SQLite write lock): it adds the orders placed since the backfill started,
+    recounts the status rollup, whose cells keep moving, with one GROUP BY over
+    ShopOrder, replaces both tables and drops the queued rollup events, which
+    the history already contains. The summed sales cells are kept in memory
+    until then.
+    """
+    last_id = ShopOrder.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+    sales = defaultdict(lambda: [0, Decimal('0'), 0])
+    processed = 0
+    start = 0
+    while True:
+        ids = list(
+            ShopOrder.objects.filter(pk__gt=start, pk__lte=last_id).order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        _sum_sales(sales, shop_order__pk__gte=ids[0], shop_order__pk__lte=ids[-1])
+        processed += len(ids)
+        start = ids[-1]
+        if progress:
+            progress(processed)
+
+    with transaction.atomic():
+        _sum_sales(sales, shop_order__pk__gt=last_id)
+        statuses = (
+            ShopOrder.objects
+            .annotate(day=TruncDate('created_at'))
+            .values('shop_id', 'day', 'status')
+            .annotate(orders=Count('id'), revenue=Sum('shop_total'))
+            .order_by()
+        )
+        statuses = {
+            (row['shop_id'], row['day'], row['status']): [row['orders'], row['revenue']]
+            for row in statuses
+        }
+
+        OutboxEvent.objects.filter(topic__in=[ORDER_PLACED, SHOP_ORDER_STATUS]).delete()
+        ProductSalesRollup.objects.all().delete()
+        ShopOrderStatusRollup.objects.all().delete()
+        _add_sales(sales)
+        _add_statuses(statuses)
+    return sum(orders for orders, _ in statuses.values())
+
+
+def _sum_sales(sales, **window):
+    """Adds the order lines of the ShopOrders matching window to sales."""
+    rows = (
+        OrderDetail.objects.filter(**window)
+        .annotate(day=TruncDate('shop_order__created_at'))
+        .values('shop_order__shop_id', 'product_id', 'day')
+        .annotate(
+            units=Sum('quantity'),
+            revenue=Sum(F('quantity') * F('price'), output_field=DecimalField()),
+            lines=Count('id')
+        )
+        .order_by()
+    )
+    for row in rows:
+        cell = sales[(row['shop_order__shop_id'], row['product_id'], row['day'])]
+        cell[0] += row['units']
+        cell[1] += row['revenue']
+        cell[2] += row['lines']
+
+
+def _add_sales(cells):
+    """cells: {(shop_id, product_id, date): [units, revenue, order_lines]}"""
+    increment_rows(
+        ProductSalesRollup,
+        key_columns=('shop_id', 'product_id', 'date'),
+        value_columns=('units', 'revenue', 'order_lines'),
+        cells=cells
+    )
+
+
+def _add_statuses(cells):
+    """cells: {(shop_id, date, status): [orders, revenue]}"""
+    increment_rows(
+        ShopOrderStatusRollup,
+        key_columns=('shop_id', 'date', 'status'),
+        value_columns=('orders', 'revenue'),
+        cells=cells
+    )
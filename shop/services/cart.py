@@ -0,0 +1,276 @@
+"""
+Cart stores.
+
+Cart mutations go through a store chosen by settings.CART_STORE['BACKEND']:
+
+  * DatabaseCartStore (default) writes CartItem rows directly. Adding lines
+    is a single INSERT ... SELECT ... ON CONFLICT DO UPDATE statement that
+    resolves the cart and the products, creates missing lines and increments
+    existing ones, and returns the resulting quantities.
+  * CacheCartStore keeps lines in the Django cache and writes them through to
+    CartItem rows before the cart is listed or checked out, so add-to-cart
+    never writes to the database: it only reads, checking the product ids
+    with one lookup, and renders the cart from the cached lines plus one
+    product query (cart()). Each change to a cached cart reads and rewrites
+    the whole entry, so it holds a per-cart lock taken with cache.add(),
+    which is atomic on every backend.
+"""
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+
+from ..models import Cart, CartItem, Product
+
+DEFAULTS = {
+    'BACKEND': 'shop.services.cart.DatabaseCartStore',
+    'CACHE': 'default',
+    # Seconds an untouched cache-backed cart is kept
+    'TIMEOUT': 60 * 60 * 24 * 7,
+    # Seconds a cache-backed cart stays locked at most, and a writer waits for it
+    'LOCK_TIMEOUT': 5,
+}
+# Cart lines are always rendered with their product (name, price, subtotal)
+CART_ITEMS_PREFETCH = Prefetch('items', queryset=CartItem.objects.select_related('product'))
+# Lines per statement; keeps well below SQLite's bound-variable limit
+UPSERT_BATCH_SIZE = 400
+MAX_QUANTITY = 10000
+
+
+class CartError(Exception):
+    pass
+
+
+class InvalidQuantityError(CartError):
+    pass
+
+
+class CartBusyError(CartError):
+    pass
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'CART_STORE', {})}
+
+
+def cart_store():
+    """The configured store; read on each call so override_settings() applies."""
+    config = options()
+    return import_string(config['BACKEND'])(config)
+
+
+def parse_lines(lines, minimum):
+    """
+    Validates [{"product_id": .., "quantity": ..}, ...] into {product_id: quantity};
+    later entries for the same product win.
+    """
+    quantities = {}
+    try:
+        for line in lines:
+            product_id, quantity = int(line['product_id']), int(line.get('quantity', 1))
+            if quantity < minimum:
+                raise InvalidQuantityError(f"Quantity must be at least {minimum}")
+            if quantity > MAX_QUANTITY:
+                raise InvalidQuantityError(f"Quantity must be at most {MAX_QUANTITY}")
+            quantities[product_id] = quantity
+    except (KeyError, TypeError, ValueError):
+        raise InvalidQuantityError("Each line needs a product_id and an integer quantity")
+    return quantities
+
+
+def _known_products(quantities):
+    """quantities without the product ids that do not exist (one query)."""
+    known = set(Product.objects.filter(pk__in=list(quantities)).values_list('pk', flat=True))
+    return {pid: quantity for pid, quantity in quantities.items() if pid in known}
+
+
+class DatabaseCartStore:
+    """Cart lines stored as CartItem rows."""
+
+    def __init__(self, config=None):
+        self.config = config or options()
+
+    def add_lines(self, user_id, quantities):
+        """
+        Adds quantities to the user's cart lines. Returns {product_id: new quantity}
+        for every known product; unknown product ids are left out.
+        """
+        return self._upsert(user_id, quantities, increment=True)
+
+    def set_lines(self, user_id, quantities):
+        """Sets line quantities (0 removes the line). Returns {product_id: quantity}."""
+        removed = [pid for pid, quantity in quantities.items() if quantity == 0]
+        if removed:
+            CartItem.objects.filter(cart__user_id=user_id, product_id__in=removed).delete()
+        kept = {pid: quantity for pid, quantity in quantities.items() if quantity}
+        result = self._upsert(user_id, kept, increment=False) if kept else {}
+        result.update((pid, 0) for pid in removed)
+        return result
+
+    def remove(self, user_id, product_id):
+        deleted, _ = CartItem.objects.filter(cart__user_id=user_id, product_id=product_id).delete()
+        return bool(deleted)
+
+    def replace(self, user_id, quantities):
+        """Makes the stored lines exactly quantities (used to write caches through)."""
+        CartItem.objects.filter(cart__user_id=user_id).exclude(product_id__in=list(quantities)).delete()
+        if quantities:
+            self._upsert(user_id, quantities, increment=False)
+        else:
+            Cart.objects.get_or_create(user_id=user_id)
+
+    def cart(self, user_id):
+        """The user's cart with its lines and their products, for rendering."""
+        return Cart.objects.prefetch_related(CART_ITEMS_PREFETCH).get(user_id=user_id)
+
+    def flush(self, user_id):
+        """Persists pending lines before the cart is read from the database."""
+
+    def discard(self, user_id):
+        """Forgets pending lines after a checkout emptied the cart."""
+
+    def _upsert(self, user_id, quantities, increment):
+        if not quantities:
+            return {}
+        result = self._upsert_rows(user_id, quantities, increment)
+        if not result and not Cart.objects.filter(user_id=user_id).exists():
+            # First write for this user: create the cart and try again
+            Cart.objects.get_or_create(user_id=user_id)
+            result = self._upsert_rows(user_id, quantities, increment)
+        return result
+
+    def _upsert_rows(self, user_id, quantities, increment):
+        quote = connection.ops.quote_name
+        items, cart, product = (
+            quote(model._meta.db_table) for model in (CartItem, Cart, Product)
+        )
+        quantity = quote('quantity')
+        new_quantity = f'{items}.{quantity} + excluded.{quantity}' if increment else f'excluded.{quantity}'
+        lines = list(quantities.items())
+        result = {}
+        with connection.cursor() as cursor:
+            for start in range(0, len(lines), UPSERT_BATCH_SIZE):
+                batch = lines[start:start + UPSERT_BATCH_SIZE]
+                values = ', '.join(['(CAST(%s AS INTEGER), CAST(%s AS INTEGER))'] * len(batch))
+                # "WHERE 1 = 1" keeps SQLite from parsing ON CONFLICT as a join constraint
+                cursor.execute(
+                    f"INSERT INTO {items} (cart_id, product_id, {quantity}) "
+                    f"SELECT c.id, p.id, v.qty FROM (SELECT column1 AS pid, column2 AS qty FROM (VALUES {values}) AS t) v "
+                    f"JOIN {product} p ON p.id = v.pid "
+                    f"JOIN {cart} c ON c.user_id = %s "
+                    f"WHERE 1 = 1 "
+                    f"ON CONFLICT (cart_id, product_id) DO UPDATE SET {quantity} = {new_quantity} "
+                    f"RETURNING product_id, {quantity}",
+                    [value for line in batch for value in line] + [user_id]
+                )
+                result.update(cursor.fetchall())
+        return result
+
+
+class CacheCartStore(DatabaseCartStore):
+    """Cart lines kept in the cache and written through to the database on demand."""
+
+    @property
+    def cache(self):
+        return caches[self.config['CACHE']]
+
+    def add_lines(self, user_id, quantities):
+        quantities = _known_products(quantities)
+        with self._locked(user_id):
+            state = self._load(user_id)
+            for product_id, quantity in quantities.items():
+                state['lines'][product_id] = state['lines'].get(product_id, 0) + quantity
+            self._save(user_id, state)
+        return {pid: state['lines'][pid] for pid in quantities}
+
+    def set_lines(self, user_id, quantities):
+        quantities = _known_products(quantities)
+        with self._locked(user_id):
+            state = self._load(user_id)
+            for product_id, quantity in quantities.items():
+                if quantity:
+                    state['lines'][product_id] = quantity
+                else:
+                    state['lines'].pop(product_id, None)
+            self._save(user_id, state)
+        return dict(quantities)
+
+    def cart(self, user_id):
+        """
+        Renders from the cached lines without writing them through: the cart
+        and its lines are unsaved copies, so lines not written yet have no id.
+        """
+        state = self.cache.get(self._key(user_id)) or self._load(user_id)
+        products = Product.objects.in_bulk(list(state['lines']))
+        cart = Cart(pk=state['cart_id'], user_id=user_id)
+        cart._state.adding = False
+        cart._prefetched_objects_cache = {'items': [
+            CartItem(cart=cart, product=products[product_id], quantity=quantity)
+            for product_id, quantity in state['lines'].items() if product_id in products
+        ]}
+        return cart
+
+    def remove(self, user_id, product_id):
+        with self._locked(user_id):
+            state = self._load(user_id)
+            removed = state['lines'].pop(product_id, None) is not None
+            if removed:
+                self._save(user_id, state)
+        return removed
+
+    def flush(self, user_id):
+        with self._locked(user_id):
+            state = self.cache.get(self._key(user_id))
+            if state is not None and state['dirty']:
+                super().replace(user_id, state['lines'])
+                state['dirty'] = False
+                self.cache.set(self._key(user_id), state, self.config['TIMEOUT'])
+
+    def discard(self, user_id):
+        with self._locked(user_id):
+            self.cache.delete(self._key(user_id))
+
+    def _key(self, user_id):
+        return f'cart:{user_id}'
+
+    @contextmanager
+    def _locked(self, user_id):
+        """
+        Holds the cart's lock for a read-modify-write. The lock expires by
+        itself so a crashed holder cannot block the cart for longer than
+        LOCK_TIMEOUT; raises CartBusyError if it is not free by then.
+        """
+        key, token = f'{self._key(user_id)}:lock', uuid.uuid4().hex
+        timeout = self.config['LOCK_TIMEOUT']
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        while not self.cache.add(key, token, timeout):
+            if time.monotonic() >= deadline:
+                raise CartBusyError("The cart is being updated; try again")
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            if self.cache.get(key) == token:
+                self.cache.delete(key)
+
+    def _load(self, user_id):
+        state = self.cache.get(self._key(user_id))
+        if state is None:
+            # Seed from the database so lines added before switching stores survive
+            lines = dict(
+                CartItem.objects.filter(cart__user_id=user_id).values_list('product_id', 'quantity')
+            )
+            cart, _ = Cart.objects.get_or_create(user_id=user_id)
+            state = {'cart_id': cart.pk, 'lines': lines, 'dirty': False}
+        return state
+
+    def _save(self, user_id, state):
+        state['dirty'] = True
+        self.cache.set(self._key(user_id), state, self.config['TIMEOUT'])
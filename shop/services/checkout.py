@@ -0,0 +1,96 @@
+from collections import defaultdict
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.db import transaction
+
+from ..models import CartItem, Order, OrderDetail, OrderStatus, ShopOrder
+from ..pricing import pricing_engine
+from .analytics import record_checkout
+from .inventory import reserve_stock
+
+
+class CheckoutError(Exception):
+    """Base class for errors that abort a checkout."""
+
+
+class EmptyCartError(CheckoutError):
+    """Raised when the cart has no items to check out."""
+
+
+@dataclass
+class CheckoutResult:
+    """Outcome of a successful checkout."""
+    order: Order
+    shop_orders: list = field(default_factory=list)
+
+
+def checkout_cart(cart):
+    """
+    Converts a cart into an Order, one ShopOrder per shop and its OrderDetail lines.
+
+    Runs as a set-based pipeline so the number of statements does not grow with
+    the cart size:
+      1. Load every cart line with its product and shop in a single query.
+      2. Price lines with the in-memory discount index and compute line, shop
+         and order totals in memory.
+      3. Reserve stock with one conditional UPDATE per batch of products.
+      4. Insert the Order, then all ShopOrders and OrderDetails with bulk_create.
+      5. Clear the cart with a single DELETE.
+    """
+    prices = pricing_engine.index()
+    with transaction.atomic():
+        items = list(
+            CartItem.objects.filter(cart=cart).select_related('product__shop')
+        )
+        if not items:
+            raise EmptyCartError("Cart is empty")
+
+        # Group lines by shop and compute totals before writing anything
+        lines_by_shop = defaultdict(list)
+        shop_totals = defaultdict(Decimal)
+        unit_prices = {}
+        for item in items:
+            product = item.product
+            unit_prices[item.pk] = prices.sale_price(product)
+            lines_by_shop[product.shop_id].append(item)
+            shop_totals[product.shop_id] += item.quantity * unit_prices[item.pk]
+        total_amount = sum(shop_totals.values(), Decimal('0'))
+
+        # Raises InsufficientStockError and rolls everything back if any line is short
+        reserve_stock({item.product_id: item.quantity for item in items})
+
+        main_order = Order.objects.create(
+            user_id=cart.user_id,
+            total_amount=total_amount,
+            status=OrderStatus.PENDING
+        )
+
+        shop_orders = ShopOrder.objects.bulk_create([
+            ShopOrder(
+                main_order=main_order,
+                shop_id=shop_id,
+                shop_total=shop_totals[shop_id],
+                status=OrderStatus.PENDING
+            )
+            for shop_id in lines_by_shop
+        ])
+
+        OrderDetail.objects.bulk_create([
+            OrderDetail(
+                order=main_order,
+                shop_order=shop_order,
+                product=item.product,
+                quantity=item.quantity,
+                price=unit_prices[item.pk]
+            )
+            for shop_order in shop_orders
+            for item in lines_by_shop[shop_order.shop_id]
+        ])
+
+        # bulk_create skips signals, so queue the vendor analytics rollups directly
+        record_checkout(main_order, shop_orders)
+
+        CartItem.objects.filter(cart=cart).delete()
+
+    return CheckoutResult(order=main_order, shop_orders=shop_orders)
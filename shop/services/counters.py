@@ -0,0 +1,66 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now
+
+from ..cache import catalog_cache
+from ..models import Comment, OrderDetail, Product
+
+RECONCILE_CHUNK_SIZE = 5000
+
+
+def adjust_comment_count(product_id, delta):
+    """Adds delta to a product's approved comment count in one UPDATE."""
+    Product.objects.filter(pk=product_id).update(
+        comment_count=F('comment_count') + delta, updated_at=Now()
+    )
+    catalog_cache.invalidate_products([product_id])
+
+
+def _counter_expressions():
+    approved = (
+        Comment.objects.filter(product=OuterRef('pk'), is_approved=True)
+        .values('product').annotate(n=Count('id')).values('n')
+    )
+    sold = (
+        OrderDetail.objects.filter(product=OuterRef('pk'))
+        .values('product').annotate(n=Sum('quantity')).values('n')
+    )
+    return {
+        'actual_comments': Coalesce(Subquery(approved, output_field=IntegerField()), Value(0)),
+        'actual_sold': Coalesce(Subquery(sold, output_field=IntegerField()), Value(0)),
+    }
+
+
+def reconcile_counters(chunk_size=RECONCILE_CHUNK_SIZE, progress=None):
+    """
+    Recomputes comment_count and units_sold from Comment and OrderDetail,
+    walking the product table by id in chunks so each statement stays short.
+    Only drifted products are written. Returns (products checked, products fixed).
+    """
+    checked = fixed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Product.objects.filter(pk__gt=last_id).order_by('pk')
+            .values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            break
+        drifted = list(
+            Product.objects.filter(pk__gte=ids[0], pk__lte=ids[-1])
+            .annotate(**_counter_expressions())
+            .filter(~Q(comment_count=F('actual_comments')) | ~Q(units_sold=F('actual_sold')))
+            .values_list('pk', 'actual_comments', 'actual_sold')
+        )
+        for pk, comments, sold in drifted:
+            Product.objects.filter(pk=pk).update(
+                comment_count=comments, units_sold=sold, updated_at=Now()
+            )
+        if drifted:
+            catalog_cache.invalidate_products([pk for pk, _, _ in drifted])
+
+        checked += len(ids)
+        fixed += len(drifted)
+        last_id = ids[-1]
+        if progress:
+            progress(checked, fixed)
+    return checked, fixed
@@ -0,0 +1,138 @@
+"""
+Idempotency keys for retried writes.
+
+A client sends an Idempotency-Key header with a write it may have to retry.
+The first request with a key claims it by inserting an IdempotencyKey row
+(the unique constraint decides between concurrent duplicates), runs, and
+stores its response in the same transaction as its own writes. Later
+requests with the key get the stored response back without running again;
+duplicates that arrive while the first one is still running poll the row
+until its response is stored.
+
+Keys are kept for TTL seconds; `manage.py purge_idempotency_keys` deletes
+expired rows. A claim whose request died without storing a response is taken
+over once it is older than CLAIM_TIMEOUT.
+"""
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from ..models import IdempotencyKey
+
+DEFAULTS = {
+    # Seconds a key is remembered
+    'TTL': 60 * 60 * 24,
+    # Seconds a duplicate waits for the first request's response
+    'WAIT_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.05,
+    # Seconds after which an unfinished claim is considered abandoned
+    'CLAIM_TIMEOUT': 60,
+}
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+
+
+class IdempotencyError(Exception):
+    status_code = 409
+
+
+class InvalidKeyError(IdempotencyError):
+    status_code = 400
+
+
+class KeyReusedError(IdempotencyError):
+    """The key was first used for another endpoint."""
+    status_code = 422
+
+
+class RequestInProgressError(IdempotencyError):
+    """The first request with the key did not finish within WAIT_TIMEOUT."""
+    status_code = 409
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'IDEMPOTENCY', {})}
+
+
+def run_once(user_id, key, scope, handler):
+    """
+    Runs handler() (returning a DRF Response) once per (user, key) and returns
+    (status code, response data, replayed). Responses with a 5xx status, and
+    exceptions, release the key so the client can retry.
+    """
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise InvalidKeyError(f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters long")
+    config = options()
+    record = _claim_or_wait(user_id, key, scope, config)
+    if record.status_code is not None:
+        return record.status_code, record.response, True
+
+    try:
+        with transaction.atomic():
+            response = handler()
+            if response.status_code < 500:
+                # Stored as the client sees it (e.g. Decimals rendered as numbers)
+                data = json.loads(JSONRenderer().render(response.data) or 'null')
+                IdempotencyKey.objects.filter(pk=record.pk).update(
+                    status_code=response.status_code, response=data
+                )
+    except BaseException:
+        _release(record)
+        raise
+    if response.status_code >= 500:
+        _release(record)
+    return response.status_code, response.data, False
+
+
+def purge_expired(now=None):
+    """Deletes expired keys; returns how many."""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
+
+
+def _claim_or_wait(user_id, key, scope, config):
+    """Returns our fresh claim, or the finished record of an earlier request."""
+    deadline = time.monotonic() + config['WAIT_TIMEOUT']
+    while True:
+        now = timezone.now()
+        expires_at = now + timedelta(seconds=config['TTL'])
+        # Retries are the common case for an existing key: look before inserting
+        record = IdempotencyKey.objects.filter(user_id=user_id, key=key).first()
+        if record is None:
+            try:
+                with transaction.atomic():
+                    return IdempotencyKey.objects.create(
+                        user_id=user_id, key=key, scope=scope, created_at=now, expires_at=expires_at
+                    )
+            except IntegrityError:
+                continue  # a concurrent duplicate claimed it first
+        abandoned = (
+            record.status_code is None
+            and record.created_at <= now - timedelta(seconds=config['CLAIM_TIMEOUT'])
+        )
+        if record.expires_at <= now or abandoned:
+            # Take the row over, unless another request just did
+            taken = IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).update(
+                scope=scope, status_code=None, response=None, created_at=now, expires_at=expires_at
+            )
+            if taken:
+                record.scope, record.status_code, record.response = scope, None, None
+                record.created_at, record.expires_at = now, expires_at
+                return record
+            continue
+        if record.scope != scope:
+            raise KeyReusedError(f"This {HEADER} was already used for {record.scope}")
+        if record.status_code is not None:
+            return record
+        if time.monotonic() >= deadline:
+            raise RequestInProgressError(f"A request with this {HEADER} is still in progress")
+        time.sleep(config['POLL_INTERVAL'])
+
+
+def _release(record):
+    IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).delete()
@@ -0,0 +1,118 @@
+from dataclasses import asdict, dataclass
+
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Now
+
+from .. import facets
+from ..cache import catalog_cache
+from ..models import Product
+
+# Products reserved per conditional UPDATE statement
+RESERVATION_BATCH_SIZE = 500
+# How often a batch is retried when it fails but no shortfall is visible any more
+RESERVATION_ATTEMPTS = 3
+
+
+@dataclass
+class Shortfall:
+    """A cart line that cannot be fulfilled from the current stock."""
+    product_id: int
+    product_name: str
+    requested: int
+    available: int
+
+    def as_dict(self):
+        return asdict(self)
+
+
+class InsufficientStockError(Exception):
+    """Raised when one or more products do not have enough stock left."""
+
+    def __init__(self, shortfalls):
+        self.shortfalls = shortfalls
+        super().__init__("Insufficient stock")
+
+    def as_dict(self):
+        return {
+            "error": str(self),
+            "shortfalls": [shortfall.as_dict() for shortfall in self.shortfalls],
+        }
+
+
+class _PartialReservation(Exception):
+    """Rolls back a batch in which at least one product was short."""
+
+
+def reserve_stock(quantities):
+    """
+    Decrements Product.stock for every {product_id: quantity} pair.
+
+    Each batch is a single conditional statement:
+        UPDATE product SET stock = stock - <qty>
+        WHERE id IN (...) AND stock >= <qty>
+    so concurrent checkouts never hold row locks while Python code runs and can
+    never drive stock below zero. The same statement adds the quantity to the
+    denormalized Product.units_sold counter. If the statement updates fewer rows than
+    requested, the batch is rolled back and an InsufficientStockError carrying
+    a per-line shortfall report is raised. Call inside the checkout transaction
+    so earlier batches are rolled back as well.
+    """
+    shortfalls = []
+    product_ids = sorted(quantities)  # stable order avoids lock-order deadlocks
+
+    for start in range(0, len(product_ids), RESERVATION_BATCH_SIZE):
+        batch = {pid: quantities[pid] for pid in product_ids[start:start + RESERVATION_BATCH_SIZE]}
+        for _ in range(RESERVATION_ATTEMPTS):
+            if _reserve_batch(batch):
+                break
+            batch_shortfalls = _find_shortfalls(batch)
+            if batch_shortfalls:
+                shortfalls.extend(batch_shortfalls)
+                break
+        else:
+            # Stock kept moving under us; report the whole batch rather than oversell
+            shortfalls.extend(_find_shortfalls(batch, only_short=False))
+
+    if shortfalls:
+        raise InsufficientStockError(shortfalls)
+
+    # Queryset updates bypass the model signals that keep the catalog cache
+    # and the facet summary up to date. Stale stock must not be served, so the
+    # cache is invalidated here; the facet deltas go through the outbox.
+    catalog_cache.invalidate_products(product_ids)
+    facets.stock_depleted(product_ids)
+
+
+def _quantity_case(batch):
+    return Case(
+        *[When(pk=pid, then=Value(quantity)) for pid, quantity in batch.items()],
+        output_field=models.PositiveIntegerField()
+    )
+
+
+def _reserve_batch(batch):
+    try:
+        with transaction.atomic():
+            requested = _quantity_case(batch)
+            updated = Product.objects.filter(
+                pk__in=batch, stock__gte=requested
+            ).update(
+                stock=F('stock') - requested, units_sold=F('units_sold') + requested, updated_at=Now()
+            )
+            if updated != len(batch):
+                raise _PartialReservation
+    except _PartialReservation:
+        return False
+    return True
+
+
+def _find_shortfalls(batch, only_short=True):
+    rows = Product.objects.filter(pk__in=batch).values_list('id', 'name', 'stock')
+    found = {pid: (name, stock) for pid, name, stock in rows}
+    shortfalls = []
+    for pid, quantity in batch.items():
+        name, stock = found.get(pid, ('', 0))
+        if stock < quantity or not only_short:
+            shortfalls.append(Shortfall(pid, name, quantity, stock))
+    return shortfalls
@@ -0,0 +1,70 @@
+"""
+Comment moderation.
+
+A comment is pending until a manager of its shop approves or rejects it
+(moderated_at is set either way). Both hot reads are served by partial
+indexes that only hold the rows they need:
+  * a shop's queue, oldest first:      comment_pending_shop_idx (shop, created_at, id)
+  * a product's public comments:       comment_approved_product_idx (product, -created_at, -id)
+Comment.shop copies product.shop so the queue needs no join through products.
+
+moderate() handles a whole selection with a single UPDATE. Bulk updates skip
+the Comment signals, so it also moves Product.comment_count itself, with one
+UPDATE per distinct number of approvals per product.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Now
+
+from ..cache import catalog_cache
+from ..models import Comment, Product
+
+APPROVE = 'approve'
+REJECT = 'reject'
+ACTIONS = (APPROVE, REJECT)
+# Comments per moderate() call; keeps the statement below SQLite's bound-variable limit
+MAX_BULK_COMMENTS = 5000
+
+
+def pending(shop_id):
+    """The moderation queue of a shop."""
+    return Comment.objects.filter(shop_id=shop_id, is_approved=False, moderated_at__isnull=True)
+
+
+def approved(product_id):
+    """The public comments of a product."""
+    return Comment.objects.filter(product_id=product_id, is_approved=True)
+
+
+def moderate(shop_id, manager_id, comment_ids, action):
+    """
+    Approves or rejects the pending comments of the shop among comment_ids;
+    others (unknown, another shop's, already moderated) are left alone.
+    Returns the number of comments moderated.
+    """
+    with transaction.atomic():
+        rows = list(
+            pending(shop_id).filter(pk__in=comment_ids).select_for_update().values_list('pk', 'product_id')
+        )
+        if not rows:
+            return 0
+        Comment.objects.filter(pk__in=[pk for pk, _ in rows]).update(
+            is_approved=action == APPROVE, moderated_by_id=manager_id, moderated_at=Now(), updated_at=Now()
+        )
+        if action == APPROVE:
+            _count_approvals(Counter(product_id for _, product_id in rows))
+    return len(rows)
+
+
+def _count_approvals(approvals):
+    """approvals: {product id: comments approved}"""
+    by_delta = defaultdict(list)
+    for product_id, delta in approvals.items():
+        by_delta[delta].append(product_id)
+    for delta, product_ids in by_delta.items():
+        Product.objects.filter(pk__in=product_ids).update(
+            comment_count=F('comment_count') + delta, updated_at=Now()
+        )
+    catalog_cache.invalidate_products(list(approvals))
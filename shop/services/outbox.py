@@ -0,0 +1,210 @@
+"""
+Transactional outbox.
+
+Writes that have side effects (analytics rollups, vendor notifications,
+index updates) only insert an OutboxEvent inside their own transaction, so
+the event exists exactly when the write committed and the request path does
+no more than that insert. `manage.py run_outbox_worker` carries the events
+out in the background:
+
+  * claim: a batch of due events is leased by pushing their available_at out
+    by LEASE seconds and stamping the worker id. Databases with SKIP LOCKED
+    select the batch with it; elsewhere (SQLite) the conditional UPDATE alone
+    keeps two workers from leasing the same row.
+  * handle: each event runs its topic's subscribers and is deleted in one
+    transaction, so database side effects are applied once. A worker that
+    lost its lease (it ran longer than LEASE) rolls back instead.
+  * retry: a failed event is released with exponential backoff and jitter;
+    after MAX_ATTEMPTS it is parked with failed_at set.
+
+Subscribers register with @subscriber('topic') and receive the JSON payload.
+"""
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from ..models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'BATCH_SIZE': 100,
+    # Events handled in parallel by one worker process
+    'CONCURRENCY': 4,
+    # Seconds a claimed event stays invisible to other workers
+    'LEASE': 60,
+    'MAX_ATTEMPTS': 10,
+    # Retry delay: BACKOFF * 2 ** (attempts - 1) seconds, at most MAX_BACKOFF
+    'BACKOFF': 1,
+    'MAX_BACKOFF': 600,
+    # Seconds an idle worker waits before polling again
+    'POLL_INTERVAL': 1,
+}
+
+_subscribers = defaultdict(list)
+
+
+class LeaseLostError(Exception):
+    """Another worker claimed the event while this one was handling it."""
+
+
+def options():
+    return {**DEFAULTS, **getattr(settings, 'OUTBOX', {})}
+
+
+def subscriber(topic):
+    """Registers the decorated function(payload) as a handler of topic."""
+    def register(func):
+        _subscribers[topic].append(func)
+        return func
+    return register
+
+
+def publish(topic, payload):
+    """Records an event; call inside the transaction of the write it belongs to."""
+    return OutboxEvent.objects.create(topic=topic, payload=payload)
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claim(worker, limit, lease):
+    """Leases up to limit due events to worker; returns them."""
+    now = timezone.now()
+    leased_until = now + timedelta(seconds=lease)
+    due = OutboxEvent.objects.filter(failed_at__isnull=True, available_at__lte=now)
+    candidates = due.order_by('available_at', 'id').values_list('pk', flat=True)
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True)[:limit])
+            due.filter(pk__in=ids).update(available_at=leased_until, locked_by=worker)
+    else:
+        # No row locks to skip (SQLite): rows another worker leased in between
+        # no longer match `due`, so the conditional UPDATE leaves them alone
+        ids = list(candidates[:limit])
+        due.filter(pk__in=ids).update(available_at=leased_until, locked_by=worker)
+    if not ids:
+        return []
+    return list(
+        OutboxEvent.objects.filter(pk__in=ids, locked_by=worker, available_at=leased_until).order_by('id')
+    )
+
+
+def handle(event, worker, config=None):
+    """Runs the subscribers of one claimed event. Returns True when it was handled."""
+    config = config or options()
+    try:
+        with transaction.atomic():
+            subscribers = _subscribers.get(event.topic)
+            if not subscribers:
+                raise LookupError(f"No subscriber for outbox topic {event.topic!r}")
+            for func in subscribers:
+                func(event.payload)
+            deleted, _ = OutboxEvent.objects.filter(
+                pk=event.pk, locked_by=worker, available_at=event.available_at
+            ).delete()
+            if not deleted:
+                raise LeaseLostError
+        return True
+    except LeaseLostError:
+        logger.warning("Lost the lease on outbox event %s; another worker handles it", event.pk)
+        return False
+    except Exception as exc:
+        _release_failed(event, worker, exc, config)
+        return False
+
+
+def process_batch(worker, config=None, executor=None):
+    """Claims and handles one batch; returns (claimed, handled)."""
+    config = config or options()
+    events = claim(worker, config['BATCH_SIZE'], config['LEASE'])
+    if executor is None:
+        results = [handle(event, worker, config) for event in events]
+    else:
+        results = list(executor.map(lambda event: _handle_in_thread(event, worker, config), events))
+    return len(events), sum(results)
+
+
+def process_pending(config=None, concurrency=None):
+    """Handles due events until none is left; returns how many were handled."""
+    config = config or options()
+    concurrency = config['CONCURRENCY'] if concurrency is None else concurrency
+    worker = worker_id()
+    handled = 0
+    with _executor(concurrency) as executor:
+        while True:
+            claimed, done = process_batch(worker, config, executor)
+            handled += done
+            if not claimed:
+                return handled
+
+
+def run_worker(config=None, concurrency=None, stop=lambda: False, progress=None):
+    """Polls for events until stop() returns True."""
+    config = config or options()
+    concurrency = config['CONCURRENCY'] if concurrency is None else concurrency
+    worker = worker_id()
+    with _executor(concurrency) as executor:
+        while not stop():
+            try:
+                claimed, handled = process_batch(worker, config, executor)
+            except DatabaseError:
+                # e.g. SQLite reporting a busy database; claimed events expire with their lease
+                logger.exception("Outbox batch failed; retrying")
+                claimed = handled = 0
+            if progress is not None and claimed:
+                progress(claimed, handled)
+            if not claimed:
+                time.sleep(config['POLL_INTERVAL'])
+
+
+def retry_delay(attempts, config):
+    delay = min(config['BACKOFF'] * 2 ** (attempts - 1), config['MAX_BACKOFF'])
+    # Jitter spreads out retries of events that failed together
+    return delay * random.uniform(0.5, 1)
+
+
+def _release_failed(event, worker, exc, config):
+    attempts = event.attempts + 1
+    now = timezone.now()
+    changes = {'attempts': attempts, 'last_error': f"{type(exc).__name__}: {exc}", 'locked_by': ''}
+    if attempts >= config['MAX_ATTEMPTS']:
+        changes['failed_at'] = now
+        logger.error("Outbox event %s (%s) failed %s times; giving up", event.pk, event.topic, attempts)
+    else:
+        changes['available_at'] = now + timedelta(seconds=retry_delay(attempts, config))
+        logger.warning("Outbox event %s (%s) failed: %s", event.pk, event.topic, exc)
+    try:
+        OutboxEvent.objects.filter(pk=event.pk, locked_by=worker).update(**changes)
+    except DatabaseError:
+        # The event becomes due again when its lease runs out
+        logger.exception("Could not release outbox event %s", event.pk)
+
+
+def _handle_in_thread(event, worker, config):
+    try:
+        return handle(event, worker, config)
+    finally:
+        connection.close_if_unusable_or_obsolete()
+
+
+@contextmanager
+def _executor(concurrency):
+    """A thread pool for concurrency > 1, or None to handle events inline."""
+    if concurrency <= 1:
+        yield None
+        return
+    with ThreadPoolExecutor(concurrency, thread_name_prefix='outbox') as pool:
+        yield pool
@@ -0,0 +1,250 @@
+"""
+Bulk product import for shop managers.
+
+A job reads a CSV or NDJSON stream one row at a time and upserts products by
+(shop, sku) in chunks: each chunk is validated in memory, resolved against
+category/brand lookup maps built once per job, and written with a single
+bulk_create(update_conflicts=True). bulk_create bypasses model signals, so
+every chunk also updates the catalog cache, the search index and the facet
+summary explicitly, inside the same transaction as the write.
+
+A file that stops being readable part way (bad encoding, broken CSV quoting)
+aborts the job with UnreadableFileError. Chunks written before that point
+stay committed; the error says how many products they hold.
+"""
+import codecs
+import csv
+import json
+from collections import Counter
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .. import facets, search
+from ..cache import catalog_cache
+from ..models import Brand, Category, Product, Status
+
+IMPORT_CHUNK_SIZE = 1000
+# Rows with errors beyond this many are counted but not itemised in the report
+MAX_REPORTED_ERRORS = 1000
+
+FORMATS = ('csv', 'ndjson')
+UPDATE_FIELDS = ['name', 'description', 'price', 'stock', 'status', 'category', 'brand', 'updated_at']
+
+_SKU_LENGTH = Product._meta.get_field('sku').max_length
+_NAME_LENGTH = Product._meta.get_field('name').max_length
+_MAX_PRICE = Decimal('99999999.99')
+_STATUSES = set(Status.values)
+
+
+@dataclass
+class ImportReport:
+    created: int = 0
+    updated: int = 0
+    failed: int = 0
+    errors: list = field(default_factory=list)
+
+    def add_error(self, row_number, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row_number, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class UnreadableFileError(Exception):
+    """Raised when an import file cannot be decoded or parsed at some row."""
+
+    def __init__(self, row, reason, report):
+        self.row = row
+        self.report = report
+        committed = report.created + report.updated
+        super().__init__(
+            f"Row {row} could not be read ({reason}); the import stopped there. "
+            + (f"{committed} products from earlier rows were saved." if committed else "Nothing was saved.")
+        )
+
+    def as_dict(self):
+        return {'error': str(self), 'row': self.row, **self.report.as_dict()}
+
+
+def decode_lines(stream, encoding='utf-8-sig'):
+    """
+    Decodes a binary stream one line at a time, so a decoding error surfaces
+    at the row that holds it rather than somewhere in a read-ahead block.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    for line in stream:
+        yield decoder.decode(line)
+    tail = decoder.decode(b'', final=True)
+    if tail:
+        yield tail
+
+
+def read_rows(stream, file_format):
+    """
+    Yields (row number, dict or None) from a text stream or iterable of lines;
+    None marks a line that could not be parsed. Row numbers count data rows from 1.
+    """
+    if file_format == 'csv':
+        for number, row in enumerate(csv.DictReader(stream), start=1):
+            yield number, row
+    elif file_format == 'ndjson':
+        number = 0
+        for line in stream:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+    else:
+        raise ValueError(f"Unknown import format {file_format!r}")
+
+
+class LabelMap:
+    """Case-insensitive name -> id lookup for a label model, loaded once per job."""
+
+    def __init__(self, model):
+        self.ids = {name.casefold(): pk for pk, name in model.objects.values_list('pk', 'name')}
+
+    def resolve(self, name):
+        """Returns (id or None, error or None)."""
+        name = (name or '').strip()
+        if not name:
+            return None, None
+        pk = self.ids.get(name.casefold())
+        if pk is None:
+            return None, f"Unknown name {name!r}."
+        return pk, None
+
+
+def import_products(shop_id, rows, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Upserts the products described by rows (see read_rows) into the shop.
+    Raises UnreadableFileError if the file breaks off part way.
+    """
+    report = ImportReport()
+    categories = LabelMap(Category)
+    brands = LabelMap(Brand)
+
+    chunk = {}
+    number = 0
+    try:
+        for number, row in rows:
+            product, errors = _build_product(shop_id, row, categories, brands)
+            if errors:
+                report.add_error(number, errors)
+                continue
+            # A repeated sku within a chunk replaces the earlier row, as it would across chunks
+            chunk[product.sku] = product
+            if len(chunk) >= chunk_size:
+                _write_chunk(shop_id, list(chunk.values()), report)
+                chunk = {}
+    except UnicodeDecodeError:
+        raise UnreadableFileError(number + 1, "not valid UTF-8", report)
+    except csv.Error as exc:
+        raise UnreadableFileError(number + 1, f"malformed CSV: {exc}", report)
+    if chunk:
+        _write_chunk(shop_id, list(chunk.values()), report)
+    return report
+
+
+def _build_product(shop_id, row, categories, brands):
+    """Validates one row; returns (unsaved Product, None) or (None, {field: message})."""
+    if row is None:
+        return None, {'row': "Could not parse row."}
+
+    def text(name):
+        value = row.get(name)
+        return '' if value is None else str(value).strip()
+
+    errors = {}
+    sku = text('sku')
+    if not sku:
+        errors['sku'] = "This field is required."
+    elif len(sku) > _SKU_LENGTH:
+        errors['sku'] = f"Ensure this field has no more than {_SKU_LENGTH} characters."
+
+    name = text('name')
+    if not name:
+        errors['name'] = "This field is required."
+    elif len(name) > _NAME_LENGTH:
+        errors['name'] = f"Ensure this field has no more than {_NAME_LENGTH} characters."
+
+    description = text('description')
+    if not description:
+        errors['description'] = "This field is required."
+
+    price = None
+    try:
+        price = Decimal(text('price'))
+        if not Decimal('0.01') <= price <= _MAX_PRICE or price.as_tuple().exponent < -2:
+            errors['price'] = "Expected a price between 0.01 and 99999999.99 with at most 2 decimals."
+    except InvalidOperation:
+        errors['price'] = "A valid number is required."
+
+    stock = 0
+    if text('stock'):
+        try:
+            stock = int(text('stock'))
+            if stock < 0:
+                raise ValueError
+        except ValueError:
+            errors['stock'] = "Expected a non-negative integer."
+
+    status = text('status') or Status.ACTIVE
+    if status not in _STATUSES:
+        errors['status'] = f"Expected one of {', '.join(sorted(_STATUSES))}."
+
+    category_id, error = categories.resolve(text('category'))
+    if error:
+        errors['category'] = error
+    brand_id, error = brands.resolve(text('brand'))
+    if error:
+        errors['brand'] = error
+
+    if errors:
+        return None, errors
+    return Product(
+        shop_id=shop_id, sku=sku, name=name, description=description, price=price,
+        stock=stock, status=status, category_id=category_id, brand_id=brand_id
+    ), None
+
+
+def _write_chunk(shop_id, products, report):
+    skus = [product.sku for product in products]
+    with transaction.atomic():
+        existing = {
+            sku: (pk, facets.facet_key(*key))
+            for sku, pk, *key in Product.objects.filter(shop_id=shop_id, sku__in=skus)
+            .values_list('sku', 'pk', *facets.KEY_FIELDS)
+        }
+        Product.objects.bulk_create(
+            products, update_conflicts=True,
+            unique_fields=['shop', 'sku'], update_fields=UPDATE_FIELDS
+        )
+        ids = list(Product.objects.filter(shop_id=shop_id, sku__in=skus).values_list('pk', flat=True))
+
+        deltas = Counter()
+        for product in products:
+            if product.sku in existing:
+                deltas[existing[product.sku][1]] -= 1
+            deltas[facets.product_key(product)] += 1
+        facets.apply_deltas(deltas)
+        search.index_products(ids)
+        # New products have nothing cached yet; list pages are invalidated either way
+        catalog_cache.invalidate_products([pk for pk, _ in existing.values()])
+
+    report.updated += len(existing)
+    report.created += len(products) - len(existing)
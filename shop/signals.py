@@ -0,0 +1,203 @@
+from django.contrib.auth.models import User
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
+from django.db.models.functions import Now
+from django.dispatch import receiver
+
+from . import facets, images, metrics, search
+from .authentication import user_cache
+from .cache import catalog_cache
+from .pricing import pricing_engine
+from .models import Brand, Category, Comment, Discount, Manager, Product, ProductImage, Shop, ShopOrder
+from .services import analytics
+from .services.counters import adjust_comment_count
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    """A product change invalidates its detail payload and every list page."""
+    catalog_cache.invalidate_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    search.index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Brand)
+def reindex_products_by_label(sender, instance, created, **kwargs):
+    """Category and brand names are indexed with each of their products."""
+    if not created:
+        column = 'category_id' if sender is Category else 'brand_id'
+        search.index_products_where(column, instance.pk)
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Brand)
+def remember_labelled_products(sender, instance, **kwargs):
+    # on_delete=SET_NULL clears the foreign keys with a queryset update, so
+    # collect the affected products before they lose the reference
+    instance._labelled_product_ids = list(instance.products.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Brand)
+def reindex_unlabelled_products(sender, instance, **kwargs):
+    search.index_products(getattr(instance, '_labelled_product_ids', []))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Brand)
+def invalidate_renamed_label(sender, instance, created, **kwargs):
+    """Label names show up in the facets of cached list pages."""
+    if not created:
+        catalog_cache.invalidate_products(list(instance.products.values_list('id', flat=True)))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Brand)
+def invalidate_unlabelled_products(sender, instance, **kwargs):
+    # The SET_NULL queryset update skipped the Product signals and updated_at
+    product_ids = getattr(instance, '_labelled_product_ids', [])
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(updated_at=Now())
+        catalog_cache.invalidate_products(product_ids)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product_image(sender, instance, **kwargs):
+    """Images are embedded in the product payload, so they also count as a product change."""
+    Product.objects.filter(pk=instance.product_id).update(updated_at=Now())
+    catalog_cache.invalidate_products([instance.product_id])
+
+
+@receiver(post_init, sender=ProductImage)
+def remember_original(sender, instance, **kwargs):
+    instance._original_name = instance.image.name if instance.pk is not None else None
+
+
+@receiver(pre_save, sender=ProductImage)
+def reset_variants(sender, instance, **kwargs):
+    # Variants of a replaced upload are stale; clients fall back to the original
+    if not instance._state.adding and instance.image.name != instance._original_name:
+        instance.content_hash = ''
+        instance.variants = {}
+
+
+@receiver(post_save, sender=ProductImage)
+def schedule_variants(sender, instance, **kwargs):
+    """New uploads are rendered into derivatives after commit, off the request path."""
+    if instance.image and instance.image.name != instance._original_name:
+        images.schedule(instance.pk)
+    instance._original_name = instance.image.name
+
+
+@receiver([post_save, post_delete], sender=Shop)
+def invalidate_shop(sender, instance, **kwargs):
+    """The shop name is embedded in the payload of each of its products."""
+    catalog_cache.invalidate_shop(instance.pk)
+
+
+@receiver(post_init, sender=Product)
+def remember_facet_key(sender, instance, **kwargs):
+    # Loaded products remember their facet cell so a save can move them out of it
+    if instance.pk is not None and not instance.get_deferred_fields() & set(facets.KEY_FIELDS):
+        instance._facet_key = facets.product_key(instance)
+
+
+@receiver(pre_save, sender=Product)
+def load_facet_key(sender, instance, **kwargs):
+    if instance._state.adding or hasattr(instance, '_facet_key'):
+        return
+    old = Product.objects.filter(pk=instance.pk).values_list(*facets.KEY_FIELDS).first()
+    instance._facet_key = facets.facet_key(*old) if old else None
+
+
+@receiver(post_save, sender=Product)
+def move_comments(sender, instance, created, **kwargs):
+    # Comments carry their product's shop (the moderation queue key)
+    old_key = None if created else instance._facet_key
+    if old_key is not None and old_key[0] != instance.shop_id:
+        Comment.objects.filter(product_id=instance.pk).update(shop_id=instance.shop_id)
+
+
+@receiver(post_save, sender=Product)
+def count_product_facets(sender, instance, created, **kwargs):
+    old_key = None if created else instance._facet_key
+    new_key = facets.product_key(instance)
+    facets.product_changed(old_key, new_key)
+    instance._facet_key = new_key
+
+
+@receiver(post_delete, sender=Product)
+def uncount_product_facets(sender, instance, **kwargs):
+    facets.product_changed(facets.product_key(instance), None)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Brand)
+def merge_facet_label(sender, instance, **kwargs):
+    facets.label_removed('category_id' if sender is Category else 'brand_id', instance.pk)
+
+
+@receiver(post_init, sender=Comment)
+def remember_approval(sender, instance, **kwargs):
+    instance._was_approved = instance.pk is not None and instance.is_approved
+
+
+@receiver(post_save, sender=Comment)
+def count_approval(sender, instance, **kwargs):
+    """Approving or un-approving a comment moves Product.comment_count by one."""
+    delta = int(instance.is_approved) - int(instance._was_approved)
+    if delta:
+        adjust_comment_count(instance.product_id, delta)
+    instance._was_approved = instance.is_approved
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_approval(sender, instance, **kwargs):
+    if instance._was_approved:
+        adjust_comment_count(instance.product_id, -1)
+
+
+@receiver(post_init, sender=ShopOrder)
+def remember_status(sender, instance, **kwargs):
+    instance._old_status = instance.status
+
+
+@receiver(post_save, sender=ShopOrder)
+def roll_up_status(sender, instance, created, **kwargs):
+    """Queues the vendor status rollup update for saved shop orders."""
+    if created:
+        analytics.record_shop_order(instance)
+    else:
+        analytics.record_status_change(instance, instance._old_status)
+    instance._old_status = instance.status
+
+
+@receiver([post_save, post_delete], sender=Discount)
+@receiver(m2m_changed, sender=Discount.products.through)
+@receiver(m2m_changed, sender=Discount.categories.through)
+def reload_discounts(sender, **kwargs):
+    """Every process reloads its discount windows (see shop/pricing.py)."""
+    if kwargs.get('action', 'post_').startswith('post_'):
+        pricing_engine.invalidate()
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    """Lets MetricsMiddleware count and time the queries of each request."""
+    metrics.instrument(connection)
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Manager)
+def forget_user(sender, instance, **kwargs):
+    """Drops the cached user behind JWT authentication (see shop/authentication.py)."""
+    user_cache.invalidate(instance.pk if sender is User else instance.user_id)
@@ -1,3 +1,1943 @@
-from django.test import TestCase
+import asyncio
+import csv
+import json
+import logging
+import os
+import pstats
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import CaptureQueriesContext
+from django.db import OperationalError, connection, connections
+from django.conf import settings
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import facets, images, metrics, routing, search
+from .benchmarks import endpoints
+from .models import (
+    Brand, Cart, CartItem, Category, Comment, Discount, IdempotencyKey, Manager, Order, OrderDetail,
+    OutboxEvent, Product, ProductImage, ProductSalesRollup, Shop, ShopOrder, ShopOrderStatusRollup
+)
+from .authentication import user_cache
+from .cache import LRUCache, catalog_cache
+from .filters import ProductFilter
+from .pricing import PricingEngine, pricing_engine
+from .serializers import ProductSerializer
+from .services import analytics, idempotency, moderation, outbox, product_import
+from .services.cart import CacheCartStore, CartBusyError, options as cart_options
+from .services.checkout import checkout_cart
+from .services.counters import reconcile_counters
+from .services.inventory import InsufficientStockError
+from .views import ProductViewSet
+
+
+def make_shop(name):
+    return Shop.objects.create(name=name, slug=name.lower().replace(' ', '-'))
+
+
+def make_product(shop, name, price='10.00', stock=100):
+    return Product.objects.create(
+        shop=shop, name=name, description=f"{name} description",
+        price=Decimal(price), stock=stock
+    )
+
+
+class CheckoutTests(APITestCase):
+    # Statements issued by a checkout, independent of the number of cart lines
+    CHECKOUT_QUERY_BUDGET = 14
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        self.shops = [make_shop(f"Shop {i}") for i in range(3)]
+        # Discounts are loaded once per process; keep that out of the counts
+        pricing_engine.index()
+
+    def fill_cart(self, lines):
+        products = Product.objects.bulk_create([
+            Product(
+                shop=self.shops[i % len(self.shops)], name=f"Product {i}",
+                description='', price=Decimal('2.50'), stock=100
+            )
+            for i in range(lines)
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=product, quantity=2)
+            for product in products
+        ])
+        return products
+
+    def checkout_query_count(self, lines):
+        self.fill_cart(lines)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post('/api/cart/checkout/')
+        self.assertEqual(response.status_code, 201)
+        return len(ctx.captured_queries)
+
+    def test_checkout_splits_order_by_shop(self):
+        self.fill_cart(5)
+        response = self.client.post('/api/cart/checkout/')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['shop_orders_count'], 3)
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertEqual(order.total_amount, Decimal('25.00'))
+        self.assertEqual(OrderDetail.objects.filter(order=order).count(), 5)
+        self.assertEqual(
+            sorted(ShopOrder.objects.filter(main_order=order).values_list('shop_total', flat=True)),
+            [Decimal('5.00'), Decimal('10.00'), Decimal('10.00')]
+        )
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_checkout_empty_cart(self):
+        response = self.client.post('/api/cart/checkout/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], "Cart is empty")
+
+    def test_checkout_query_count_is_constant(self):
+        small = self.checkout_query_count(1)
+        large = self.checkout_query_count(60)
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, self.CHECKOUT_QUERY_BUDGET)
+
+
+class StockReservationTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass')
+        self.client.force_authenticate(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+        shop = make_shop("Stock Shop")
+        self.plenty = make_product(shop, "Plenty", stock=10)
+        self.scarce = make_product(shop, "Scarce", stock=1)
+
+    def test_checkout_decrements_stock(self):
+        CartItem.objects.create(cart=self.cart, product=self.plenty, quantity=4)
+        response = self.client.post('/api/cart/checkout/')
+
+        self.assertEqual(response.status_code, 201)
+        self.plenty.refresh_from_db()
+        self.assertEqual(self.plenty.stock, 6)
+
+    def test_shortfall_report_rolls_back_checkout(self):
+        CartItem.objects.create(cart=self.cart, product=self.plenty, quantity=4)
+        CartItem.objects.create(cart=self.cart, product=self.scarce, quantity=3)
+        response = self.client.post('/api/cart/checkout/')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['shortfalls'], [{
+            'product_id': self.scarce.id, 'product_name': "Scarce",
+            'requested': 3, 'available': 1,
+        }])
+        self.plenty.refresh_from_db()
+        self.assertEqual(self.plenty.stock, 10)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 2)
+
+
+class StockContentionTests(TransactionTestCase):
+    """Concurrent checkouts on one hot product must never oversell it."""
+    BUYERS = 12
+    STOCK = 7
+
+    def setUp(self):
+        shop = make_shop("Hot Shop")
+        self.product = make_product(shop, "Hot item", stock=self.STOCK)
+        self.carts = []
+        for i in range(self.BUYERS):
+            cart = Cart.objects.create(user=User.objects.create_user(username=f"buyer{i}"))
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.carts.append(cart)
+
+    def checkout_with_retry(self, cart, outcomes):
+        try:
+            while True:
+                try:
+                    checkout_cart(cart)
+                    outcomes.append('ok')
+                    return
+                except InsufficientStockError:
+                    outcomes.append('short')
+                    return
+                except OperationalError:
+                    # SQLite reports writer contention as "locked"; back off and retry
+                    time.sleep(random.uniform(0, 0.005))
+        finally:
+            connection.close()
+
+    def test_concurrent_checkouts_do_not_oversell(self):
+        outcomes = []
+        threads = [
+            threading.Thread(target=self.checkout_with_retry, args=(cart, outcomes))
+            for cart in self.carts
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        self.assertEqual(outcomes.count('ok'), self.STOCK)
+        self.assertEqual(outcomes.count('short'), self.BUYERS - self.STOCK)
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(Order.objects.count(), self.STOCK)
+
+
+@override_settings(CATALOG_CACHE={'ENABLED': False})
+class QueryScalingTests(APITestCase):
+    """
+    Read endpoints must issue the same number of queries for 10 or 100 rows.
+    Paginated ones are asked for 100-row pages, so both scales render every row.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='pass')
+        self.manager_user = User.objects.create_user(username='manager', password='pass')
+        self.shops = [make_shop(f"Shop {i}") for i in range(3)]
+        Manager.objects.create(user=self.manager_user, shop=self.shops[0])
+        self.cart = Cart.objects.create(user=self.user)
+        self.seeded = 0
+        pricing_engine.index()  # loaded once per process, see CheckoutTests
+
+    def seed(self, rows):
+        """Adds rows products, cart lines and single-line orders for every endpoint."""
+        products = Product.objects.bulk_create([
+            Product(
+                shop=self.shops[0], name=f"Product {self.seeded + i}",
+                description='', price=Decimal('1.00'), stock=10
+            )
+            for i in range(rows)
+        ])
+        self.seeded += rows
+        ProductImage.objects.bulk_create([
+            ProductImage(product=product, image='products/p.jpg', is_feature=True)
+            for product in products
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=product, quantity=1) for product in products
+        ])
+        orders = Order.objects.bulk_create([
+            Order(user=self.user, total_amount=Decimal('1.00')) for _ in products
+        ])
+        shop_orders = ShopOrder.objects.bulk_create([
+            ShopOrder(main_order=order, shop=self.shops[0], shop_total=Decimal('1.00'))
+            for order in orders
+        ])
+        OrderDetail.objects.bulk_create([
+            OrderDetail(
+                order=order, shop_order=shop_order, product=product,
+                quantity=1, price=product.price
+            )
+            for order, shop_order, product in zip(orders, shop_orders, products)
+        ])
+
+    def count_queries(self, url, user):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        if 'results' in response.data:
+            self.assertEqual(len(response.data['results']), self.seeded)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, url, user=None):
+        user = user or self.user
+        self.seed(10)
+        small = self.count_queries(url, user)
+        self.seed(90)
+        large = self.count_queries(url, user)
+        self.assertEqual(small, large, f"{url} issues {small} queries at 10 rows, {large} at 100")
+
+    def test_product_list(self):
+        self.assertConstantQueries('/api/products/?page_size=100')
+
+    def test_cart(self):
+        self.assertConstantQueries('/api/cart/')
+
+    def test_order_history(self):
+        self.assertConstantQueries('/api/orders/?page_size=100')
+
+    def test_vendor_orders(self):
+        self.assertConstantQueries('/api/vendor-orders/?page_size=100', self.manager_user)
+
+
+class CursorPaginationTests(APITestCase):
+
+    def setUp(self):
+        shop = make_shop("Paged Shop")
+        products = [make_product(shop, f"Product {i}") for i in range(45)]
+        # Force timestamp ties so the id tie-breaker is exercised
+        Product.objects.filter(pk__in=[p.pk for p in products[10:20]]).update(
+            created_at=products[10].created_at
+        )
+        self.expected = list(
+            Product.objects.order_by('-created_at', 'id').values_list('id', flat=True)
+        )
+
+    def test_walks_every_product_once(self):
+        seen, url = [], '/api/products/?page_size=20'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            seen += [row['id'] for row in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(seen, self.expected)
+
+    def test_previous_link_returns_prior_page(self):
+        first = self.client.get('/api/products/?page_size=20').data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(
+            [row['id'] for row in back['results']],
+            [row['id'] for row in first['results']]
+        )
+        self.assertIsNone(back['previous'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/products/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 404)
+
+
+class CatalogCacheTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        catalog_cache.clear_local()
+        catalog_cache.reset_stats()
+        self.shop = make_shop("Cached Shop")
+        self.product = make_product(self.shop, "Cached", stock=5)
+        self.url = f'/api/products/{self.product.id}/'
+
+    def test_detail_is_served_from_cache(self):
+        self.client.get(self.url)
+        # Only the conditional GET validator (one indexed aggregate) reaches the database
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(self.url)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertIn('MAX(', ctx.captured_queries[0]['sql'])
+        self.assertEqual(response.data['name'], "Cached")
+        self.assertEqual(catalog_cache.stats()['local_hits'], 1)
+        self.assertEqual(catalog_cache.stats()['misses'], 1)
+
+    def test_padded_ids_share_the_cache_entry(self):
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(f'/api/products/0{self.product.id}/').data['name'], "Cached")
+        self.product.name = "Renamed"
+        self.product.save()
+        self.assertEqual(self.client.get(f'/api/products/0{self.product.id}/').data['name'], "Renamed")
+        self.assertEqual(self.client.get('/api/products/abc/').status_code, 404)
+
+    def test_product_save_invalidates_detail_and_list(self):
+        self.client.get(self.url)
+        self.client.get('/api/products/')
+        self.product.name = "Renamed"
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).data['name'], "Renamed")
+        self.assertEqual(self.client.get('/api/products/').data['results'][0]['name'], "Renamed")
+
+    def test_shop_and_image_changes_invalidate_detail(self):
+        self.client.get(self.url)
+        self.shop.name = "New Shop Name"
+        self.shop.save()
+        self.assertEqual(self.client.get(self.url).data['shop_name'], "New Shop Name")
+        ProductImage.objects.create(product=self.product, image='products/p.jpg')
+        self.assertEqual(len(self.client.get(self.url).data['images']), 1)
+
+    def test_checkout_invalidates_stock(self):
+        self.client.get(self.url)
+        user = User.objects.create_user(username='buyer')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        checkout_cart(cart)
+        self.assertEqual(self.client.get(self.url).data['stock'], 3)
+
+    def test_label_changes_invalidate_products(self):
+        label = Category.objects.create(name="Kitchen")
+        self.product.category = label
+        self.product.save()
+        self.client.get(self.url)
+        self.assertEqual(self.client.get('/api/products/').data['facets']['category'][0]['label'], "Kitchen")
+
+        label.name = "Cookware"
+        label.save()
+        self.assertEqual(self.client.get('/api/products/').data['facets']['category'][0]['label'], "Cookware")
+        label.delete()
+        self.assertIsNone(self.client.get(self.url).data['category'])
+        self.assertEqual(self.client.get('/api/products/').data['facets']['category'][0]['value'], None)
+
+    def test_lru_tier_is_bounded(self):
+        lru = LRUCache(max_entries=2)
+        for key in 'abc':
+            lru.set(key, key)
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.evictions, 1)
+        self.assertEqual(len(lru), 2)
+
+    def test_lru_entries_expire(self):
+        # Bounds how long another process's writes go unseen on a per-process backend
+        lru = LRUCache(max_entries=2, ttl=60)
+        with mock.patch('shop.cache.time.monotonic', return_value=1000):
+            lru.set('a', 1)
+        with mock.patch('shop.cache.time.monotonic', return_value=1059):
+            self.assertEqual(lru.get('a'), 1)
+        with mock.patch('shop.cache.time.monotonic', return_value=1060):
+            self.assertIsNone(lru.get('a'))
+        self.assertEqual(len(lru), 0)
+        self.assertEqual(catalog_cache.local.ttl, catalog_cache.options['TIMEOUT'])
+
+
+class ProductSearchTests(APITestCase):
+
+    def setUp(self):
+        shop = make_shop("Search Shop")
+        self.shoes = Category.objects.create(name="Footwear")
+        self.acme = Brand.objects.create(name="Acme")
+        self.runner = Product.objects.create(
+            shop=shop, category=self.shoes, brand=self.acme, name="Trail runner",
+            description="Light shoe for running", price=Decimal('80.00')
+        )
+        self.boot = Product.objects.create(
+            shop=shop, category=self.shoes, name="Winter boot",
+            description="Warm boot, not for running", price=Decimal('120.00')
+        )
+        self.kettle = Product.objects.create(
+            shop=shop, name="Kettle", description="Boils water", price=Decimal('30.00')
+        )
+
+    def search(self, q, **params):
+        response = self.client.get('/api/products/search/', {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def ids(self, q, **params):
+        return [row['id'] for row in self.search(q, **params).data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.ids("running"), [self.runner.id, self.boot.id])
+        self.assertEqual(self.ids("runner"), [self.runner.id])
+
+    def test_category_and_brand_names_are_indexed(self):
+        self.assertEqual(set(self.ids("footwear")), {self.runner.id, self.boot.id})
+        self.assertEqual(self.ids("acme"), [self.runner.id])
+
+    def test_prefix_and_operator_input(self):
+        self.assertEqual(self.ids("ket"), [self.kettle.id])
+        self.assertEqual(self.ids('"kettle" OR NOT ('), [])
+        self.assertEqual(self.ids(""), [])
+
+    def test_index_follows_writes(self):
+        self.kettle.name = "Electric jug"
+        self.kettle.save()
+        self.assertEqual(self.ids("jug"), [self.kettle.id])
+        self.assertEqual(self.ids("kettle"), [])
+
+        self.acme.name = "Globex"
+        self.acme.save()
+        self.assertEqual(self.ids("globex"), [self.runner.id])
+
+        self.shoes.delete()
+        self.assertEqual(self.ids("footwear"), [])
+
+        self.boot.delete()
+        self.assertEqual(self.ids("winter"), [])
+
+    def test_pagination(self):
+        first = self.search("footwear", page_size=1).data
+        self.assertEqual(len(first['results']), 1)
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        self.assertIsNone(second['next'])
+        self.assertNotEqual(first['results'][0]['id'], second['results'][0]['id'])
+
+    def test_ranking_bound_is_reported(self):
+        # Every match is ranked by default
+        self.assertEqual((self.ids("running"), self.search("running").data['truncated']), (
+            [self.runner.id, self.boot.id], False
+        ))
+        with override_settings(SEARCH={'MAX_RANKED_CANDIDATES': 1}):
+            # Only the most recent match is ranked
+            data = self.search("running").data
+            self.assertEqual(([row['id'] for row in data['results']], data['truncated']), ([self.boot.id], True))
+            self.assertFalse(self.search("kettle").data['truncated'])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.FTS_TABLE}")
+        self.assertEqual(self.ids("kettle"), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.ids("kettle"), [self.kettle.id])
+
+
+class FacetTests(APITestCase):
+
+    def setUp(self):
+        self.shops = [make_shop("Facet A"), make_shop("Facet B")]
+        self.shoes = Category.objects.create(name="Shoes")
+        self.hats = Category.objects.create(name="Hats")
+        self.acme = Brand.objects.create(name="Acme")
+        specs = [
+            (0, self.shoes, self.acme, '10.00', 5),
+            (0, self.shoes, None, '30.00', 0),
+            (1, self.hats, self.acme, '75.00', 2),
+            (1, None, None, '600.00', 1),
+        ]
+        self.products = [
+            Product.objects.create(
+                shop=self.shops[shop], category=category, brand=brand, name=f"Item {i}",
+                description='', price=Decimal(price), stock=stock
+            )
+            for i, (shop, category, brand, price, stock) in enumerate(specs)
+        ]
+
+    def assertSummaryMatchesLive(self, **params):
+        product_filter = ProductFilter(params)
+        queryset = product_filter.filter_queryset(Product.objects.all())
+        self.assertEqual(
+            facets.summary_counts(product_filter.facet_filters), facets.live_counts(queryset)
+        )
+
+    def test_filters_and_facet_block(self):
+        response = self.client.get('/api/products/', {'category': self.shoes.id, 'in_stock': 'true'})
+        self.assertEqual([row['id'] for row in response.data['results']], [self.products[0].id])
+        block = response.data['facets']
+        self.assertEqual(block['category'], [{'value': self.shoes.id, 'label': "Shoes", 'count': 1}])
+        self.assertEqual(block['price_band'], [{'value': '0-25', 'count': 1}])
+
+        response = self.client.get('/api/products/', {'price_band': '25-50,500+'})
+        self.assertEqual(
+            {row['id'] for row in response.data['results']},
+            {self.products[1].id, self.products[3].id}
+        )
+
+    def test_summary_matches_live_counts(self):
+        self.assertSummaryMatchesLive()
+        self.assertSummaryMatchesLive(shop=str(self.shops[1].id))
+        self.assertSummaryMatchesLive(category=f"{self.shoes.id},none", in_stock='true')
+        self.assertSummaryMatchesLive(brand='none', price_band='500+,25-50')
+
+    def test_summary_follows_writes(self):
+        product = self.products[0]
+        product.price = Decimal('120.00')
+        product.category = self.hats
+        product.save()
+        self.products[1].delete()
+        self.acme.delete()
+        self.assertSummaryMatchesLive()
+
+        user = User.objects.create_user(username='buyer')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.products[2], quantity=2)
+        checkout_cart(cart)
+        # Checkout only queues the depleted product's move to the out-of-stock cell
+        self.assertTrue(OutboxEvent.objects.filter(topic=facets.STOCK_DEPLETED).exists())
+        outbox.process_pending(concurrency=1)
+        self.assertSummaryMatchesLive(in_stock='false')
+
+        expected = facets.summary_counts({})
+        facets.rebuild_counts()
+        self.assertEqual(facets.summary_counts({}), expected)
+
+    def test_unfiltered_facets_do_not_scan_products(self):
+        with CaptureQueriesContext(connection) as ctx:
+            ProductFilter({}).facet_counts(Product.objects.all())
+        self.assertEqual(len(ctx.captured_queries), 5)
+        self.assertFalse(any('"shop_product"' in q['sql'] for q in ctx.captured_queries))
+
+    def test_price_range_uses_live_counts(self):
+        response = self.client.get('/api/products/', {'min_price': '20', 'max_price': '100'})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(sum(row['count'] for row in response.data['facets']['shop']), 2)
+
+    def test_invalid_filter(self):
+        response = self.client.get('/api/products/', {'price_band': 'cheap', 'category': 'x'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data), {'price_band', 'category'})
+
+    def test_non_finite_prices_are_rejected(self):
+        for value in ('NaN', 'sNaN', 'Infinity', '-inf'):
+            response = self.client.get('/api/products/', {'min_price': value, 'max_price': '100'})
+            self.assertEqual(response.status_code, 400, value)
+            self.assertEqual(response.data, {'min_price': "Expected a number."})
+
+
+class ProductCounterTests(APITestCase):
+
+    def setUp(self):
+        shop = make_shop("Counter Shop")
+        self.user = User.objects.create_user(username='buyer')
+        self.popular = make_product(shop, "Popular")
+        self.quiet = make_product(shop, "Quiet")
+
+    def counters(self, product):
+        product.refresh_from_db()
+        return product.comment_count, product.units_sold
+
+    def test_comment_approval_moves_count(self):
+        comment = Comment.objects.create(product=self.quiet, user=self.user, comment="Nice")
+        self.assertEqual(self.counters(self.quiet), (0, 0))
+        comment.is_approved = True
+        comment.save()
+        comment.save()
+        self.assertEqual(self.counters(self.quiet), (1, 0))
+        Comment.objects.create(product=self.quiet, user=self.user, comment="Ok", is_approved=True)
+        self.assertEqual(self.counters(self.quiet), (2, 0))
+        comment.delete()
+        self.assertEqual(self.counters(self.quiet), (1, 0))
+
+    def test_checkout_counts_units_sold(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.popular, quantity=3)
+        checkout_cart(cart)
+        self.assertEqual(self.counters(self.popular), (0, 3))
+
+    def test_sorts_by_counters(self):
+        Product.objects.filter(pk=self.quiet.pk).update(comment_count=4)
+        Product.objects.filter(pk=self.popular.pk).update(units_sold=9)
+        cache.clear()
+        best = self.client.get('/api/products/', {'sort': 'best_selling'}).data['results']
+        reviewed = self.client.get('/api/products/', {'sort': 'most_reviewed'}).data['results']
+        self.assertEqual(best[0]['id'], self.popular.id)
+        self.assertEqual(reviewed[0]['id'], self.quiet.id)
+        self.assertEqual(self.client.get('/api/products/', {'sort': 'cheapest'}).status_code, 400)
+
+    def test_reconcile_fixes_drift(self):
+        Comment.objects.create(product=self.quiet, user=self.user, comment="Ok", is_approved=True)
+        order = Order.objects.create(user=self.user)
+        OrderDetail.objects.create(order=order, product=self.popular, quantity=5, price=Decimal('1'))
+        Product.objects.filter(pk=self.quiet.pk).update(comment_count=7)
+
+        checked, fixed = reconcile_counters(chunk_size=1)
+        self.assertEqual((checked, fixed), (2, 2))
+        self.assertEqual(self.counters(self.quiet), (1, 0))
+        self.assertEqual(self.counters(self.popular), (0, 5))
+
+
+class SalesAnalyticsTests(APITestCase):
+
+    def setUp(self):
+        self.shop = make_shop("Analytics Shop")
+        other = make_shop("Other Shop")
+        self.manager = User.objects.create_user(username='manager')
+        Manager.objects.create(user=self.manager, shop=self.shop)
+        self.buyer = User.objects.create_user(username='buyer')
+        self.mug = make_product(self.shop, "Mug", price='4.00')
+        self.lamp = make_product(self.shop, "Lamp", price='25.00')
+        self.other = make_product(other, "Other", price='1.00')
+
+    def checkout(self, *lines):
+        cart, _ = Cart.objects.get_or_create(user=self.buyer)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=quantity) for product, quantity in lines
+        ])
+        result = checkout_cart(cart)
+        self.drain()
+        return result
+
+    def drain(self):
+        # Rollups are applied by the outbox worker; run it inline in the test transaction
+        return outbox.process_pending(concurrency=1)
+
+    def snapshot(self):
+        sales = ProductSalesRollup.objects.order_by('shop', 'product', 'date').values_list(
+            'shop', 'product', 'date', 'units', 'revenue', 'order_lines'
+        )
+        statuses = ShopOrderStatusRollup.objects.filter(orders__gt=0).order_by(
+            'shop', 'date', 'status'
+        ).values_list('shop', 'date', 'status', 'orders', 'revenue')
+        return list(sales), list(statuses)
+
+    def test_checkout_updates_rollups(self):
+        self.checkout((self.mug, 2), (self.lamp, 1), (self.other, 5))
+        self.checkout((self.mug, 1))
+        mug = ProductSalesRollup.objects.get(product=self.mug)
+        self.assertEqual((mug.units, mug.revenue, mug.order_lines), (3, Decimal('12.00'), 2))
+        pending = ShopOrderStatusRollup.objects.get(shop=self.shop, status='pending')
+        self.assertEqual((pending.orders, pending.revenue), (2, Decimal('37.00')))
+
+    def test_status_change_moves_order(self):
+        result = self.checkout((self.lamp, 2))
+        shop_order = result.shop_orders[0]
+        shop_order.status = 'shipped'
+        shop_order.save()
+        shop_order.save()
+        self.assertEqual(self.drain(), 1)
+        rows = dict(
+            ShopOrderStatusRollup.objects.filter(shop=self.shop).values_list('status', 'orders')
+        )
+        self.assertEqual(rows, {'pending': 0, 'shipped': 1})
+
+    def test_backfill_matches_incremental_rollups(self):
+        self.checkout((self.mug, 2), (self.other, 1))
+        result = self.checkout((self.lamp, 1), (self.mug, 3))
+        shop_order = result.shop_orders[0]
+        shop_order.status = 'delivered'
+        shop_order.save()
+        self.drain()
+        incremental = self.snapshot()
+
+        self.assertEqual(analytics.backfill(chunk_size=1), 3)
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_backfill_keeps_up_with_concurrent_orders(self):
+        first = self.checkout((self.mug, 2), (self.other, 1)).shop_orders[0]
+        self.checkout((self.lamp, 1))
+
+        incremental = []
+
+        def meanwhile(processed):
+            # Chunks are plain reads: checkouts and status changes go on
+            if processed == 1:
+                self.checkout((self.mug, 1))
+                first.refresh_from_db()
+                first.status = 'shipped'
+                first.save()
+                self.drain()
+                incremental.append(self.snapshot())
+
+        self.assertEqual(analytics.backfill(chunk_size=1, progress=meanwhile), 4)
+        self.assertEqual(self.snapshot(), incremental[0])
+        self.assertFalse(OutboxEvent.objects.exists())
+        mug = ProductSalesRollup.objects.get(product=self.mug)
+        self.assertEqual((mug.units, mug.order_lines), (3, 2))
+
+    def test_dashboard_endpoint(self):
+        self.checkout((self.mug, 2), (self.lamp, 1), (self.other, 5))
+        self.client.force_authenticate(self.manager)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/api/vendor-analytics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([q for q in ctx.captured_queries if 'shop_orderdetail' in q['sql']])
+        self.assertEqual(
+            [(row['product_name'], row['units']) for row in response.data['units_per_product']],
+            [('Mug', 2), ('Lamp', 1)]
+        )
+        self.assertEqual(response.data['revenue_per_day'][0]['revenue'], Decimal('33.00'))
+        self.assertEqual(response.data['status_breakdown'][0]['orders'], 1)
+
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/vendor-analytics/').status_code, 403)
+        self.client.force_authenticate(self.manager)
+        self.assertEqual(self.client.get('/api/vendor-analytics/', {'from': 'x'}).status_code, 400)
+
+
+class OrderExportTests(APITestCase):
+
+    def setUp(self):
+        self.shop = make_shop("Export Shop")
+        self.manager = User.objects.create_user(username='manager')
+        Manager.objects.create(user=self.manager, shop=self.shop)
+        self.buyer = User.objects.create_user(username='buyer')
+        mug = make_product(self.shop, "Mug, large", price='4.00')
+        other = make_product(make_shop("Other Shop"), "Other")
+        cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=cart, product=mug, quantity=2)
+        CartItem.objects.create(cart=cart, product=other, quantity=1)
+        self.shop_order = checkout_cart(cart).shop_orders[0]
+        self.client.force_authenticate(self.manager)
+
+    def export(self, **params):
+        response = self.client.get('/api/vendor-orders/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.reader(StringIO(self.export())))
+        self.assertEqual(rows[0][:3], ['shop_order_id', 'order_id', 'created_at'])
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][7:], ['Mug, large', '2', '4.00'])
+
+    def test_ndjson(self):
+        rows = [json.loads(line) for line in self.export(type='ndjson').splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['shop_order_id'], self.shop_order.id)
+        self.assertEqual((rows[0]['quantity'], rows[0]['price']), (2, '4.00'))
+
+    def test_rejects_non_managers_and_unknown_types(self):
+        self.assertEqual(self.client.get('/api/vendor-orders/export/', {'type': 'xml'}).status_code, 400)
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/vendor-orders/export/').status_code, 403)
+
+
+class ProductImportTests(APITestCase):
+
+    CSV = (
+        "sku,name,description,price,stock,category,brand\n"
+        "A-1,Trail shoe,Grippy,49.90,5,shoes,Acme\n"
+        "A-2,Sun hat,Wide brim,12.00,0,Hats,\n"
+        ",No sku,Missing,1.00,1,,\n"
+        "A-3,Bad row,Broken,-4,x,Socks,Nobody\n"
+    )
+
+    def setUp(self):
+        self.shop = make_shop("Import Shop")
+        self.manager = User.objects.create_user(username='manager')
+        Manager.objects.create(user=self.manager, shop=self.shop)
+        self.shoes = Category.objects.create(name="Shoes")
+        Category.objects.create(name="Hats")
+        self.acme = Brand.objects.create(name="Acme")
+        self.client.force_authenticate(self.manager)
+
+    def upload(self, content, name='catalog.csv', **params):
+        upload = SimpleUploadedFile(name, content if isinstance(content, bytes) else content.encode())
+        query = '?' + '&'.join(f'{key}={value}' for key, value in params.items()) if params else ''
+        return self.client.post(f'/api/products/import/{query}', {'file': upload}, format='multipart')
+
+    def test_csv_import_reports_row_errors(self):
+        response = self.upload(self.CSV)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['created'], response.data['updated'], response.data['failed']), (2, 0, 2)
+        )
+        self.assertEqual(response.data['errors'][0], {'row': 3, 'errors': {'sku': "This field is required."}})
+        self.assertEqual(
+            set(response.data['errors'][1]['errors']), {'price', 'stock', 'category', 'brand'}
+        )
+        shoe = Product.objects.get(shop=self.shop, sku='A-1')
+        self.assertEqual((shoe.category, shoe.brand, shoe.price), (self.shoes, self.acme, Decimal('49.90')))
+
+    def test_reimport_updates_in_place_and_refreshes_derived_data(self):
+        self.upload(self.CSV)
+        self.assertEqual(self.client.get('/api/products/').data['facets']['in_stock'], [
+            {'value': True, 'count': 1}, {'value': False, 'count': 1}
+        ])
+        rows = '\n'.join([
+            '{"sku": "A-1", "name": "Trail runner", "description": "Grippy", "price": "59.90", "stock": 0}',
+            '{"sku": "A-4", "name": "Rain jacket", "description": "Dry", "price": "80", "stock": 3}',
+            'not json',
+        ])
+        response = self.upload(rows, name='catalog.txt', type='ndjson')
+        self.assertEqual(
+            (response.data['created'], response.data['updated'], response.data['failed']), (1, 1, 1)
+        )
+        self.assertEqual(Product.objects.filter(shop=self.shop).count(), 3)
+        runner = Product.objects.get(sku='A-1')
+        self.assertEqual((runner.name, runner.category), ("Trail runner", None))
+
+        listing = self.client.get('/api/products/').data
+        self.assertEqual(listing['facets']['in_stock'], [
+            {'value': True, 'count': 1}, {'value': False, 'count': 2}
+        ])
+        self.assertIn("Trail runner", [row['name'] for row in listing['results']])
+        self.assertEqual(search.search_product_ids("runner", 10)[0], [runner.id])
+        self.assertEqual(facets.summary_counts({}), facets.live_counts(Product.objects.all()))
+
+    def test_rejects_non_managers_and_unknown_types(self):
+        self.assertEqual(self.upload(self.CSV, name='catalog.xlsx').status_code, 400)
+        self.client.force_authenticate(User.objects.create_user(username='buyer'))
+        self.assertEqual(self.upload(self.CSV).status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.upload(self.CSV).status_code, 401)
+        self.assertFalse(Product.objects.exists())
+
+    def test_unreadable_rows_stop_the_import_with_400(self):
+        header = b"sku,name,description,price,stock,category,brand\n"
+        rows = b''.join(b"B-%d,Item %d,Plain,1.00,1,,\n" % (n, n) for n in range(4))
+        latin1 = header + rows + b"B-9,Caf\xe9,Latin-1,1.00,1,,\n"
+        response = self.upload(latin1)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((response.data['row'], response.data['created']), (5, 0))
+        self.assertEqual(
+            response.data['error'], "Row 5 could not be read (not valid UTF-8); the import stopped there. "
+            "Nothing was saved."
+        )
+
+        # Chunks written before the bad row stay committed, and the error says so
+        lines = product_import.decode_lines(BytesIO(latin1))
+        with self.assertRaises(product_import.UnreadableFileError) as raised:
+            product_import.import_products(self.shop.id, product_import.read_rows(lines, 'csv'), chunk_size=2)
+        self.assertIn("4 products from earlier rows were saved.", str(raised.exception))
+        self.assertEqual(Product.objects.filter(shop=self.shop).count(), 4)
+
+        huge = self.CSV + 'A-9,"' + 'x' * (csv.field_size_limit() + 1) + '",Long,1.00,1,,\n'
+        response = self.upload(huge)
+        self.assertEqual((response.status_code, response.data['row']), (400, 5))
+        self.assertIn("malformed CSV", response.data['error'])
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as fh:
+            fh.write(self.CSV)
+        self.addCleanup(os.remove, fh.name)
+        out, err = StringIO(), StringIO()
+        call_command('import_products', fh.name, shop=self.shop.slug, chunk_size=1, stdout=out, stderr=err)
+        self.assertIn("Created 2, updated 0, failed 2.", out.getvalue())
+        self.assertIn("row 3: sku: This field is required.", err.getvalue())
+
+
+def make_png(color, size=(1200, 900)):
+    buffer = BytesIO()
+    Image.new('RGBA', size, color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_PIPELINE={'ASYNC': False, 'WORKERS': 0})
+class ProductImageVariantTests(APITestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.enterContext(override_settings(MEDIA_ROOT=media))
+        shop = make_shop("Image Shop")
+        self.mug = make_product(shop, "Mug")
+        self.cup = make_product(shop, "Cup")
+
+    def upload(self, product, data, name='photo.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=product, image=SimpleUploadedFile(name, data))
+        image.refresh_from_db()
+        return image
+
+    def test_upload_renders_variants(self):
+        image = self.upload(self.mug, make_png((255, 0, 0, 128)))
+        self.assertEqual(set(image.variants), set(images.VARIANTS))
+        with default_storage.open(image.variants['thumb_webp']) as fh, Image.open(fh) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (200, 150)))
+        with default_storage.open(image.variants['medium_jpeg']) as fh, Image.open(fh) as medium:
+            self.assertEqual((medium.format, medium.size), ('JPEG', (800, 600)))
+
+        data = self.client.get(f'/api/products/{self.mug.id}/').data
+        self.assertTrue(data['images'][0]['variants']['thumb_webp'].endswith('/thumb_webp.webp'))
+
+    def test_identical_uploads_share_variants(self):
+        data = make_png((0, 0, 255, 255))
+        first = self.upload(self.mug, data, 'a.png')
+        second = self.upload(self.cup, data, 'b.png')
+        self.assertEqual(first.content_hash, second.content_hash)
+        self.assertEqual(first.variants, second.variants)
+
+        replaced = self.upload(self.cup, make_png((0, 255, 0, 255)))
+        self.assertNotEqual(replaced.variants, second.variants)
+
+    def test_backfill_command_uses_process_pool(self):
+        data = make_png((10, 20, 30, 255))
+        with self.captureOnCommitCallbacks(execute=False):
+            for product in (self.mug, self.cup, self.mug):
+                ProductImage.objects.create(product=product, image=SimpleUploadedFile('x.png', data))
+        ProductImage.objects.create(product=self.cup, image=SimpleUploadedFile('y.png', make_png((1, 2, 3, 255))))
+        ProductImage.objects.filter(pk=ProductImage.objects.last().pk).update(content_hash='', variants={})
+
+        with mock.patch.object(images, 'ProcessPoolExecutor', wraps=images.ProcessPoolExecutor) as pool:
+            out = StringIO()
+            call_command('process_product_images', workers=2, stdout=out)
+        self.assertEqual(pool.call_args.kwargs['mp_context'].get_start_method(), 'spawn')
+        self.assertIn("Processed 4 images; rendered 2 distinct originals.", out.getvalue())
+        self.assertFalse(ProductImage.objects.filter(content_hash='').exists())
+
+    def test_corrupt_original_does_not_stop_the_backfill(self):
+        good = make_png((10, 20, 30, 255))
+        with self.captureOnCommitCallbacks(execute=False):
+            first = ProductImage.objects.create(product=self.mug, image=SimpleUploadedFile('a.png', good))
+            broken = ProductImage.objects.create(product=self.mug, image=SimpleUploadedFile('b.png', good[:200]))
+            last = ProductImage.objects.create(
+                product=self.cup, image=SimpleUploadedFile('c.png', make_png((1, 2, 3, 255)))
+            )
+
+        out = StringIO()
+        with self.assertLogs('shop.images', 'WARNING'):
+            call_command('process_product_images', workers=0, stdout=out)
+        self.assertIn("Processed 2 images; rendered 2 distinct originals.", out.getvalue())
+        self.assertIn("1 images could not be decoded", out.getvalue())
+        for image in (first, broken, last):
+            image.refresh_from_db()
+        self.assertEqual(set(first.variants), set(images.VARIANTS))
+        self.assertEqual(set(last.variants), set(images.VARIANTS))
+        self.assertEqual((len(broken.content_hash), broken.variants), (64, {}))
+
+        # Marked rows leave the backlog
+        out = StringIO()
+        call_command('process_product_images', workers=0, stdout=out)
+        self.assertIn("Processed 0 images", out.getvalue())
+
+
+class ProductListRepresentationTests(APITestCase):
+
+    def setUp(self):
+        shop = make_shop("Card Shop")
+        self.lamp = make_product(shop, "Lamp", price='12.50')
+        self.bare = make_product(shop, "Bare")
+        ProductImage.objects.create(product=self.lamp, image='products/side.jpg')
+        ProductImage.objects.create(
+            product=self.lamp, image='products/front.jpg', is_feature=True,
+            variants={'thumb_webp': 'products/derived/ab/front/thumb_webp.webp'}
+        )
+
+    def test_list_renders_compact_cards(self):
+        results = {row['id']: row for row in self.client.get('/api/products/').data['results']}
+        lamp = results[self.lamp.id]
+        self.assertEqual(
+            set(lamp), {
+                'id', 'name', 'price', 'sale_price', 'discount_percentage', 'stock',
+                'shop', 'shop_name', 'image', 'thumbnail'
+            }
+        )
+        self.assertEqual((lamp['price'], lamp['shop_name']), ('12.50', "Card Shop"))
+        self.assertTrue(lamp['image'].endswith('/media/products/front.jpg'))
+        self.assertTrue(lamp['thumbnail'].endswith('/thumb_webp.webp'))
+        self.assertEqual((results[self.bare.id]['image'], results[self.bare.id]['thumbnail']), (None, None))
+
+        detail = self.client.get(f'/api/products/{self.lamp.id}/').data
+        self.assertEqual(len(detail['images']), 2)
+        self.assertIn('description', detail)
+
+
+class ConditionalGetTests(APITestCase):
+
+    def setUp(self):
+        self.shop = make_shop("Etag Shop")
+        self.product = make_product(self.shop, "Kettle", stock=5)
+        self.url = f'/api/products/{self.product.id}/'
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(url, params, HTTP_IF_NONE_MATCH=response['ETag'])
+
+    def test_unchanged_resources_return_304_before_loading_rows(self):
+        # Only the validator aggregate runs (list pages come from the cache, see below)
+        for url, queries in ((self.url, 1), ('/api/products/', 0), ('/api/shops/', 1)):
+            first = self.client.get(url)
+            self.assertEqual(first.status_code, 200)
+            with self.assertNumQueries(queries):
+                second = self.revalidate(url, first)
+            self.assertEqual(second.status_code, 304)
+            self.assertEqual(second['ETag'], first['ETag'])
+
+        first = self.client.get(self.url)
+        modified = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(modified.status_code, 304)
+
+    def test_lists_never_aggregate_the_catalog(self):
+        # Per-process cache: lists are validated by their body, not by MAX()/COUNT() over the catalog
+        for url in ('/api/products/', '/api/async/products/'):
+            with CaptureQueriesContext(connection) as ctx:
+                first = self.client.get(url)
+            self.assertFalse([q['sql'] for q in ctx.captured_queries if 'MAX(' in q['sql']])
+            self.assertTrue(first['ETag'].startswith('W/'))
+            with self.assertNumQueries(0):
+                self.assertEqual(self.revalidate(url, first).status_code, 304)
+            self.product.name = f"Renamed for {url}"
+            self.product.save()
+            self.assertEqual(self.revalidate(url, first).status_code, 200)
+
+    def test_shared_cache_lists_read_the_catalog_version(self):
+        # A cache shared by every process lets list pages skip the aggregate
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.enterContext(override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}
+        }))
+        self.assertTrue(catalog_cache.shares_versions)
+        for url in ('/api/products/', '/api/async/products/'):
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.revalidate(url, first).status_code, 304)
+            self.product.name = "Renamed"
+            self.product.save()
+            self.assertEqual(self.revalidate(url, first).status_code, 200)
+
+    def test_writes_change_validators(self):
+        detail, listing = self.client.get(self.url), self.client.get('/api/products/')
+        user = User.objects.create_user(username='buyer')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        checkout_cart(cart)
+        self.assertEqual(self.revalidate(self.url, detail).data['stock'], 3)
+        self.assertEqual(self.revalidate('/api/products/', listing).status_code, 200)
+
+        detail = self.client.get(self.url)
+        self.shop.name = "Renamed"
+        self.shop.save()
+        self.assertEqual(self.revalidate(self.url, detail).status_code, 200)
+
+    def test_order_history_follows_vendor_status(self):
+        user = User.objects.create_user(username='buyer')
+        self.client.force_authenticate(user)
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+        shop_order = checkout_cart(cart).shop_orders[0]
+        first = self.client.get('/api/orders/')
+        self.assertEqual(self.revalidate('/api/orders/', first).status_code, 304)
+        shop_order.status = 'shipped'
+        shop_order.save()
+        self.assertEqual(self.revalidate('/api/orders/', first).status_code, 200)
+
+    def test_sparse_fieldsets(self):
+        detail = self.client.get(self.url, {'fields': 'id,name,stock'})
+        self.assertEqual(detail.data, {'id': self.product.id, 'name': "Kettle", 'stock': 5})
+        self.assertEqual(set(self.client.get(self.url).data) - {'images'}, set(ProductSerializer.Meta.fields) - {'images'})
+
+        listing = self.client.get('/api/products/', {'fields': 'id,price'})
+        self.assertEqual(listing.data['results'], [{'id': self.product.id, 'price': '10.00'}])
+        shops = self.client.get('/api/shops/', {'fields': 'name'})
+        self.assertEqual(list(shops.data), [{'name': "Etag Shop"}])
+        self.assertNotEqual(
+            self.client.get(self.url, {'fields': 'id'})['ETag'], self.client.get(self.url)['ETag']
+        )
+        self.assertEqual(self.client.get(self.url, {'fields': 'id,secret'}).status_code, 400)
+
+
+class CartStoreTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='shopper')
+        self.client.force_authenticate(self.user)
+        shop = make_shop("Cart Shop")
+        self.pen = make_product(shop, "Pen")
+        self.ink = make_product(shop, "Ink")
+
+    def add(self, product_id, quantity=1):
+        return self.client.post('/api/cart/add_item/', {'product_id': product_id, 'quantity': quantity})
+
+    def batch_add(self, product_id, quantity=1):
+        items = [{'product_id': product_id, 'quantity': quantity}]
+        return self.client.post('/api/cart/items/', {'items': items}, format='json')
+
+    def lines(self):
+        return dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity'))
+
+    def test_add_item_returns_the_cart(self):
+        response = self.add(self.pen.id, 2)  # creates the cart
+        self.assertEqual([(item['product'], item['quantity']) for item in response.data['items']], [(self.pen.id, 2)])
+        # The upsert, then the cart and its lines for the response
+        with self.assertNumQueries(3):
+            response = self.add(self.pen.id, 3)
+        self.assertEqual(set(response.data), {'id', 'user', 'items', 'total_price'})
+        self.assertEqual(response.data['items'][0]['quantity'], 5)
+        self.assertEqual(response.data['items'][0]['subtotal'], Decimal('50.00'))
+        self.assertEqual(self.lines(), {self.pen.id: 5})
+
+        self.assertEqual(self.add(999999).status_code, 400)
+        self.assertEqual(self.add(self.pen.id, 0).status_code, 400)
+        self.assertEqual(self.add(self.pen.id, 10 ** 20).status_code, 400)
+        self.assertEqual(self.add('pen').status_code, 400)
+
+    def test_batch_add_and_set(self):
+        self.add(self.pen.id, 1)
+        response = self.client.post('/api/cart/items/', {'items': [
+            {'product_id': self.pen.id, 'quantity': 2},
+            {'product_id': self.ink.id},
+            {'product_id': 999999, 'quantity': 1},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['unknown_products'], [999999])
+        self.assertEqual(self.lines(), {self.pen.id: 3, self.ink.id: 1})
+
+        response = self.client.post('/api/cart/items/', {'mode': 'set', 'items': [
+            {'product_id': self.pen.id, 'quantity': 7},
+            {'product_id': self.ink.id, 'quantity': 0},
+        ]}, format='json')
+        self.assertEqual(
+            response.data['items'], [{'product': self.pen.id, 'quantity': 7}, {'product': self.ink.id, 'quantity': 0}]
+        )
+        self.assertEqual(self.lines(), {self.pen.id: 7})
+
+        bad = {'items': [{'product_id': self.pen.id, 'quantity': -1}]}
+        self.assertEqual(self.client.post('/api/cart/items/', bad, format='json').status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/items/', {'mode': 'x', 'items': []}, format='json').status_code, 400)
+
+    def test_remove_item(self):
+        self.add(self.pen.id)
+        self.assertEqual(self.client.post('/api/cart/remove_item/', {'product_id': self.pen.id}).status_code, 204)
+        self.assertEqual(self.client.post('/api/cart/remove_item/', {'product_id': self.pen.id}).status_code, 404)
+
+    @override_settings(CART_STORE={'BACKEND': 'shop.services.cart.CacheCartStore'})
+    def test_cache_store_writes_through(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        Cart.objects.create(user=self.user)
+        self.batch_add(self.pen.id)  # seeds the cached cart from the database
+        # Only the product ids are checked
+        with self.assertNumQueries(1):
+            self.batch_add(self.pen.id, 2)
+        with self.assertNumQueries(1):
+            self.batch_add(self.ink.id)
+        self.assertEqual(self.lines(), {})
+
+        # add_item renders the cached lines without writing them through
+        pricing_engine.index()  # loaded once per process, see CheckoutTests
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.add(self.ink.id)
+        self.assertEqual(len(ctx), 2)
+        self.assertTrue(all(q['sql'].startswith('SELECT') for q in ctx.captured_queries))
+        self.assertEqual(
+            {item['product']: item['quantity'] for item in response.data['items']}, {self.pen.id: 3, self.ink.id: 2}
+        )
+        self.assertEqual(response.data['total_price'], Decimal('50.00'))
+        self.assertEqual(self.lines(), {})
+        self.assertEqual(self.add(999999).status_code, 400)
+        self.client.post('/api/cart/remove_item/', {'product_id': self.ink.id})
+
+        cart = self.client.get('/api/cart/').data[0]
+        self.assertEqual({item['product']: item['quantity'] for item in cart['items']}, {self.pen.id: 3})
+        self.add(self.pen.id)
+
+        response = self.client.post('/api/cart/checkout/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(OrderDetail.objects.get(product=self.pen).quantity, 4)
+        self.assertFalse(OrderDetail.objects.filter(product=self.ink).exists())
+        self.assertEqual(self.lines(), {})
+        self.assertEqual(self.client.get('/api/cart/').data[0]['items'], [])
+
+
+class CartStoreConcurrencyTests(TransactionTestCase):
+    """Writers on other connections must see the products they add."""
+
+    def test_cache_store_concurrent_adds_are_not_lost(self):
+        user = User.objects.create_user(username='shopper')
+        pen = make_product(make_shop("Cart Shop"), "Pen")
+        cache.clear()
+        self.addCleanup(cache.clear)
+        store = CacheCartStore({**cart_options(), 'BACKEND': 'shop.services.cart.CacheCartStore'})
+        store.add_lines(user.pk, {pen.id: 1})  # seeds the cached cart from the database
+
+        def add_many():
+            try:
+                for _ in range(50):
+                    store.add_lines(user.pk, {pen.id: 1})
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_many) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(store.add_lines(user.pk, {pen.id: 0})[pen.id], 201)
+
+        # A writer gives up on a cart another writer keeps locked
+        cache.add(f'cart:{user.pk}:lock', 'crashed', 1)
+        busy = CacheCartStore({**store.config, 'LOCK_TIMEOUT': 0.05})
+        with self.assertRaises(CartBusyError):
+            busy.remove(user.pk, pen.id)
+
+
+class PricingTests(APITestCase):
+
+    def setUp(self):
+        self.addCleanup(pricing_engine.clear)
+        self.now = timezone.now()
+        shop = make_shop("Sale Shop")
+        self.mugs = Category.objects.create(name="Mugs")
+        self.mug = make_product(shop, "Mug", price='20.00')
+        self.mug.category = self.mugs
+        self.mug.save()
+        self.pen = make_product(shop, "Pen", price='3.00')
+        self.category_sale = self.discount("Mug week", '10', categories=[self.mugs])
+        self.discount("Mug clearance", '25', products=[self.mug])
+        self.upcoming = self.discount("Pen launch", '50', products=[self.pen], starts_in=timedelta(hours=1))
+
+    def discount(self, name, percentage, products=(), categories=(), starts_in=timedelta(hours=-1)):
+        discount = Discount.objects.create(
+            name=name, discount_percentage=Decimal(percentage),
+            start_date=self.now + starts_in, end_date=self.now + starts_in + timedelta(days=1)
+        )
+        discount.products.set(products)
+        discount.categories.set(categories)
+        return discount
+
+    def test_best_active_discount_applies_everywhere(self):
+        detail = self.client.get(f'/api/products/{self.mug.id}/').data
+        self.assertEqual((detail['price'], detail['sale_price'], detail['discount_percentage']), ('20.00', '15.00', '25.00'))
+        cards = {row['id']: row for row in self.client.get('/api/products/').data['results']}
+        self.assertEqual(cards[self.mug.id]['sale_price'], '15.00')
+        self.assertEqual((cards[self.pen.id]['sale_price'], cards[self.pen.id]['discount_percentage']), ('3.00', None))
+
+        user = User.objects.create_user(username='bargain')
+        self.client.force_authenticate(user)
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=self.mug, quantity=2)
+        CartItem.objects.create(cart=cart, product=self.pen, quantity=1)
+        self.assertEqual(self.client.get('/api/cart/').data[0]['total_price'], Decimal('33.00'))
+        order = checkout_cart(cart).order
+        self.assertEqual(order.total_amount, Decimal('33.00'))
+        self.assertEqual(OrderDetail.objects.get(order=order, product=self.mug).price, Decimal('15.00'))
+
+    def test_detail_resolves_the_discount_once(self):
+        index = pricing_engine.index()
+        with mock.patch.object(index, 'percentage', wraps=index.percentage) as percentage:
+            data = ProductSerializer([self.mug, self.pen], many=True, context={'prices': index}).data
+        self.assertEqual([row['sale_price'] for row in data], ['15.00', '3.00'])
+        self.assertEqual(percentage.call_count, 2)
+
+    @override_settings(CATALOG_CACHE={'ENABLED': False})
+    def test_list_pricing_does_not_query_per_product(self):
+        def list_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get('/api/products/')
+            return len(ctx.captured_queries)
+
+        list_queries()
+        small = list_queries()
+        category_products = [make_product(self.mug.shop, f"Cup {i}") for i in range(20)]
+        Product.objects.filter(pk__in=[p.pk for p in category_products]).update(category=self.mugs)
+        self.assertEqual(list_queries(), small)
+
+    def test_windows_open_and_close_without_reloading(self):
+        index = pricing_engine.index(self.now)
+        self.assertEqual(index.sale_price(self.pen), Decimal('3.00'))
+        with self.assertNumQueries(0):
+            later = pricing_engine.index(self.now + timedelta(hours=2))
+            self.assertEqual(later.sale_price(self.pen), Decimal('1.50'))
+            self.assertNotEqual(later.token, index.token)
+            ended = pricing_engine.index(self.now + timedelta(days=1))
+        self.assertEqual(ended.sale_price(self.mug), Decimal('20.00'))
+        self.assertEqual(later.valid_until, self.now + timedelta(hours=23))
+
+    def test_discount_changes_reach_cached_payloads(self):
+        url = f'/api/products/{self.mug.id}/'
+        first = self.client.get(url)
+        self.category_sale.discount_percentage = Decimal('40')
+        self.category_sale.save()
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['sale_price'], '12.00')
+
+        self.category_sale.categories.clear()
+        self.assertEqual(self.client.get(url).data['sale_price'], '15.00')
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'process-1'},
+        'process-2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'process-2'},
+    })
+    def test_other_processes_reload_without_a_shared_cache(self):
+        # A second process: its own engine, reading versions from its own LocMem cache
+        other = PricingEngine()
+        in_other_process = override_settings(CATALOG_CACHE={'BACKEND': 'process-2'})
+        with in_other_process:
+            before = other.index()
+        self.assertEqual(before.sale_price(self.mug), Decimal('15.00'))
+
+        self.category_sale.discount_percentage = Decimal('40')
+        self.category_sale.save()
+        self.assertEqual(pricing_engine.index().sale_price(self.mug), Decimal('12.00'))
+        with in_other_process, self.assertNumQueries(0):
+            self.assertIs(other.index(), before)  # within RELOAD_INTERVAL
+
+        with in_other_process, override_settings(PRICING={'RELOAD_INTERVAL': 0}):
+            after = other.index()
+        self.assertEqual(after.sale_price(self.mug), Decimal('12.00'))
+        # Both processes key cached payloads and ETags by the same prices
+        self.assertEqual(after.token, pricing_engine.index().token)
+
+
+class IdempotentCheckoutTests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='retrier')
+        self.client.force_authenticate(self.user)
+        self.product = make_product(make_shop("Retry Shop"), "Charger", price='7.25', stock=10)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+
+    def checkout(self, key='order-1'):
+        return self.client.post('/api/cart/checkout/', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.checkout()
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(1):  # reads the stored response
+            retry = self.checkout()
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 8)
+
+        # Without a key (or with a new one) the now empty cart is checked out again
+        self.assertEqual(self.checkout('order-2').status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/checkout/').status_code, 400)
+
+    def test_keys_are_scoped_and_validated(self):
+        self.checkout()
+        with self.assertRaises(idempotency.KeyReusedError):
+            idempotency.run_once(self.user.pk, 'order-1', '/api/other/', lambda: None)
+        self.assertEqual(self.checkout('x' * 256).status_code, 400)
+
+        other = User.objects.create_user(username='other')
+        self.client.force_authenticate(other)
+        # Keys are per user: another user's key does not replay this order
+        self.assertEqual(self.checkout().status_code, 404)
+
+    def test_failures_release_the_key(self):
+        with self.assertRaises(RuntimeError):
+            idempotency.run_once(self.user.pk, 'order-1', '/api/cart/checkout/', self.fail_checkout)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.checkout().status_code, 201)
+
+    def fail_checkout(self):
+        raise RuntimeError("connection reset")
+
+    def test_expired_keys_are_purged(self):
+        self.checkout()
+        IdempotencyKey.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn("Deleted 1", out.getvalue())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class IdempotencyConcurrencyTests(TransactionTestCase):
+
+    def test_duplicate_waits_for_the_first_request(self):
+        user = User.objects.create_user(username='double-tap')
+        started, calls, results = threading.Event(), [], {}
+
+        def slow_checkout():
+            calls.append('first')
+            started.set()
+            time.sleep(0.3)
+            return Response({'order_id': 41}, status=201)
+
+        def duplicate_checkout():
+            calls.append('duplicate')
+            return Response({'order_id': 42}, status=201)
+
+        def send(name, handler):
+            try:
+                results[name] = idempotency.run_once(user.pk, 'tap', '/api/cart/checkout/', handler)
+            finally:
+                connection.close()
+
+        first = threading.Thread(target=send, args=('first', slow_checkout))
+        first.start()
+        started.wait()
+        duplicate = threading.Thread(target=send, args=('duplicate', duplicate_checkout))
+        duplicate.start()
+        first.join()
+        duplicate.join()
+
+        self.assertEqual(calls, ['first'])
+        self.assertEqual(results['first'], (201, {'order_id': 41}, False))
+        self.assertEqual(results['duplicate'], (201, {'order_id': 41}, True))
+
+
+handled_payloads = []
+
+
+@outbox.subscriber('test.record')
+def record_payload(payload):
+    handled_payloads.append(payload['n'])
+
+
+@outbox.subscriber('test.flaky')
+def fail_payload(payload):
+    raise ConnectionError("vendor webhook unreachable")
+
+
+class OutboxTests(APITestCase):
+
+    def setUp(self):
+        handled_payloads.clear()
+        self.product = make_product(make_shop("Outbox Shop"), "Bell", price='2.00')
+        self.buyer = User.objects.create_user(username='buyer')
+
+    def test_checkout_only_queues_side_effects(self):
+        cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=3)
+        result = checkout_cart(cart)
+        order, [shop_order] = result.order, result.shop_orders
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.topic, event.payload), (analytics.ORDER_PLACED, {
+            'order_id': order.pk,
+            'shop_orders': {str(shop_order.pk): {'status': 'pending', 'shop_total': '6.00'}},
+        }))
+        self.assertFalse(ProductSalesRollup.objects.exists())
+
+        out = StringIO()
+        call_command('run_outbox_worker', '--once', '--concurrency=1', stdout=out)
+        self.assertIn("Handled 1", out.getvalue())
+        self.assertEqual(ProductSalesRollup.objects.get().units, 3)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_status_change_before_the_worker_runs(self):
+        cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.create(cart=cart, product=self.product, quantity=3)
+        [shop_order] = checkout_cart(cart).shop_orders
+        shop_order.refresh_from_db()
+        shop_order.status = 'shipped'
+        shop_order.save()
+
+        call_command('run_outbox_worker', '--once', '--concurrency=1', stdout=StringIO())
+        today = timezone.localdate()
+        report = analytics.dashboard(self.product.shop_id, today, today)
+        self.assertEqual(
+            [(row['status'], row['orders']) for row in report['status_breakdown']], [('shipped', 1)]
+        )
+        self.assertFalse(ShopOrderStatusRollup.objects.filter(orders__lt=0).exists())
+
+    def test_leased_events_are_not_claimed_twice(self):
+        for n in range(3):
+            outbox.publish('test.record', {'n': n})
+        first = outbox.claim('worker-a', 2, lease=60)
+        self.assertEqual(len(first), 2)
+        self.assertEqual([e.payload['n'] for e in outbox.claim('worker-b', 10, lease=60)], [2])
+        self.assertEqual(outbox.claim('worker-c', 10, lease=60), [])
+
+        # A worker whose lease was taken over rolls back, leaving the event to its new owner
+        OutboxEvent.objects.filter(pk=first[0].pk).update(locked_by='worker-d')
+        with self.assertLogs('shop.services.outbox', 'WARNING'):
+            self.assertFalse(outbox.handle(first[0], 'worker-a'))
+        self.assertTrue(outbox.handle(first[1], 'worker-a'))
+        self.assertEqual(
+            list(OutboxEvent.objects.order_by('pk').values_list('locked_by', flat=True)), ['worker-d', 'worker-b']
+        )
+
+    def test_failures_back_off_then_park(self):
+        event = outbox.publish('test.flaky', {})
+        config = {**outbox.options(), 'MAX_ATTEMPTS': 2}
+        [claimed] = outbox.claim('worker', 10, lease=60)
+        with self.assertLogs('shop.services.outbox', 'WARNING'):
+            self.assertFalse(outbox.handle(claimed, 'worker', config))
+        event.refresh_from_db()
+        self.assertEqual((event.attempts, event.locked_by, event.failed_at), (1, '', None))
+        self.assertIn("vendor webhook unreachable", event.last_error)
+        self.assertGreater(event.available_at, timezone.now())
+        self.assertEqual(outbox.claim('worker', 10, lease=60), [])
+
+        OutboxEvent.objects.update(available_at=timezone.now())
+        [claimed] = outbox.claim('worker', 10, lease=60)
+        with self.assertLogs('shop.services.outbox', 'ERROR'):
+            outbox.handle(claimed, 'worker', config)
+        event.refresh_from_db()
+        self.assertIsNotNone(event.failed_at)
+        self.assertEqual(outbox.process_pending(config, concurrency=1), 0)
+
+
+class OutboxConcurrencyTests(TransactionTestCase):
+
+    def test_parallel_workers_drain_the_outbox(self):
+        handled_payloads.clear()
+        OutboxEvent.objects.bulk_create([
+            OutboxEvent(topic='test.record', payload={'n': n}) for n in range(60)
+        ])
+        # The in-memory test database reports contention as "table is locked"
+        # instead of waiting; such failures are retried right away here
+        config = {**outbox.options(), 'BATCH_SIZE': 7, 'BACKOFF': 0, 'LEASE': 1, 'MAX_ATTEMPTS': 1000}
+        deadline = time.monotonic() + 30
+        logger = logging.getLogger('shop.services.outbox')
+        self.addCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.CRITICAL)
+
+        def work():
+            try:
+                while OutboxEvent.objects.exists() and time.monotonic() < deadline:
+                    try:
+                        outbox.process_pending(config, concurrency=3)
+                    except OperationalError:
+                        time.sleep(random.uniform(0, 0.01))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=work) for _ in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        # Non-database side effects of a failed attempt are repeated (at least once)
+        self.assertEqual(set(handled_payloads), set(range(60)))
+        self.assertFalse(OutboxEvent.objects.exists())
+
+
+class AsyncReadTests(APITestCase):
+
+    def setUp(self):
+        self.addCleanup(pricing_engine.clear)
+        self.shop = make_shop("Async Shop")
+        self.kettle = make_product(self.shop, "Kettle", price='30.00')
+        self.mug = make_product(self.shop, "Mug", price='8.00', stock=0)
+        now = timezone.now()
+        sale = Discount.objects.create(
+            name="Kettle days", discount_percentage=Decimal('10'),
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(days=1)
+        )
+        sale.products.set([self.kettle])
+        self.user = User.objects.create_user(username='async-buyer')
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.kettle, quantity=1)
+        checkout_cart(cart)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def test_payloads_match_sync_endpoints(self):
+        for path, params in (
+            ('products/', {}), ('products/', {'in_stock': 'true', 'fields': 'id,sale_price'}),
+            (f'products/{self.kettle.id}/', {}), (f'products/{self.kettle.id}/', {'fields': 'name,sale_price'}),
+            ('shops/', {}), ('orders/', {}),
+        ):
+            sync = self.client.get(f'/api/{path}', params, **self.auth)
+            response = self.client.get(f'/api/async/{path}', params, **self.auth)
+            self.assertEqual(response.status_code, 200, path)
+            data, expected = response.json(), sync.json()
+            if 'results' in expected:
+                # Pagination links point at each endpoint's own URL
+                data.pop('next'), data.pop('previous'), expected.pop('next'), expected.pop('previous')
+            self.assertEqual(data, expected, path)
+        listing = self.client.get('/api/async/products/').json()
+        self.assertEqual(listing['facets'], self.client.get('/api/products/').json()['facets'])
+        self.assertEqual({row['name']: row['sale_price'] for row in listing['results']}, {'Kettle': '27.00', 'Mug': '8.00'})
+
+    def test_conditional_get_and_errors(self):
+        for path, headers in (
+            ('products/', {}), (f'products/{self.kettle.id}/', {}), ('shops/', {}), ('orders/', self.auth)
+        ):
+            first = self.client.get(f'/api/async/{path}', **headers)
+            second = self.client.get(f'/api/async/{path}', HTTP_IF_NONE_MATCH=first['ETag'], **headers)
+            self.assertEqual(second.status_code, 304, path)
+
+        anonymous = self.client.get('/api/async/orders/')
+        self.assertEqual(anonymous.status_code, 401)
+        self.assertIn('Bearer', anonymous['WWW-Authenticate'])
+        bad_token = self.client.get('/api/async/orders/', HTTP_AUTHORIZATION='Bearer nonsense')
+        self.assertEqual(bad_token.status_code, 401)
+        self.assertEqual(self.client.get('/api/async/products/0/').status_code, 404)
+        self.assertEqual(self.client.get('/api/async/products/', {'in_stock': 'maybe'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/async/products/', {'fields': 'secret'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/async/shops/').status_code, 405)
+
+    async def test_concurrent_requests_on_the_async_handler(self):
+        paths = ['products/', f'products/{self.kettle.id}/', 'shops/'] * 5
+        responses = await asyncio.gather(
+            *(self.async_client.get(f'/api/async/{path}') for path in paths),
+            self.async_client.get('/api/async/orders/', headers={'Authorization': self.auth['HTTP_AUTHORIZATION']}),
+        )
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(len(responses[-1].json()['results']), 1)
+
+
+class RequestMetricsTests(APITestCase):
+
+    def setUp(self):
+        metrics.registry.reset()
+        self.addCleanup(metrics.registry.reset)
+        self.product = make_product(make_shop("Metric Shop"), "Scale")
+        self.staff = User.objects.create_user(username='ops', is_staff=True)
+
+    def scrape(self):
+        self.client.force_authenticate(self.staff)
+        response = self.client.get('/api/metrics/')
+        self.client.force_authenticate(None)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def sample(self, text, name, **labels):
+        selector = ','.join(f'{key}="{value}"' for key, value in labels.items())
+        for line in text.splitlines():
+            if line.startswith(f'{name}{{{selector}}} '):
+                return float(line.rpartition(' ')[2])
+        self.fail(f"No sample {name}{{{selector}}}")
+
+    def test_routes_are_measured(self):
+        url = f'/api/products/{self.product.id}/'
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        detail_queries = len(queries)  # the next request resets the query log
+        self.client.get('/api/products/')
+        self.client.get('/api/products/')
+        self.client.get(f'/api/async/products/{self.product.id}/', {'fields': 'id'})
+        self.client.get('/api/no-such-page/')
+        text = self.scrape()
+
+        detail = {'route': 'shop:product-detail', 'method': 'GET'}
+        self.assertEqual(self.sample(text, 'shop_request_queries_sum', **detail), detail_queries)
+        self.assertEqual(self.sample(text, 'shop_request_queries_bucket', **detail, le='+Inf'), 1)
+        self.assertGreater(self.sample(text, 'shop_request_serializer_seconds_sum', **detail), 0)
+        listing = {'route': 'shop:product-list', 'method': 'GET'}
+        self.assertEqual(self.sample(text, 'shop_requests_total', **listing, status=200), 2)
+        self.assertGreater(self.sample(text, 'shop_request_db_seconds_sum', **listing), 0)
+        self.assertGreater(self.sample(text, 'shop_request_queries_sum', route='shop:async-product-detail', method='GET'), 0)
+        self.assertEqual(self.sample(text, 'shop_requests_total', route='unmatched', method='GET', status=404), 1)
+        self.assertIn('# TYPE shop_request_duration_seconds histogram', text)
+
+    def test_serializers_keep_their_class(self):
+        view = ProductViewSet(action='retrieve', request=None, format_kwarg=None, kwargs={})
+        self.assertIs(type(view.get_serializer(self.product)), ProductSerializer)
+
+    def test_metrics_are_staff_only(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 401)
+        self.client.force_authenticate(User.objects.create_user(username='buyer'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+    def test_slow_requests_are_profiled(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with override_settings(METRICS={'PROFILE_SAMPLE_RATE': 1, 'PROFILE_MIN_DURATION': 0, 'PROFILE_DIR': directory}):
+            self.client.get('/api/products/')
+        with override_settings(METRICS={'PROFILE_SAMPLE_RATE': 1, 'PROFILE_MIN_DURATION': 60, 'PROFILE_DIR': directory}):
+            self.client.get('/api/products/')
+        (name,) = os.listdir(directory)
+        self.assertTrue(name.startswith('shop.product-list-GET-') and name.endswith('.prof'))
+        stats = pstats.Stats(os.path.join(directory, name))
+        self.assertTrue(any(func[2] == 'list' for func in stats.stats))
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class JWTFastPathTests(APITestCase):
+
+    def setUp(self):
+        self.addCleanup(user_cache.clear)
+        self.home, self.other = make_shop("Home Shop"), make_shop("Other Shop")
+        self.lamp, self.rug = make_product(self.home, "Lamp"), make_product(self.other, "Rug")
+        self.user = User.objects.create_user(username='vendor', password='s3cret-pass')
+        self.manager = Manager.objects.create(user=self.user, shop=self.home)
+
+    def login(self):
+        tokens = self.client.post('/api/token/', {'username': 'vendor', 'password': 's3cret-pass'}).data
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {tokens['access']}")
+        return tokens
+
+    def auth_queries(self, queries):
+        tables = ('auth_user', 'shop_manager')
+        return [q['sql'] for q in queries.captured_queries if any(table in q['sql'] for table in tables)]
+
+    def test_authenticated_reads_make_no_auth_queries(self):
+        self.login()
+        for url in ('/api/orders/', '/api/vendor-orders/', '/api/async/orders/'):
+            self.assertEqual(self.client.get(url).status_code, 200)
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(self.auth_queries(queries), [], url)
+
+    def test_permissions_compare_shop_ids(self):
+        self.login()
+        self.client.get('/api/orders/')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f'/api/products/{self.lamp.id}/', {'stock': 7})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.auth_queries(queries), [])
+        self.assertEqual(self.client.patch(f'/api/products/{self.rug.id}/', {'stock': 7}).status_code, 403)
+        self.assertEqual(self.client.patch(f'/api/shops/{self.home.id}/', {'description': "Lamps"}).status_code, 200)
+        self.assertEqual(self.client.patch(f'/api/shops/{self.other.id}/', {'description': "Rugs"}).status_code, 403)
+
+    def test_user_and_manager_changes_apply_at_once(self):
+        self.login()
+        self.client.get('/api/orders/')
+        self.manager.shop = self.other
+        self.manager.save()
+        self.assertEqual(self.client.patch(f'/api/products/{self.rug.id}/', {'stock': 1}).status_code, 200)
+        self.assertEqual(self.client.patch(f'/api/products/{self.lamp.id}/', {'stock': 1}).status_code, 403)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/orders/').status_code, 401)
+        self.assertEqual(self.client.get('/api/async/orders/').status_code, 401)
+
+
+class SQLiteProfileTests(SimpleTestCase):
+    """The production profile applies to every new connection (tests run in memory)."""
+
+    def test_connections_use_wal_and_immediate_transactions(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        wrapper = type(connections['default'])({
+            **connections['default'].settings_dict, **settings.SQLITE_PRODUCTION,
+            'NAME': os.path.join(directory, 'profile.sqlite3'),
+        }, alias='profile')
+        self.addCleanup(wrapper.close)
+        with wrapper.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+        self.assertEqual(wrapper.settings_dict['CONN_MAX_AGE'], 0)
+
+
+@override_settings(DATABASE_ROUTING={'REPLICAS': ['replica'], 'PIN_SECONDS': 5}, CATALOG_CACHE={'ENABLED': False})
+class ReadReplicaTests(TransactionTestCase):
+    """A second SQLite file plays the replica; it lags behind the primary."""
+    databases = '__all__'  # resolved after setUpClass registers 'replica'
+    client_class = APIClient
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        connections.settings['replica'] = {
+            **connections.settings['default'], 'NAME': os.path.join(cls.directory, 'replica.sqlite3')
+        }
+        call_command('migrate', database='replica', verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        shutil.rmtree(cls.directory)
+
+    def setUp(self):
+        self.shop = make_shop("Primary Shop")
+        self.product = make_product(self.shop, "Fresh")
+        self.copy_to_replica(self.shop, name="Replica Shop")
+        self.copy_to_replica(self.product, name="Stale")
+        self.user = User.objects.create_user(username='writer')
+        self.addCleanup(cache.delete, routing.pin_key(self.user.pk))
+
+    def copy_to_replica(self, obj, **changes):
+        fields = {field.attname: getattr(obj, field.attname) for field in type(obj)._meta.concrete_fields}
+        type(obj).objects.using('replica').bulk_create([type(obj)(**{**fields, **changes})])
+
+    def product_name(self, client=None):
+        return (client or self.client).get(f'/api/products/{self.product.id}/').json()['name']
+
+    def test_safe_requests_read_from_a_replica(self):
+        self.assertEqual(self.product_name(), "Stale")
+        self.assertEqual([shop['name'] for shop in self.client.get('/api/shops/').json()], ["Replica Shop"])
+        self.assertEqual(self.client.get(f'/api/async/products/{self.product.id}/').json()['name'], "Stale")
+        # Single-database fallbacks
+        for replicas in ([], ['missing']):
+            with override_settings(DATABASE_ROUTING={'REPLICAS': replicas}):
+                self.assertEqual(self.product_name(), "Fresh")
+
+    def test_writers_read_their_writes(self):
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/api/cart/add_item/', {'product_id': self.product.id, 'quantity': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db_pin', response.cookies)
+        self.assertEqual(self.product_name(), "Fresh")
+        # Pinned by user id as well, for clients that drop cookies
+        self.client.cookies.clear()
+        self.assertEqual(self.product_name(), "Fresh")
+        self.assertEqual(self.product_name(APIClient()), "Stale")
+        cache.delete(routing.pin_key(self.user.pk))
+        self.assertEqual(self.product_name(), "Stale")
+
+
+class SyntheticDataTests(APITestCase):
+    def test_generated_dataset_is_consistent(self):
+        out = StringIO()
+        call_command('generate_data', shops=3, products=30, buyers=10, orders=25, comments=40, stdout=out)
+        self.assertIn("30 products", out.getvalue())
+        self.assertEqual((Shop.objects.count(), Manager.objects.count(), Product.objects.count()), (3, 3, 30))
+        self.assertEqual(Order.objects.count(), 25)
+        self.assertGreater(ShopOrder.objects.count(), 25)
+        # Totals add up, and the derived data matches the rows
+        for order in Order.objects.prefetch_related('shop_orders__items'):
+            shop_orders = order.shop_orders.all()
+            self.assertEqual(order.total_amount, sum(shop_order.shop_total for shop_order in shop_orders))
+            for shop_order in shop_orders:
+                self.assertEqual(shop_order.created_at, order.created_at)
+                self.assertEqual(
+                    shop_order.shop_total, sum(line.quantity * line.price for line in shop_order.items.all())
+                )
+        self.assertEqual(reconcile_counters(), (30, 0))
+        self.assertGreater(Order.objects.dates('created_at', 'day').count(), 1)
+        self.assertTrue(ProductSalesRollup.objects.exists())
+        in_stock = self.client.get('/api/products/').data['facets']['in_stock']
+        self.assertEqual(sum(cell['count'] for cell in in_stock), 30)
+
+        with self.assertRaises(CommandError):
+            call_command('generate_data', shops=3, products=30, stdout=out)
+        call_command('generate_data', shops=3, products=30, buyers=10, orders=5, comments=5, seed=1, stdout=out)
+        self.assertEqual(Product.objects.count(), 60)
+
+    def test_every_route_has_a_benchmark_plan(self):
+        routes = endpoints.routes()
+        self.assertIn(('shop:product-list', 'GET'), routes)
+        self.assertIn(('shop:async-order-list', 'GET'), routes)
+        self.assertEqual(
+            [route for route in routes if route not in endpoints.PLANS and route not in endpoints.SKIPPED], []
+        )
+
+
+class CommentModerationTests(APITestCase):
+    def setUp(self):
+        self.shop = make_shop("Moderated Shop")
+        self.other_shop = make_shop("Other Shop")
+        self.user = User.objects.create_user(username='moderator')
+        self.manager = Manager.objects.create(user=self.user, shop=self.shop)
+        self.buyer = User.objects.create_user(username='reviewer')
+        self.mug = make_product(self.shop, "Mug")
+        self.lamp = make_product(self.shop, "Lamp")
+        self.elsewhere = make_product(self.other_shop, "Kettle")
+        self.pending = [
+            Comment.objects.create(product=product, user=self.buyer, comment=f"Comment {i}")
+            for i, product in enumerate([self.mug, self.lamp, self.mug])
+        ]
+        self.foreign = Comment.objects.create(product=self.elsewhere, user=self.buyer, comment="Not yours")
+        self.client.force_authenticate(self.user)
+
+    def moderate(self, verdict, comments):
+        return self.client.post(
+            '/api/moderation/comments/moderate/', {'action': verdict, 'ids': [c.pk for c in comments]}, format='json'
+        )
+
+    def test_queue_lists_the_shops_pending_comments_oldest_first(self):
+        self.assertEqual(self.foreign.shop_id, self.other_shop.id)
+        response = self.client.get('/api/moderation/comments/?page_size=2')
+        self.assertEqual([row['id'] for row in response.data['results']], [c.pk for c in self.pending[:2]])
+        self.assertEqual(response.data['results'][0]['product_name'], "Mug")
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], [self.pending[2].pk])
+
+        self.moderate('reject', self.pending[:1])
+        response = self.client.get('/api/moderation/comments/')
+        self.assertEqual([row['id'] for row in response.data['results']], [c.pk for c in self.pending[1:]])
+        # Moving a product to another shop moves its comments to that queue
+        self.lamp.shop = self.other_shop
+        self.lamp.save()
+        response = self.client.get('/api/moderation/comments/')
+        self.assertEqual([row['id'] for row in response.data['results']], [self.pending[2].pk])
+
+        self.client.force_authenticate(self.buyer)
+        self.assertEqual(self.client.get('/api/moderation/comments/').status_code, 403)
+
+    def test_bulk_approval_updates_counters_in_one_statement(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.moderate('approve', [*self.pending, self.foreign])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'action': 'approve', 'moderated': 3, 'skipped': 1})
+        updates = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "shop_comment"')]
+        self.assertEqual(len(updates), 1)
+        self.mug.refresh_from_db()
+        self.lamp.refresh_from_db()
+        self.assertEqual((self.mug.comment_count, self.lamp.comment_count), (2, 1))
+        self.assertEqual(reconcile_counters(), (3, 0))
+        comment = Comment.objects.get(pk=self.pending[0].pk)
+        self.assertEqual((comment.moderated_by, comment.is_approved), (self.manager, True))
+        self.assertIsNotNone(comment.moderated_at)
+        self.assertFalse(Comment.objects.get(pk=self.foreign.pk).is_approved)
+        # Moderated comments are not moderated again
+        self.assertEqual(self.moderate('reject', self.pending).data['moderated'], 0)
+
+        for data in (
+            {'action': 'delete', 'ids': [1]}, {'action': 'approve', 'ids': []}, {'action': 'approve', 'ids': ['x']}
+        ):
+            response = self.client.post('/api/moderation/comments/moderate/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_public_comments_of_a_product(self):
+        self.moderate('approve', self.pending)
+        response = self.client.get(f'/api/products/{self.mug.id}/comments/?page_size=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['id'] for row in response.data['results']], [self.pending[2].pk])
+        self.assertEqual(response.data['results'][0]['user'], 'reviewer')
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['id'] for row in response.data['results']], [self.pending[0].pk])
+        self.assertEqual(self.client.get(f'/api/products/{self.elsewhere.id}/comments/').data['results'], [])
+        self.assertEqual(self.client.get('/api/products/999999/comments/').status_code, 404)
+
+    def test_queries_read_the_partial_indexes(self):
+        self.assertIn(
+            'comment_pending_shop_idx', moderation.pending(self.shop.id).order_by('created_at', 'id').explain()
+        )
+        self.assertIn(
+            'comment_approved_product_idx', moderation.approved(self.mug.id).order_by('-created_at', '-id').explain()
+        )
@@ -1,6 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CartViewSet, OrderViewSet, ProductViewSet, ShopViewSet, VendorOrderViewSet
+from . import async_views
+from .views import (
+    CartViewSet, CommentModerationViewSet, MetricsView, OrderViewSet, ProductViewSet, ShopViewSet,
+    VendorAnalyticsViewSet, VendorOrderViewSet,
+)
 
 
 
@@ -11,10 +15,18 @@ router.register(r'shops', ShopViewSet, basename='shop')
 router.register(r'cart', CartViewSet, basename='cart')
 router.register(r'orders', OrderViewSet, basename='order')
 router.register(r'vendor-orders', VendorOrderViewSet, basename='vendor-order')
+router.register(r'vendor-analytics', VendorAnalyticsViewSet, basename='vendor-analytics')
+router.register(r'moderation/comments', CommentModerationViewSet, basename='comment-moderation')
 
 app_name = 'shop'
 
 urlpatterns = [
     # This includes the auto-generated URLs (e.g., /products/, /products/1/, /shops/)
     path('', include(router.urls)),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    # Async (ASGI) versions of the hot read endpoints, see shop/async_views.py
+    path('async/products/', async_views.product_list, name='async-product-list'),
+    path('async/products/<int:pk>/', async_views.product_detail, name='async-product-detail'),
+    path('async/shops/', async_views.shop_list, name='async-shop-list'),
+    path('async/orders/', async_views.order_list, name='async-order-list'),
 ]
\ No newline at end of file
@@ -1,29 +1,191 @@
 from rest_framework import viewsets, permissions, status
 from .serializers import OrderSerializer, ProductSerializer, ShopSerializer, CartSerializer,ShopOrderSerializer, CartItemSerializer
+from .serializers import ProductListSerializer, check_fields, product_list_queryset, requested_fields, trim_fields
+from .serializers import CommentSerializer, ModerationCommentSerializer
+from .conditional import ConditionalGetMixin
+from .metrics import SerializerTimingMixin
+from .authentication import managed_shop_id
 from .permissions import IsShopManager
+from .pagination import (
+    CommentCursorPagination, ModerationQueuePagination, OrderCursorPagination, ProductCursorPagination, RankedPagination
+)
+from .search import search_product_ids
+from .filters import ProductFilter, ProductFilterBackend
+from .cache import catalog_cache
+from .pricing import pricing_engine
 from .models import Cart, CartItem, Product, Shop, Order, ShopOrder, OrderDetail
+from . import exports, metrics
+from .services import analytics, idempotency, moderation, product_import
+from .services.cart import CART_ITEMS_PREFETCH, CartBusyError, InvalidQuantityError, cart_store, parse_lines
+from .services.checkout import EmptyCartError, checkout_cart
+from .services.inventory import InsufficientStockError
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, PermissionDenied
 from rest_framework.response import Response
-from django.db import transaction
+from rest_framework.views import APIView
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_date
+from datetime import timedelta
 
-class ProductViewSet(viewsets.ModelViewSet):
+
+class ProductViewSet(SerializerTimingMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     Handles viewing products (Public) and editing (Managers Only).
     """
-    queryset = Product.objects.all().prefetch_related('images')
+    queryset = Product.objects.select_related('shop').prefetch_related('images')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    filter_backends = [ProductFilterBackend]
+    # The payload embeds the shop name
+    validator_fields = ('updated_at', 'shop__updated_at')
 
     def get_permissions(self):
         # Allow anyone to view list/detail, but require manager for changes
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'bulk_import']:
             return [permissions.IsAuthenticated(), IsShopManager()]
         return [permissions.AllowAny()]
 
+    def get_queryset(self):
+        # Listings render compact product cards (see ProductListSerializer)
+        if self.action == 'list':
+            return product_list_queryset()
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProductListSerializer
+        if self.action == 'comments':
+            return CommentSerializer
+        return super().get_serializer_class()
+
+    @cached_property
+    def prices(self):
+        # One discount index per request: the payload, cache keys and ETag agree
+        return pricing_engine.index()
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'prices': self.prices}
+
+    def get_validators(self):
+        # Every write that can change a list page bumps the catalog cache version,
+        # which is cheaper to read than aggregating over the filtered catalog. A
+        # per-process backend holds per-process versions: list() validates the
+        # page by its body instead (see content_validated_response).
+        if self.action == 'list':
+            if not catalog_cache.shares_versions:
+                return None
+            return [catalog_cache.catalog_version(), self.prices.token], None
+        validators = super().get_validators()
+        if validators is None:
+            return None
+        parts, last_modified = validators
+        if last_modified is not None:
+            last_modified = max(last_modified, self.prices.changed_at)
+        return [*parts, self.prices.token], last_modified
+
     def perform_create(self, serializer):
         # Automatically set the product's shop to the manager's assigned shop
-        serializer.save(shop=self.request.user.manager_profile.shop)
+        shop_id = managed_shop_id(self.request.user)
+        if shop_id is None:
+            raise PermissionDenied("Only shop managers can add products")
+        serializer.save(shop=Shop.objects.get(pk=shop_id))
+
+    def list(self, request, *args, **kwargs):
+        # Pages are cached per full URI (filters, cursor and page size included)
+        # and per set of active discounts
+        data = catalog_cache.get_list(
+            f'{request.build_absolute_uri()}|{self.prices.token}',
+            lambda: self._list_payload(request, *args, **kwargs)
+        )
+        if not catalog_cache.shares_versions:
+            return self.content_validated_response(request, data)
+        return Response(data)
+
+    def _list_payload(self, request, *args, **kwargs):
+        data = super().list(request, *args, **kwargs).data
+        # Counts per category/brand/shop/price band/stock for the filtered result set
+        data['facets'] = ProductFilter(request.query_params).facet_counts(Product.objects.all())
+        return data
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """
+        Full-text search over name, description, category and brand,
+        ranked by relevance: /api/products/search/?q=red+shoes
+        """
+        paginator = RankedPagination()
+        limit, offset = paginator.get_window(request)
+        ids, has_more, truncated = search_product_ids(request.query_params.get('q', ''), limit, offset)
+
+        products = self.get_queryset().in_bulk(ids)
+        ranked = [products[pk] for pk in ids if pk in products]
+        data = self.get_serializer(ranked, many=True).data
+        return paginator.get_paginated_response(data, has_more, truncated)
+
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request):
+        """
+        Upserts products into the manager's shop by sku from an uploaded CSV or
+        NDJSON file (multipart field "file"; ?type= overrides the file extension).
+        Returns a per-row error report.
+        """
+        shop_id = managed_shop_id(request.user)
+        if shop_id is None:
+            return Response({'error': 'Only shop managers can import products'}, status=status.HTTP_403_FORBIDDEN)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Upload the catalog as "file"'}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.query_params.get('type') or upload.name.rpartition('.')[2].lower()
+        if file_format not in product_import.FORMATS:
+            return Response(
+                {'error': f"type must be one of {', '.join(product_import.FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        lines = product_import.decode_lines(upload.file)
+        try:
+            report = product_import.import_products(shop_id, product_import.read_rows(lines, file_format))
+        except product_import.UnreadableFileError as exc:
+            return Response(exc.as_dict(), status=status.HTTP_400_BAD_REQUEST)
+        return Response(report.as_dict())
+
+    @action(detail=True, methods=['get'])
+    def comments(self, request, pk=None):
+        """Approved comments, newest first, in keyset pages read from a partial index."""
+        try:
+            product_id = int(pk)
+        except ValueError:
+            raise NotFound()
+        paginator = CommentCursorPagination()
+        page = paginator.paginate_queryset(moderation.approved(product_id).select_related('user'), request)
+        # An empty first page is the only case that needs telling "no comments" from "no product"
+        if not page and paginator.position is None and not Product.objects.filter(pk=product_id).exists():
+            raise NotFound()
+        return paginator.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    def retrieve(self, request, *args, **kwargs):
+        # The cache holds the full payload; ?fields= is applied on the way out
+        context = self.get_serializer_context()
+        # "01" and "1" are the same product: key the cache by the canonical id
+        try:
+            product_id = int(self.kwargs[self.lookup_field])
+        except ValueError:
+            raise NotFound()
+        data = catalog_cache.get_product(
+            str(product_id),
+            lambda: self.get_serializer(self.get_object(), context={**context, 'sparse': False}).data,
+            variant=self.prices.token
+        )
+        requested = requested_fields(context)
+        if requested is not None:
+            check_fields(requested, data)
+            data = trim_fields(data, requested)
+        return Response(data)
 
-class ShopViewSet(viewsets.ModelViewSet):
+class ShopViewSet(SerializerTimingMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     Handles viewing shops (Public) and editing shop profile (Managers Only).
     """
@@ -36,125 +198,144 @@ class ShopViewSet(viewsets.ModelViewSet):
             return [permissions.IsAuthenticated(), IsShopManager()]
         return [permissions.AllowAny()]
 
-class CartViewSet(viewsets.ModelViewSet):
+class CartViewSet(SerializerTimingMixin, viewsets.ModelViewSet):
     serializer_class = CartSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        # Using get_or_create ensures the user always has a cart object
-        Cart.objects.get_or_create(user=self.request.user)
-        return Cart.objects.filter(user=self.request.user)
+        return Cart.objects.filter(user=self.request.user).prefetch_related(CART_ITEMS_PREFETCH)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, CartBusyError):
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        return super().handle_exception(exc)
+
+    def list(self, request, *args, **kwargs):
+        cart_store().flush(request.user.pk)
+        carts = list(self.get_queryset())
+        if not carts:
+            # The user always sees a cart, created on first visit
+            cart, _ = Cart.objects.get_or_create(user=request.user)
+            carts = [cart]
+        return Response(self.get_serializer(carts, many=True).data)
 
     @action(detail=False, methods=['post'])
     def add_item(self, request):
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-        product_id = request.data.get('product_id')
-        
+        """
+        Adds quantity (default 1) of a product in one statement and returns the
+        cart. Clients that only need the new quantity can use POST items/.
+        """
         try:
-            quantity = int(request.data.get('quantity', 1))
-            product = Product.objects.get(id=product_id)
-        except (Product.DoesNotExist, TypeError, ValueError):
+            quantities = parse_lines([request.data], minimum=1)
+        except InvalidQuantityError:
             return Response({"error": "Valid Product ID and Quantity required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        item, created = CartItem.objects.get_or_create(cart=cart, product=product)
-        if not created:
-            item.quantity += quantity
-        else:
-            item.quantity = quantity
-        item.save()
+        (product_id, _), = quantities.items()
+        store = cart_store()
+        result = store.add_lines(request.user.pk, quantities)
+        if product_id not in result:
+            return Response({"error": "Valid Product ID and Quantity required"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.get_serializer(store.cart(request.user.pk)).data, status=status.HTTP_200_OK)
 
-        return Response(CartSerializer(cart).data, status=status.HTTP_200_OK)
+    @action(detail=False, methods=['post'], url_path='items')
+    def update_items(self, request):
+        """
+        Adds or sets several lines at once:
+        {"mode": "add" | "set", "items": [{"product_id": 1, "quantity": 2}, ...]}
+        In "set" mode a quantity of 0 removes the line.
+        """
+        mode = request.data.get('mode', 'add')
+        lines = request.data.get('items')
+        if mode not in ('add', 'set') or not isinstance(lines, list) or not lines:
+            return Response(
+                {"error": 'Expected {"mode": "add" | "set", "items": [...]}'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            quantities = parse_lines(lines, minimum=1 if mode == 'add' else 0)
+        except InvalidQuantityError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        store = cart_store()
+        if mode == 'add':
+            result = store.add_lines(request.user.pk, quantities)
+        else:
+            result = store.set_lines(request.user.pk, quantities)
+        return Response({
+            "items": [{"product": pid, "quantity": quantity} for pid, quantity in result.items()],
+            "unknown_products": [pid for pid in quantities if pid not in result],
+        })
 
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
-        product_id = request.data.get('product_id')
         try:
-            item = CartItem.objects.get(cart__user=request.user, product_id=product_id)
-            item.delete()
-            return Response({"message": "Item removed"}, status=status.HTTP_204_NO_CONTENT)
-        except CartItem.DoesNotExist:
+            product_id = int(request.data.get('product_id'))
+        except (TypeError, ValueError):
             return Response({"error": "Item not found in cart"}, status=status.HTTP_404_NOT_FOUND)
+        if cart_store().remove(request.user.pk, product_id):
+            return Response({"message": "Item removed"}, status=status.HTTP_204_NO_CONTENT)
+        return Response({"error": "Item not found in cart"}, status=status.HTTP_404_NOT_FOUND)
 
     @action(detail=False, methods=['post'])
     def checkout(self, request):
+        """
+        Places the order. Clients that may retry send an Idempotency-Key header:
+        repeats of a key get the first response back (header Idempotent-Replayed)
+        instead of a second checkout.
+        """
+        key = request.headers.get(idempotency.HEADER)
+        if key is None:
+            return self._checkout(request)
+        try:
+            status_code, data, replayed = idempotency.run_once(
+                request.user.pk, key, request.path, lambda: self._checkout(request)
+            )
+        except idempotency.IdempotencyError as exc:
+            return Response({"error": str(exc)}, status=exc.status_code)
+        response = Response(data, status=status_code)
+        if replayed:
+            response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def _checkout(self, request):
+        store = cart_store()
+        store.flush(request.user.pk)
         try:
             cart = Cart.objects.get(user=request.user)
         except Cart.DoesNotExist:
             return Response({"error": "Cart not found"}, status=status.HTTP_404_NOT_FOUND)
 
-        cart_items = cart.items.all()
-        if not cart_items.exists():
-            return Response({"error": "Cart is empty"}, status=status.HTTP_400_BAD_REQUEST)
-
-        with transaction.atomic():
-            # 1. Create Parent Order
-            main_order = Order.objects.create(
-                user=request.user,
-                total_amount=0, 
-                status='pending'
-            )
-
-            total_amount = 0
-            shop_orders = {}
-
-            # 2. Process items and group by Shop
-            for item in cart_items:
-                product = item.product
-                shop = product.shop
-                line_total = item.quantity * product.price
-
-                if shop.id not in shop_orders:
-                    shop_orders[shop.id] = ShopOrder.objects.create(
-                        main_order=main_order,
-                        shop=shop,
-                        shop_total=0,
-                        status='pending'
-                    )
-
-                # 3. Create OrderDetail (Line Item)
-                OrderDetail.objects.create(
-                    order=main_order,
-                    shop_order=shop_orders[shop.id],
-                    product=product,
-                    quantity=item.quantity,
-                    price=product.price
-                )
-
-                # Update running totals
-                shop_orders[shop.id].shop_total += line_total
-                total_amount += line_total
-
-            # 4. Save ShopOrder totals and Main Order total
-            for s_order in shop_orders.values():
-                s_order.save()
-
-            main_order.total_amount = total_amount
-            main_order.save()
-
-            # 5. Clear Cart
-            cart_items.delete()
+        try:
+            result = checkout_cart(cart)
+        except EmptyCartError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except InsufficientStockError as exc:
+            return Response(exc.as_dict(), status=status.HTTP_409_CONFLICT)
+        store.discard(request.user.pk)
 
         return Response({
             "message": "Order created successfully",
-            "order_id": main_order.id,
-            "total_amount": main_order.total_amount,
-            "shop_orders_count": len(shop_orders)
+            "order_id": result.order.id,
+            "total_amount": result.order.total_amount,
+            "shop_orders_count": len(result.shop_orders)
         }, status=status.HTTP_201_CREATED)
 
-class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+class OrderViewSet(SerializerTimingMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     """
     Users can view their own order history and specific order details.
     """
     serializer_class = OrderSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
+    # Vendors move the embedded shop orders through their statuses
+    validator_fields = ('updated_at', 'shop_orders__updated_at')
 
     def get_queryset(self):
         return Order.objects.filter(user=self.request.user).prefetch_related(
-            'shop_orders__items', 
-            'shop_orders__shop'
+            Prefetch('shop_orders', queryset=ShopOrder.objects.select_related('shop')),
+            Prefetch('shop_orders__items', queryset=OrderDetail.objects.select_related('product')),
         )
 
-class VendorOrderViewSet(viewsets.ModelViewSet):
+class VendorOrderViewSet(SerializerTimingMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ViewSet for Shop Managers to manage orders specific to their shop.
     """
@@ -163,7 +344,11 @@ class VendorOrderViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         # Filter shop orders by the shop owned/managed by the current user
-        return ShopOrder.objects.filter(shop__manager_profile__user=self.request.user)
+        return ShopOrder.objects.filter(shop_id=managed_shop_id(self.request.user)).select_related(
+            'shop'
+        ).prefetch_related(
+            Prefetch('items', queryset=OrderDetail.objects.select_related('product'))
+        )
 
     @action(detail=True, methods=['post'])
     def update_status(self, request, pk=None):
@@ -178,4 +363,110 @@ class VendorOrderViewSet(viewsets.ModelViewSet):
             shop_order.save()
             return Response({'status': 'order status updated'})
         
-        return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Streams the shop's order lines as ?type=csv (default) or ?type=ndjson.
+        Rows are encoded directly from a database iterator, bypassing the serializers.
+        """
+        shop_id = managed_shop_id(request.user)
+        if shop_id is None:
+            return Response({'error': 'Only shop managers can export orders'}, status=status.HTTP_403_FORBIDDEN)
+        file_format = request.query_params.get('type', 'csv')
+        if file_format not in exports.ENCODERS:
+            return Response(
+                {'error': f"type must be one of {', '.join(exports.ENCODERS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(
+            exports.export_orders(shop_id, file_format),
+            content_type=exports.CONTENT_TYPES[file_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="shop-{shop_id}-orders.{file_format}"'
+        return response
+
+
+class CommentModerationViewSet(SerializerTimingMixin, viewsets.GenericViewSet):
+    """
+    The manager's queue of pending comments, oldest first, and bulk moderation:
+    POST moderate/ {"action": "approve" | "reject", "ids": [1, 2, ...]}
+    """
+    serializer_class = ModerationCommentSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ModerationQueuePagination
+
+    def get_queryset(self):
+        return moderation.pending(managed_shop_id(self.request.user)).select_related('product', 'user')
+
+    def list(self, request):
+        if managed_shop_id(request.user) is None:
+            return Response({'error': 'Only shop managers can moderate comments'}, status=status.HTTP_403_FORBIDDEN)
+        page = self.paginate_queryset(self.get_queryset())
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    @action(detail=False, methods=['post'])
+    def moderate(self, request):
+        """Approves or rejects up to MAX_BULK_COMMENTS pending comments in one statement."""
+        shop_id = managed_shop_id(request.user)
+        if shop_id is None:
+            return Response({'error': 'Only shop managers can moderate comments'}, status=status.HTTP_403_FORBIDDEN)
+        verdict = request.data.get('action')
+        ids = request.data.get('ids')
+        if verdict not in moderation.ACTIONS or not isinstance(ids, list) or not ids:
+            return Response(
+                {'error': 'Expected {"action": "approve" | "reject", "ids": [...]}'}, status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(ids) > moderation.MAX_BULK_COMMENTS:
+            return Response(
+                {'error': f"At most {moderation.MAX_BULK_COMMENTS} comments per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = {int(pk) for pk in ids}
+        except (TypeError, ValueError):
+            return Response({'error': 'ids must be comment ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        moderated = moderation.moderate(shop_id, request.user.manager_profile.pk, ids, verdict)
+        return Response({'action': verdict, 'moderated': moderated, 'skipped': len(ids) - moderated})
+
+
+class VendorAnalyticsViewSet(viewsets.ViewSet):
+    """
+    Sales analytics for the manager's shop, read from the daily rollups.
+    Optional ?from=YYYY-MM-DD&to=YYYY-MM-DD (defaults to the last 30 days).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        shop_id = managed_shop_id(request.user)
+        if shop_id is None:
+            return Response({'error': 'Only shop managers can view analytics'}, status=status.HTTP_403_FORBIDDEN)
+
+        try:
+            date_to = self._date_param(request, 'to') or timezone.localdate()
+            date_from = self._date_param(request, 'from') or date_to - timedelta(days=29)
+        except ValueError:
+            return Response({'error': 'Dates must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(analytics.dashboard(shop_id, date_from, date_to))
+
+    @staticmethod
+    def _date_param(request, name):
+        raw = request.query_params.get(name)
+        if not raw:
+            return None
+        value = parse_date(raw)
+        if value is None:
+            raise ValueError(raw)
+        return value
+
+
+class MetricsView(APIView):
+    """Per-route request metrics in Prometheus text format (see shop/metrics.py)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)